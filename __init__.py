@@ -1,4 +1,7 @@
 from .flircam_hw import FlirCamHW
 from .flircam_live_measure import FlirCamLiveMeasure
+from .flircam_record_measure import FlirCamRecordMeasure
+from .flircam_average_measure import FlirCamAverageMeasure
+from .flircam_spot_measure import FlirCamSpotMeasure
 from .flircam_interface import FlirCamInterface
 from . import flircam_consts
\ No newline at end of file
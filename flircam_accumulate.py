@@ -0,0 +1,169 @@
+"""
+In-place frame accumulation with dark and flat-field correction.
+
+    acc = FrameAccumulator(dtype=np.float32, variance=True)
+    acc.set_dark(dark)          # optional, subtracted from every frame
+    acc.set_flat(flat)          # optional, gain map from a (raw) flat frame
+    for frame in frames:
+        acc.add(frame)
+    acc.mean, acc.variance, acc.sum
+
+Accumulators and scratch buffers are allocated from the first frame and
+reused (reset() only zeroes them), every add() is a fixed sequence of
+in-place ufuncs, no per-frame allocation. The arrays returned by sum,
+mean and variance are the same buffers from frame to frame.
+
+Correction: corrected = (frame - dark)*gain, with the gain map
+    gain = mean(flat - dark)/(flat - dark)
+pixels with flat - dark <= 0 (dead pixels) keep a gain of 1.
+
+Variance uses Welford's update, numerically stable also in float32:
+    d = x - mean;  mean += d/n;  m2 += d*d*(n - 1)/n
+"""
+import numpy as np
+
+ACCUMULATOR_DTYPES = ('float32', 'float64')
+
+
+class FrameAccumulator(object):
+    """
+    Running sum, mean and optionally variance of frames of equal shape,
+    see module docstring. Not thread safe, add() and the results are
+    meant to be used from one thread.
+    """
+
+    def __init__(self, dtype=np.float64, variance=False):
+        self.dtype = np.dtype(dtype)
+        self.track_variance = variance
+        self.shape = None
+        self.dark = None
+        self.gain = None
+        self.n = 0
+        # corrections in effect for the frames accumulated since reset()
+        self._dark = None
+        self._gain = None
+
+    def set_dark(self, dark):
+        "dark frame subtracted from every frame, None to disable. Applies from the next reset()"
+        self.dark = None if dark is None else np.array(dark, dtype=self.dtype)
+
+    def set_flat(self, flat, dark_subtracted=False):
+        """
+        Gain map from flat frame flat, None to disable. Unless
+        dark_subtracted, the current dark frame is subtracted first.
+        Applies from the next reset().
+        """
+        if flat is None:
+            self.gain = None
+            return
+        d = np.array(flat, dtype=np.float64)
+        if self.dark is not None and not dark_subtracted:
+            d -= self.dark
+        good = d > 0
+        if not good.any():
+            raise ValueError("flat frame has no pixels above the dark level")
+        gain = np.ones(d.shape, dtype=self.dtype)
+        gain[good] = d[good].mean()/d[good]
+        self.gain = gain
+
+    def allocate(self, shape):
+        "(re)allocate the buffers for frames of shape, keeps them if the shape did not change"
+        shape = tuple(shape)
+        for name, m in (('dark', self.dark), ('flat', self.gain)):
+            if m is not None and m.shape != shape:
+                raise ValueError("{} shape {} does not match frame shape {}".format(name, m.shape, shape))
+        if shape != self.shape:
+            self.shape = shape
+            self._sum = np.zeros(shape, dtype=self.dtype)
+            self._mean = np.zeros(shape, dtype=self.dtype)
+            self._x = np.zeros(shape, dtype=self.dtype)
+            self._d = None
+            self._m2 = None
+            self._var = None
+        if self.track_variance and self._m2 is None:
+            self._d = np.zeros(shape, dtype=self.dtype)
+            self._m2 = np.zeros(shape, dtype=self.dtype)
+            self._var = np.zeros(shape, dtype=self.dtype)
+        self.reset()
+
+    def reset(self):
+        "start over, keeps buffers and corrections"
+        self.n = 0
+        self._dark = self.dark
+        self._gain = self.gain
+        if self.shape is None:
+            return
+        self._sum.fill(0)
+        self._mean.fill(0)
+        if self.track_variance:
+            self._m2.fill(0)
+
+    def correct(self, frame, out):
+        "Writes the dark and flat corrected frame to out (accumulator dtype)"
+        if self._dark is not None:
+            np.subtract(frame, self._dark, out=out, casting='unsafe')
+        else:
+            np.copyto(out, frame, casting='unsafe')
+        if self._gain is not None:
+            np.multiply(out, self._gain, out=out)
+        return out
+
+    def add(self, frame):
+        "Accumulate frame (any numeric dtype, the shape of the first frame)"
+        if self.shape is None:
+            self.allocate(frame.shape)
+        elif frame.shape != self.shape:
+            raise ValueError("frame shape {} does not match accumulator shape {}".format(
+                frame.shape, self.shape))
+        self.n += 1
+        if self._dark is None and self._gain is None and not self.track_variance:
+            np.add(self._sum, frame, out=self._sum, casting='unsafe')
+            return
+        x = self.correct(frame, self._x)
+        np.add(self._sum, x, out=self._sum)
+        if self.track_variance:
+            n = self.n
+            d = self._d
+            np.subtract(x, self._mean, out=d)
+            # x is free now: d/n, then d*d*(n - 1)/n
+            np.multiply(d, 1.0/n, out=x)
+            np.add(self._mean, x, out=self._mean)
+            np.multiply(x, d, out=x)
+            np.multiply(x, n - 1, out=x)
+            np.add(self._m2, x, out=self._m2)
+
+    @property
+    def dark_applied(self):
+        return self._dark is not None
+
+    @property
+    def flat_applied(self):
+        return self._gain is not None
+
+    @property
+    def sum(self):
+        return self._sum
+
+    @property
+    def mean(self):
+        "mean frame, zeros before the first frame"
+        if self.shape is None:
+            return None
+        if not self.track_variance and self.n:
+            np.multiply(self._sum, 1.0/self.n, out=self._mean)
+        return self._mean
+
+    @property
+    def variance(self):
+        "sample variance (ddof=1), None without variance tracking or with fewer than 2 frames"
+        if not self.track_variance or self.n < 2:
+            return None
+        np.multiply(self._m2, 1.0/(self.n - 1), out=self._var)
+        return self._var
+
+    @property
+    def std(self):
+        var = self.variance
+        if var is None:
+            return None
+        return np.sqrt(var)
@@ -0,0 +1,160 @@
+from ScopeFoundry import Measurement, h5_io
+import pyqtgraph as pg
+import numpy as np
+import time
+from .flircam_accumulate import FrameAccumulator, ACCUMULATOR_DTYPES
+
+
+class FlirCamAverageMeasure(Measurement):
+    """
+    Averages n_frames frames of the flircam hardware with a
+    FrameAccumulator (see flircam_accumulate), optionally dark subtracted
+    and flat-field corrected, and saves mean (and variance) to HDF5.
+
+    Frames are read from the hardware frame ring on the measurement
+    thread, frames overwritten before they were accumulated are counted
+    in frames_missed. Dark and flat maps are taken from the mean of a
+    previous run with the use_as_dark / use_as_flat operations.
+    """
+
+    name = 'flircam_average'
+
+    def setup(self):
+        S = self.settings
+        S.New('n_frames', dtype=int, initial=100, vmin=1)
+        S.New('accumulator_dtype', dtype=str, initial='float64', choices=ACCUMULATOR_DTYPES)
+        S.New('variance', dtype=bool, initial=False,
+              description='per-pixel variance (Welford), saved with the mean')
+        S.New('dark_subtract', dtype=bool, initial=False)
+        S.New('flat_field', dtype=bool, initial=False)
+        S.New('has_dark', dtype=bool, ro=True)
+        S.New('has_flat', dtype=bool, ro=True)
+        S.New('save_h5', dtype=bool, initial=True)
+        S.New('frames_accumulated', dtype=int, ro=True)
+        S.New('frames_missed', dtype=int, ro=True,
+              description='frames overwritten in the frame ring before they were accumulated')
+        S.New('t_add', dtype=float, unit='ms', spinbox_decimals=3, ro=True,
+              description='mean accumulation time per frame')
+        S.New('frame_period', dtype=float, unit='ms', spinbox_decimals=3, ro=True)
+
+        self.add_operation('use_as_dark', self.use_as_dark)
+        self.add_operation('use_as_flat', self.use_as_flat)
+        self.add_operation('clear_dark_flat', self.clear_dark_flat)
+
+        self.acc = None
+        self.dark = None
+        self.flat = None
+        self.hw = self.app.hardware['flircam']
+
+    def setup_figure(self):
+        self.ui = self.graph_layout = pg.GraphicsLayoutWidget()
+        self.plot = self.graph_layout.addPlot()
+        self.img_item = pg.ImageItem()
+        self.plot.addItem(self.img_item)
+        self.plot.setAspectLocked(lock=True, ratio=1)
+        self.display_update_period = 0.1
+
+    def get_accumulator(self):
+        "FrameAccumulator for the current settings, reused (with its buffers) when they did not change"
+        S = self.settings
+        acc = self.acc
+        if acc is None or acc.dtype != np.dtype(S['accumulator_dtype']) \
+                or acc.track_variance != S['variance']:
+            acc = FrameAccumulator(S['accumulator_dtype'], variance=S['variance'])
+        acc.set_dark(self.dark if S['dark_subtract'] else None)
+        acc.set_flat(self.flat if S['flat_field'] else None, dark_subtracted=True)
+        return acc
+
+    def run(self):
+        S = self.settings
+        if not self.hw.settings['connected']:
+            self.hw.settings['connected'] = True
+        self.acc = acc = self.get_accumulator()
+        acc.reset()
+        S['frames_accumulated'] = 0
+        S['frames_missed'] = 0
+
+        cursor = self.hw.frame_ring.new_cursor('next', name=self.name)
+        t_add = 0.0
+        try:
+            while not self.interrupt_measurement_called and acc.n < S['n_frames']:
+                frame = cursor.get_frame()
+                if frame is None:
+                    time.sleep(0.001)
+                    continue
+                t0 = time.perf_counter()
+                if acc.n == 0:
+                    acc.allocate(frame.shape)
+                acc.add(frame)
+                t_add += time.perf_counter() - t0
+                del frame
+                if acc.n % 10 == 0 or acc.n == S['n_frames']:
+                    S['frames_accumulated'] = acc.n
+                    S['frames_missed'] = cursor.n_missed
+                    S['t_add'] = 1e3*t_add/acc.n
+                    rate = self.hw.settings['frame_rate_camera']
+                    if rate > 0:
+                        S['frame_period'] = 1e3/rate
+                    self.set_progress(100.0*acc.n/S['n_frames'])
+        finally:
+            self.hw.frame_ring.remove_cursor(cursor)
+        S['frames_accumulated'] = acc.n
+        S['frames_missed'] = cursor.n_missed
+
+        if S['save_h5'] and acc.n:
+            self.save_h5()
+
+    def save_h5(self):
+        acc = self.acc
+        h5file = h5_io.h5_base_file(app=self.app, measurement=self)
+        try:
+            M = h5_io.h5_create_measurement_group(self, h5file)
+            M['mean'] = acc.mean
+            M['sum'] = acc.sum
+            M.attrs['n_frames'] = acc.n
+            if acc.variance is not None:
+                M['variance'] = acc.variance
+            if acc.dark_applied:
+                M['dark'] = acc.dark
+            if acc.flat_applied:
+                M['flat_gain'] = acc.gain
+        finally:
+            h5file.close()
+
+    def update_display(self):
+        if self.acc is None or self.acc.n == 0:
+            return
+        mean = self.acc.mean
+        if mean is not None:
+            self.img_item.setImage(mean.swapaxes(0, 1), autoLevels=True)
+
+    def use_as_dark(self):
+        "mean of the last run becomes the dark frame"
+        if self.acc is None or self.acc.n == 0:
+            print(self.name, 'no frames accumulated')
+            return
+        if self.acc.dark_applied or self.acc.flat_applied:
+            print(self.name, 'last run was corrected, not used as dark frame')
+            return
+        self.dark = self.acc.mean.copy()
+        self.settings['has_dark'] = True
+
+    def use_as_flat(self):
+        "mean of the last run becomes the flat frame (dark subtracted if it was)"
+        if self.acc is None or self.acc.n == 0:
+            print(self.name, 'no frames accumulated')
+            return
+        if self.acc.flat_applied:
+            print(self.name, 'last run was flat-field corrected, not used as flat frame')
+            return
+        flat = self.acc.mean.copy()
+        if not self.acc.dark_applied and self.dark is not None:
+            flat -= self.dark
+        self.flat = flat
+        self.settings['has_flat'] = True
+
+    def clear_dark_flat(self):
+        self.dark = None
+        self.flat = None
+        self.settings['has_dark'] = False
+        self.settings['has_flat'] = False
@@ -0,0 +1,371 @@
+"""
+Acquisition throughput and latency benchmarks.
+
+Runs against the simulated SpinnakerC backend (flircam_sim_lib) with
+realtime=False, so the numbers measure the cost of the host side code
+only: FlirCamInterface.get_image for each pixel format branch, the
+per-frame work of FlirCamHW.grab_frame, of the display worker
+(flircam_display) and of FlirCamLiveMeasure.update_display on the GUI
+thread for several downsample_view values. SpinnakerC calls per frame are
+counted with CallCountingLib.
+
+Results are written as JSON and can be compared against a stored
+baseline, a benchmark regresses when its per-frame time (or call count)
+grows by more than the tolerance:
+
+    python -m ScopeFoundryHW.flircam.flircam_benchmark --out bench.json
+    python -m ScopeFoundryHW.flircam.flircam_benchmark --save-baseline
+    python -m ScopeFoundryHW.flircam.flircam_benchmark --baseline
+
+Timings depend on the machine, so no baseline is shipped: save one on
+the machine the comparisons run on first, --baseline without a path
+uses flircam_benchmark_baseline.json next to this module.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import types
+import numpy as np
+
+from .flircam_interface import FlirCamInterface
+from .flircam_sim_lib import SimSpinnakerLib
+from .flircam_frame_ring import FrameRing
+from .flircam_pipeline import FramePipeline
+from .flircam_latency import LatencyTracker
+from .flircam_demosaic import DEMOSAIC_MODES
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'flircam_benchmark_baseline.json')
+
+# get_image branches: name -> pixel format of the simulated camera
+GET_IMAGE_BRANCHES = [('RGB8', 'RGB8'),
+                      ('Mono8', 'Mono8'),
+                      ('8bit', 'BayerRG8'),
+                      ('16bit', 'Mono16'),
+                      ('Mono12p', 'Mono12p'),
+                      ('Mono12Packed', 'Mono12Packed'),
+                      ('Mono10p', 'Mono10p'),
+                      ('Mono10Packed', 'Mono10Packed')]
+
+DOWNSAMPLE_VIEWS = (1, 2, 4)
+
+
+class CallCountingLib(object):
+    "Wraps a SpinnakerC library object and counts calls per function"
+
+    def __init__(self, lib):
+        self._lib = lib
+        self.counts = dict()
+
+    def __getattr__(self, name):
+        func = getattr(self._lib, name)
+        if not name.startswith('spin'):
+            return func
+        counts = self.counts
+
+        def counted(*args):
+            counts[name] = counts.get(name, 0) + 1
+            return func(*args)
+        counted.__name__ = name
+        # cache on the instance, __getattr__ is only hit once per name
+        setattr(self, name, counted)
+        return counted
+
+    def total(self):
+        return sum(self.counts.values())
+
+    def reset(self):
+        self.counts.clear()
+
+
+def make_camera(pixel_format, width, height):
+    lib = CallCountingLib(SimSpinnakerLib(width=width, height=height,
+                                          pixel_format=pixel_format,
+                                          frame_rate=None, realtime=False))
+    cam = FlirCamInterface(lib=lib)
+    return cam, lib
+
+
+def make_bench_hw(cam):
+    """
+    object that FlirCamHW.grab_frame can run on, without ScopeFoundry app.
+    Its settings are the ones grab_frame reads
+    """
+    from ScopeFoundry.logged_quantity import LQCollection
+    from .flircam_hw import IMAGE_BUFFER_SIZE
+    hw = types.SimpleNamespace()
+    hw.name = 'flircam'
+    hw.cam = cam
+    hw.frame_ring = FrameRing(IMAGE_BUFFER_SIZE, pool=cam.frame_pool)
+    hw.frame_consumers = []
+    hw.pipeline = FramePipeline(pool=cam.frame_pool)
+    hw.latency = LatencyTracker()
+    hw.settings = LQCollection()
+    hw.settings.New('acquiring', dtype=bool, initial=True)
+    hw.settings.New('debug_mode', dtype=bool, initial=False)
+    hw.settings.New('grab_timeout', dtype=float, initial=1.0, unit='s')
+    return hw
+
+
+def _summary(times, lib=None, n_frames=None):
+    t = np.asarray(times)
+    res = dict(n=int(t.size),
+               per_frame_s=float(t.mean()),
+               p50_s=float(np.percentile(t, 50)),
+               p95_s=float(np.percentile(t, 95)),
+               p99_s=float(np.percentile(t, 99)),
+               fps=float(1.0/t.mean()))
+    if lib is not None:
+        res['calls_per_frame'] = lib.total()/float(n_frames or t.size)
+        res['calls'] = dict(lib.counts)
+    return res
+
+
+def bench_get_image(pixel_format, n_frames=200, width=1920, height=1200, warmup=10,
+                    demosaic=None):
+    cam, lib = make_camera(pixel_format, width, height)
+    cam.set_demosaic(demosaic)
+    cam.start_acquisition()
+    try:
+        for i in range(warmup):
+            cam.frame_pool.release(cam.get_image())
+        lib.reset()
+        times = []
+        for i in range(n_frames):
+            t0 = time.perf_counter()
+            img = cam.get_image()
+            times.append(time.perf_counter() - t0)
+            cam.frame_pool.release(img)
+        return _summary(times, lib, n_frames)
+    finally:
+        cam.stop_acquisition()
+        cam.release_camera()
+        cam.release_system()
+
+
+def bench_grab_frame(pixel_format='RGB8', n_frames=200, width=1920, height=1200, warmup=10):
+    from .flircam_hw import FlirCamHW
+    cam, lib = make_camera(pixel_format, width, height)
+    hw = make_bench_hw(cam)
+    cam.start_acquisition()
+    try:
+        for i in range(warmup):
+            FlirCamHW.grab_frame(hw)
+        lib.reset()
+        times = []
+        for i in range(n_frames):
+            t0 = time.perf_counter()
+            FlirCamHW.grab_frame(hw)
+            times.append(time.perf_counter() - t0)
+        return _summary(times, lib, n_frames)
+    finally:
+        cam.stop_acquisition()
+        cam.release_camera()
+        cam.release_system()
+
+
+def make_bench_live_measure(hw, downsample_view=1, display_downsample='stride', 
+                            auto_level=False):
+    """
+    object that FlirCamLiveMeasure.update_display can run on, with a display worker.
+    Its settings are the live measure's own (setup_display_settings)
+    """
+    import pyqtgraph as pg
+    from ScopeFoundry.logged_quantity import LQCollection
+    from .flircam_display import DisplayWorker
+    from .flircam_live_measure import FlirCamLiveMeasure
+    pg.mkQApp()
+    m = types.SimpleNamespace()
+    m.name = 'flircam_live'
+    m.hw = hw
+    m.img_item = pg.ImageItem()
+    m.settings = LQCollection()
+    FlirCamLiveMeasure.setup_display_settings(m.settings)
+    m.settings['auto_level'] = auto_level
+    m.settings['downsample_view'] = downsample_view
+    m.settings['fit_viewport'] = False
+    m.settings['display_downsample'] = display_downsample
+    m.display_update_period = 0.01
+    m.display_seq = None
+    m.display_transform = None
+    for attr in ('get_roi_offset',):
+        setattr(m, attr, types.MethodType(getattr(FlirCamLiveMeasure, attr), m))
+    m.display_ds = 1
+    # not started, frames are prepared synchronously with process_latest()
+    m.display_worker = DisplayWorker(hw.frame_ring, name=m.name + '_display')
+    return m
+
+
+def check_display_shape(out, ds, mode):
+    "the worker must have prepared its frame at decimation ds, else the numbers are meaningless"
+    h, w = out.frame_shape[:2]
+    if mode == 'block':
+        shape = (h//ds, w//ds)
+    else:
+        shape = (-(-h//ds), -(-w//ds))
+    assert out.ds == ds and out.image.shape[:2] == shape, \
+        "display frame {} at ds {}, expected {} at ds {}".format(
+            out.image.shape, out.ds, shape, ds)
+
+
+def bench_display_prepare(downsample_view, display_downsample='stride', pixel_format='RGB8',
+                          n_frames=100, width=1920, height=1200, warmup=5, auto_level=False):
+    "per-frame cost of the display worker thread, configured through its attributes"
+    from .flircam_display import DisplayWorker
+    from .flircam_hw import FlirCamHW
+    cam, lib = make_camera(pixel_format, width, height)
+    hw = make_bench_hw(cam)
+    # not started, frames are prepared synchronously with process_latest()
+    worker = DisplayWorker(hw.frame_ring, name='flircam_live_display')
+    worker.min_ds = downsample_view
+    worker.mode = display_downsample
+    worker.auto_level = auto_level
+    cam.start_acquisition()
+    try:
+        times = []
+        for i in range(warmup + n_frames):
+            FlirCamHW.grab_frame(hw)
+            t0 = time.perf_counter()
+            worker.process_latest()
+            if i >= warmup:
+                times.append(time.perf_counter() - t0)
+        check_display_shape(worker.output, downsample_view, display_downsample)
+        return _summary(times)
+    finally:
+        cam.stop_acquisition()
+        cam.release_camera()
+        cam.release_system()
+
+
+def bench_update_display(downsample_view, pixel_format='RGB8', n_frames=100,
+                         width=1920, height=1200, warmup=5):
+    "per-frame cost on the GUI thread: update_display and rendering the image item"
+    from .flircam_hw import FlirCamHW
+    from .flircam_live_measure import FlirCamLiveMeasure
+    cam, lib = make_camera(pixel_format, width, height)
+    hw = make_bench_hw(cam)
+    m = make_bench_live_measure(hw, downsample_view)
+
+    cam.start_acquisition()
+    try:
+        times = []
+        for i in range(warmup + n_frames):
+            FlirCamHW.grab_frame(hw)
+            m.display_worker.process_latest()
+            t0 = time.perf_counter()
+            FlirCamLiveMeasure.update_display(m)
+            m.img_item.render()
+            if i >= warmup:
+                times.append(time.perf_counter() - t0)
+        return _summary(times)
+    finally:
+        cam.stop_acquisition()
+        cam.release_camera()
+        cam.release_system()
+
+
+def run_all(n_frames=200, width=1920, height=1200, only=None):
+    results = dict()
+    skipped = dict()
+
+    def run(name, func, *args, **kwargs):
+        if only and not any(name.startswith(o) for o in only):
+            return
+        try:
+            results[name] = func(*args, **kwargs)
+        except ImportError as err:
+            skipped[name] = str(err)
+            return
+        print("{:32s} {:9.3f} ms/frame  {:8.1f} fps".format(
+            name, 1e3*results[name]['per_frame_s'], results[name]['fps']))
+
+    for name, fmt in GET_IMAGE_BRANCHES:
+        run('get_image.' + name, bench_get_image, fmt, n_frames, width, height)
+    for mode in DEMOSAIC_MODES:
+        run('get_image.BayerRG8.' + mode, bench_get_image, 'BayerRG8', n_frames, width, height,
+            demosaic=mode)
+    run('grab_frame.RGB8', bench_grab_frame, 'RGB8', n_frames, width, height)
+    for ds in DOWNSAMPLE_VIEWS:
+        for mode in ('stride', 'block'):
+            run('display_prepare.{}.ds{}'.format(mode, ds), bench_display_prepare, ds, mode,
+                'RGB8', max(n_frames//2, 1), width, height)
+        run('update_display.ds{}'.format(ds), bench_update_display, ds, 'RGB8',
+            max(n_frames//2, 1), width, height)
+    run('display_prepare.auto_level.ds2', bench_display_prepare, 2, 'stride', 'RGB8',
+        max(n_frames//2, 1), width, height, auto_level=True)
+
+    return dict(meta=dict(time=time.time(),
+                          python=sys.version.split()[0],
+                          numpy=np.__version__,
+                          platform=platform.platform(),
+                          machine=platform.machine(),
+                          n_frames=n_frames, width=width, height=height),
+                results=results,
+                skipped=skipped)
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Returns a list of regression messages: benchmarks present in both
+    whose per-frame time grew by more than tolerance (fraction), or that
+    make more SpinnakerC calls per frame than in the baseline
+    """
+    regressions = []
+    for name, res in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        if res['per_frame_s'] > base['per_frame_s']*(1 + tolerance):
+            regressions.append("{}: {:.3f} ms/frame vs baseline {:.3f} ms/frame".format(
+                name, 1e3*res['per_frame_s'], 1e3*base['per_frame_s']))
+        if 'calls_per_frame' in res and 'calls_per_frame' in base \
+                and res['calls_per_frame'] > base['calls_per_frame'] + 1e-9:
+            regressions.append("{}: {:.1f} SpinnakerC calls/frame vs baseline {:.1f}".format(
+                name, res['calls_per_frame'], base['calls_per_frame']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1200)
+    parser.add_argument('--only', nargs='*', help='benchmark name prefixes to run')
+    parser.add_argument('--out', help='write results JSON to this file')
+    parser.add_argument('--baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='compare against this results JSON (default: %(const)s)')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE,
+                        help='store results as baseline (default: %(const)s)')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+    if args.baseline and not os.path.exists(args.baseline):
+        print("no benchmark baseline at {}, create one with --save-baseline".format(
+            args.baseline))
+        return 2
+
+    current = run_all(args.frames, args.width, args.height, args.only)
+    for name, reason in current['skipped'].items():
+        print("{:32s} skipped: {}".format(name, reason))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(current, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.tolerance)
+        for msg in regressions:
+            print("REGRESSION", msg)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
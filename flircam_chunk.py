@@ -0,0 +1,71 @@
+"""
+Per-frame chunk data and frame ID gap detection.
+
+With chunk mode active the camera appends metadata to every frame,
+FlirCamInterface.get_image decodes the enabled CHUNK_FIELDS into a 0-d
+CHUNK_DTYPE record, info['chunk'].
+
+FrameGapDetector follows the frame IDs of a frame sequence: a jump by
+more than one means the frames in between never arrived (dropped on the
+camera, in the stream buffers, or later e.g. by a full writer queue).
+Every gap is logged as a DROP_LOG_DTYPE record.
+"""
+from collections import OrderedDict
+import numpy as np
+
+# field -> (ChunkSelector entry, 'int' or 'float'),
+# decoded with spinImageChunkDataGet{Int,Float}Value(hImage, 'Chunk' + entry)
+CHUNK_FIELDS = OrderedDict([
+    ('frame_id', ('FrameID', 'int')),
+    ('timestamp', ('Timestamp', 'int')),        # ns
+    ('exposure_time', ('ExposureTime', 'float')),  # us
+    ('gain', ('Gain', 'float')),                # dB
+    ])
+
+CHUNK_DTYPE = np.dtype([('frame_id', '<u8'),
+                        ('timestamp', '<u8'),
+                        ('exposure_time', '<f8'),
+                        ('gain', '<f8')])
+
+# index: position of the frame after the gap in the sequence,
+# frame_id: its frame ID, n_missing: frames missing before it
+DROP_LOG_DTYPE = np.dtype([('index', '<u8'),
+                           ('frame_id', '<u8'),
+                           ('n_missing', '<u8')])
+
+
+class FrameGapDetector(object):
+    """
+    Counts missing frame IDs in a sequence of frames.
+    update(frame_id) is called once per frame in order of arrival, a
+    frame ID that does not increase (counter reset) starts over without
+    counting a gap.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last_id = None
+        self.n_frames = 0
+        self.n_missing = 0
+        self.drop_log = []
+
+    def restart(self):
+        "next frame ID starts a new sequence, e.g. after an acquisition restart"
+        self.last_id = None
+
+    def update(self, frame_id):
+        "Returns the number of frames missing before frame_id"
+        gap = 0
+        if self.last_id is not None and frame_id > self.last_id + 1:
+            gap = frame_id - self.last_id - 1
+            self.n_missing += gap
+            self.drop_log.append((self.n_frames, frame_id, gap))
+        self.last_id = frame_id
+        self.n_frames += 1
+        return gap
+
+    def get_drop_log(self):
+        "Returns the gaps as DROP_LOG_DTYPE array"
+        return np.array(self.drop_log, dtype=DROP_LOG_DTYPE)
@@ -84,3 +84,38 @@ class AccessModeEnum(Enum):
     _UndefinedAccesMode   = 5 #: Object is not yet initialized
     _CycleDetectAccesMode = 6   #: used internally for AccessMode cycle detection
 
+
+
+# Writing the key node can change the limits / enum entries of the listed
+# nodes, used to invalidate FlirCamInterface's node metadata cache.
+NodeDependents = {
+    'PixelFormat': ('Width', 'Height', 'OffsetX', 'OffsetY', 
+                    'AcquisitionFrameRate', 'ExposureTime'),
+    'Width': ('OffsetX', 'AcquisitionFrameRate', 'ExposureTime'),
+    'Height': ('OffsetY', 'AcquisitionFrameRate', 'ExposureTime'),
+    'OffsetX': ('Width',),
+    'OffsetY': ('Height',),
+    'BinningHorizontal': ('Width', 'OffsetX', 'AcquisitionFrameRate'),
+    'BinningVertical': ('Height', 'OffsetY', 'AcquisitionFrameRate'),
+    'DecimationHorizontal': ('Width', 'OffsetX', 'AcquisitionFrameRate'),
+    'DecimationVertical': ('Height', 'OffsetY', 'AcquisitionFrameRate'),
+    'ExposureAuto': ('ExposureTime',),
+    'ExposureTime': ('AcquisitionFrameRate',),
+    'AcquisitionFrameRate': ('ExposureTime',),
+    'AcquisitionFrameRateEnable': ('AcquisitionFrameRate', 'ExposureTime'),
+    'AcquisitionFrameRateAuto': ('AcquisitionFrameRate', 'ExposureTime'),
+    }
+
+# nodes that set the frame geometry, locked while acquiring,
+# see FlirCamInterface.paused_acquisition()
+GeometryNodes = ('BinningHorizontal', 'BinningVertical', 
+                 'DecimationHorizontal', 'DecimationVertical',
+                 'OffsetX', 'OffsetY', 'Width', 'Height')
+
+# nodes of the transport layer stream node map, buffering between camera
+# and host, looked up there by FlirCamInterface.get_node()
+StreamNodes = ('StreamBufferCountMode', 'StreamBufferCountManual', 'StreamBufferCountResult',
+               'StreamBufferHandlingMode', 'StreamLostFrameCount')
+
+# error code -> error name
+FlirCamErrorNames = {v: k for k, v in FlirCamErrors.items()}
@@ -0,0 +1,139 @@
+"""
+Host side Bayer demosaicing, vectorized with numpy.
+
+Streaming BayerXX8 instead of RGB8 needs a third of the link bandwidth,
+the color conversion is done here instead of on the camera:
+
+    demosaicer = Demosaicer('bilinear')
+    rgb = demosaicer(raw, 'RG')            # raw: (h, w) Bayer mosaic
+
+'bilinear'    full resolution (h, w, 3), missing colors interpolated
+              from the 2 or 4 nearest neighbors of that color
+'superpixel'  half resolution (h//2, w//2, 3), every 2x2 tile becomes one
+              RGB pixel (green: mean of both green pixels), much faster
+
+Output and scratch buffers are preallocated and reused frame to frame.
+"""
+import numpy as np
+
+DEMOSAIC_MODES = ('bilinear', 'superpixel')
+
+# pattern -> color of the 2x2 tile sites (0, 0), (0, 1), (1, 0), (1, 1)
+BAYER_TILES = {
+    'RG': 'RGGB',
+    'GR': 'GRBG',
+    'GB': 'GBRG',
+    'BG': 'BGGR',
+    }
+
+
+def bayer_pattern(name):
+    """
+    Returns the tile pattern ('RG', 'GR', 'GB' or 'BG') of a PixelColorFilter
+    value ('BayerRG') or Bayer pixel format ('BayerRG8', 'BayerGB16'),
+    None if name is not a Bayer format.
+    """
+    if not name or not name.startswith('Bayer'):
+        return None
+    pattern = name[5:7]
+    return pattern if pattern in BAYER_TILES else None
+
+
+def demosaic_shape(raw_shape, mode):
+    h, w = raw_shape[:2]
+    if mode == 'superpixel':
+        return (h//2, w//2, 3)
+    return (h, w, 3)
+
+
+class Demosaicer(object):
+    """
+    Converts Bayer mosaics (h, w) of uint8 or uint16 to RGB of the same
+    dtype, see module docstring. h and w must be even.
+    """
+
+    def __init__(self, mode='bilinear'):
+        assert mode in DEMOSAIC_MODES
+        self.mode = mode
+        self._pad = None
+        self._acc = None
+
+    def output_shape(self, raw_shape):
+        return demosaic_shape(raw_shape, self.mode)
+
+    def __call__(self, raw, pattern, out=None):
+        "Returns RGB image of raw, written to out if given"
+        if out is None:
+            out = np.empty(self.output_shape(raw.shape), dtype=raw.dtype)
+        tiles = BAYER_TILES[pattern]
+        if self.mode == 'superpixel':
+            self.superpixel(raw, tiles, out)
+        else:
+            self.bilinear(raw, tiles, out)
+        return out
+
+    def _acc_buffer(self, shape, raw_dtype):
+        # sums of 4 pixels: uint16 holds 8-bit data, 16-bit data needs uint32
+        dtype = np.uint16 if raw_dtype == np.uint8 else np.uint32
+        if self._acc is None or self._acc.shape != shape or self._acc.dtype != dtype:
+            self._acc = np.empty(shape, dtype=dtype)
+        return self._acc
+
+    def superpixel(self, raw, tiles, out):
+        sites = {(0, 0): tiles[0], (0, 1): tiles[1], (1, 0): tiles[2], (1, 1): tiles[3]}
+        greens = [s for s, c in sites.items() if c == 'G']
+        for (y, x), c in sites.items():
+            if c != 'G':
+                out[..., 'RGB'.index(c)] = raw[y::2, x::2]
+        (y1, x1), (y2, x2) = greens
+        acc = self._acc_buffer(out.shape[:2], raw.dtype)
+        np.add(raw[y1::2, x1::2], raw[y2::2, x2::2], out=acc, dtype=acc.dtype)
+        np.right_shift(acc, 1, out=out[..., 1], casting='unsafe')
+
+    def _padded(self, raw):
+        "raw with a one pixel border mirrored about the edge pixels (keeps the Bayer phase)"
+        h, w = raw.shape
+        if self._pad is None or self._pad.shape != (h+2, w+2) or self._pad.dtype != raw.dtype:
+            self._pad = np.empty((h+2, w+2), dtype=raw.dtype)
+        P = self._pad
+        P[1:-1, 1:-1] = raw
+        P[0, 1:-1] = raw[1]
+        P[-1, 1:-1] = raw[-2]
+        P[:, 0] = P[:, 2]
+        P[:, -1] = P[:, -3]
+        return P
+
+    def bilinear(self, raw, tiles, out):
+        h, w = raw.shape
+        P = self._padded(raw)
+        acc = self._acc_buffer(((h+1)//2, (w+1)//2), raw.dtype)
+
+        def nb(y0, x0, dy, dx):
+            # neighbor (dy, dx) of every site of phase (y0, x0)
+            return P[1+y0+dy:1+dy+h:2, 1+x0+dx:1+dx+w:2]
+
+        def mean(dst, y0, x0, offsets):
+            np.add(nb(y0, x0, *offsets[0]), nb(y0, x0, *offsets[1]), out=acc, dtype=acc.dtype)
+            for off in offsets[2:]:
+                np.add(acc, nb(y0, x0, *off), out=acc)
+            np.right_shift(acc, 1 if len(offsets) == 2 else 2, out=dst, casting='unsafe')
+
+        cross = ((-1, 0), (1, 0), (0, -1), (0, 1))
+        diag = ((-1, -1), (-1, 1), (1, -1), (1, 1))
+        horiz = ((0, -1), (0, 1))
+        vert = ((-1, 0), (1, 0))
+
+        for i, (y0, x0) in enumerate(((0, 0), (0, 1), (1, 0), (1, 1))):
+            c = tiles[i]
+            site = out[y0::2, x0::2]
+            site[..., 'RGB'.index(c)] = raw[y0::2, x0::2]
+            if c == 'G':
+                # color of the horizontal neighbors on this row
+                c_row = tiles[i ^ 1]
+                c_col = 'B' if c_row == 'R' else 'R'
+                mean(site[..., 'RGB'.index(c_row)], y0, x0, horiz)
+                mean(site[..., 'RGB'.index(c_col)], y0, x0, vert)
+            else:
+                other = 'B' if c == 'R' else 'R'
+                mean(site[..., 1], y0, x0, cross)
+                mean(site[..., 'RGB'.index(other)], y0, x0, diag)
@@ -0,0 +1,213 @@
+"""
+Live view display preparation, off the GUI thread.
+
+DisplayWorker reads the newest frame of a FrameRing (stale frames are
+skipped), decimates it to what the viewport can show, applies flips and
+levels and publishes a DisplayFrame holding a C-contiguous uint8 image.
+The GUI thread only hands that image to the ImageItem, its cost per
+refresh does not depend on the sensor resolution.
+
+AutoLevels estimates percentile levels from a pixel subsample, levels
+are applied with a lookup table.
+"""
+import threading
+from collections import namedtuple
+import numpy as np
+
+# image: C-contiguous uint8, (h, w) or (h, w, 3)
+# ds: decimation factor of image, frame_shape: shape of the full frame
+# levels: (lo, hi) of the frame values mapped to 0..255, 
+#         one (lo, hi) per channel with per-channel auto levels
+DisplayFrame = namedtuple('DisplayFrame', ['seq', 'image', 'ds', 'levels', 'frame_shape', 'info'])
+
+DOWNSAMPLE_MODES = ('stride', 'block')
+
+
+def downsample(im, ds, mode='stride'):
+    """
+    Decimates the first two axes of integer image im by ds.
+    'stride' picks every ds-th pixel (a view), 'block' averages ds x ds
+    blocks (edges that do not fill a block are dropped).
+    """
+    if ds <= 1:
+        return im
+    if mode == 'block':
+        h = (im.shape[0]//ds)*ds
+        w = (im.shape[1]//ds)*ds
+        blocks = im[:h, :w].reshape((h//ds, ds, w//ds, ds) + im.shape[2:])
+        acc = blocks.sum(axis=(1, 3), dtype=np.uint32)
+        acc //= ds*ds
+        return acc.astype(im.dtype)
+    return im[::ds, ::ds]
+
+
+def linear_lut(lo, hi, n):
+    "uint8 lookup table of length n mapping [lo, hi] linearly to [0, 255]"
+    scale = 255.0/max(hi - lo, 1e-9)
+    lut = (np.arange(n, dtype=np.float32) - lo)*scale
+    np.clip(lut, 0, 255, out=lut)
+    return lut.astype(np.uint8)
+
+
+class AutoLevels(object):
+    """
+    Percentile levels of 8- or 16-bit images, per channel if per_channel.
+    
+    Percentiles low and high (in %) come from a histogram (np.bincount) of 
+    a strided subsample of about n_samples pixels, and are smoothed from
+    frame to frame with an exponential moving average:
+        levels = smoothing*levels + (1 - smoothing)*new_levels
+    """
+    
+    def __init__(self, low=0.5, high=99.5, smoothing=0.8, n_samples=65536, per_channel=False):
+        self.low = low
+        self.high = high
+        self.smoothing = smoothing
+        self.n_samples = n_samples
+        self.per_channel = per_channel
+        self.reset()
+    
+    def reset(self):
+        self.levels = None
+        self._key = None
+    
+    def update(self, im):
+        """
+        Returns the smoothed levels for integer image im: 
+        array (n_channels, 2) of (lo, hi)
+        """
+        h, w = im.shape[:2]
+        step = max(1, int(np.sqrt(h*w/float(self.n_samples))))
+        sub = im[::step, ::step]
+        if self.per_channel and im.ndim == 3:
+            channels = [sub[..., c] for c in range(im.shape[2])]
+        else:
+            channels = [sub]
+        nbins = np.iinfo(im.dtype).max + 1
+        
+        new = np.empty((len(channels), 2))
+        for i, ch in enumerate(channels):
+            hist = np.bincount(ch.ravel(), minlength=nbins)
+            cdf = np.cumsum(hist)
+            n = cdf[-1]
+            lo = np.searchsorted(cdf, 0.01*self.low*n)
+            hi = np.searchsorted(cdf, 0.01*self.high*n)
+            new[i] = lo, max(hi, lo + 1)
+        
+        key = (im.dtype, len(channels))
+        if self.levels is None or key != self._key:
+            self.levels = new
+            self._key = key
+        else:
+            a = self.smoothing
+            self.levels = a*self.levels + (1 - a)*new
+        return self.levels
+
+
+class DisplayWorker(threading.Thread):
+    """
+    Prepares the newest frame of frame_ring for display, see module
+    docstring. Display parameters (min_ds, view_ds, mode, auto_level,
+    flip_x, flip_y) are plain attributes set from the GUI thread, the
+    result is read from self.output.
+    """
+
+    def __init__(self, frame_ring, period=0.005, name='flircam_display'):
+        threading.Thread.__init__(self, name=name, daemon=True)
+        self.frame_ring = frame_ring
+        self.cursor = frame_ring.new_cursor('latest', name=name)
+        self.period = period
+
+        self.min_ds = 1         # smallest decimation factor
+        self.view_ds = 1        # decimation the viewport can show without loss
+        self.mode = 'stride'    # see DOWNSAMPLE_MODES
+        self.auto_level = False
+        self.autolevels = AutoLevels()
+        self.flip_x = False
+        self.flip_y = False
+
+        self.output = None
+        self.n_prepared = 0
+        self.error = None
+        self._stop_event = threading.Event()
+        self._lut_key = None
+        self._lut = None
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if not self.process_latest():
+                    self._stop_event.wait(self.period)
+        except Exception as err:
+            self.error = err
+            raise
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.frame_ring.remove_cursor(self.cursor)
+
+    def process_latest(self):
+        "Prepares the newest unseen frame. Returns False if there was none"
+        entry = self.cursor.get()
+        if entry is None:
+            return False
+        seq, frame, info = entry
+        out = self.prepare(seq, frame, info)
+        if out is not None:
+            self.output = out
+            self.n_prepared += 1
+        return True
+
+    def get_levels(self, im):
+        """
+        Returns (lo, hi), or with per-channel auto levels a tuple of (lo, hi)
+        per channel. Auto levels are rounded to whole values, so the lookup 
+        table is rebuilt only when they move.
+        """
+        if not self.auto_level:
+            self.autolevels.reset()
+            return 0, np.iinfo(im.dtype).max
+        levels = np.round(self.autolevels.update(im)).astype(int).tolist()
+        if len(levels) == 1:
+            return tuple(levels[0])
+        return tuple(tuple(lv) for lv in levels)
+
+    def prepare(self, seq, frame, info):
+        "Returns the DisplayFrame of frame, None for frames that can not be shown"
+        if frame.ndim < 2 or frame.dtype.kind != 'u':
+            return None
+        ds = max(1, int(self.min_ds), int(self.view_ds))
+        im = downsample(frame, ds, self.mode)
+        if self.flip_y:
+            im = im[::-1]
+        if self.flip_x:
+            im = im[:, ::-1]
+
+        levels = self.get_levels(im)
+        if im.dtype == np.uint8 and levels == (0, 255):
+            # copy, the frame buffer is reused once the ring drops it
+            image = np.array(im, order='C', copy=True)
+        else:
+            image = np.empty(im.shape, dtype=np.uint8)
+            lut = self.get_lut(levels, im.dtype)
+            if lut.ndim == 1:
+                # flat take is about twice as fast as on (strided) 2D/3D views
+                np.take(lut, im.reshape(-1), out=image.reshape(-1), mode='clip')
+            else:
+                for c in range(lut.shape[0]):
+                    np.take(lut[c], im[..., c], out=image[..., c], mode='clip')
+        return DisplayFrame(seq, image, ds, levels, frame.shape, info)
+
+    def get_lut(self, levels, dtype):
+        "uint8 lookup table for levels (lo, hi), or one row per channel"
+        key = (levels, dtype)
+        if key != self._lut_key:
+            n = np.iinfo(dtype).max + 1
+            if np.ndim(levels) == 1:
+                self._lut = linear_lut(levels[0], levels[1], n)
+            else:
+                self._lut = np.array([linear_lut(lo, hi, n) for lo, hi in levels])
+            self._lut_key = key
+        return self._lut
@@ -0,0 +1,105 @@
+import weakref
+from threading import Lock
+import numpy as np
+
+
+class FramePool(object):
+    """
+    Pool of preallocated numpy frame buffers, keyed by (shape, dtype).
+
+    acquire() hands out a free buffer of the requested shape (allocating
+    a new one only when the pool is empty). Buffers handed out are
+    reference counted: acquire() returns a buffer with one reference,
+    owned by the caller, every holder that shares it takes one more with
+    retain() and drops it with release(). The buffer goes back to the
+    pool when the last reference is released. At most max_free buffers
+    per shape are kept around, so memory use stays flat during long
+    acquisitions.
+
+    retain() and release() also take views of a pool buffer (e.g. a
+    crop), arrays that did not come from acquire() are ignored.
+    """
+
+    def __init__(self, max_free=8):
+        self.max_free = max_free
+        self.lock = Lock()
+        self._free = dict()
+        # id(buffer) -> [weakref to buffer, references], buffers handed out
+        self._refs = dict()
+        self.n_allocated = 0
+        self.n_reused = 0
+
+    def acquire(self, shape, dtype=np.uint8):
+        key = (tuple(shape), np.dtype(dtype))
+        with self.lock:
+            free = self._free.get(key)
+            if free:
+                self.n_reused += 1
+                arr = free.pop()
+                self._track(arr)
+                return arr
+            self.n_allocated += 1
+        arr = np.empty(key[0], dtype=key[1])
+        with self.lock:
+            self._track(arr)
+        return arr
+
+    def _track(self, arr):
+        k = id(arr)
+        refs = self._refs
+
+        def forget(ref):
+            # buffer dropped without release() (a holder lost it)
+            entry = refs.get(k)
+            if entry is not None and entry[0] is ref:
+                refs.pop(k, None)
+
+        refs[k] = [weakref.ref(arr, forget), 1]
+
+    def _entry(self, arr):
+        "(buffer, refcount entry) of arr or of the buffer arr is a view of"
+        if arr is None:
+            return None, None
+        buf = arr if arr.base is None else arr.base
+        entry = self._refs.get(id(buf))
+        if entry is None or entry[0]() is not buf:
+            return None, None
+        return buf, entry
+
+    def retain(self, arr):
+        "Take a reference to the pool buffer of arr, give it back with release()"
+        with self.lock:
+            buf, entry = self._entry(arr)
+            if entry is not None:
+                entry[1] += 1
+
+    def release(self, arr):
+        """
+        Drop a reference to the pool buffer of arr, it goes back to the pool
+        with the last one. arr must not be used by the caller afterwards
+        """
+        with self.lock:
+            buf, entry = self._entry(arr)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._refs[id(buf)]
+            free = self._free.setdefault((buf.shape, buf.dtype), [])
+            if len(free) < self.max_free:
+                free.append(buf)
+
+    def refcount(self, arr):
+        "references held to the pool buffer of arr, 0 if it is not handed out"
+        with self.lock:
+            buf, entry = self._entry(arr)
+            return 0 if entry is None else entry[1]
+
+    def clear(self):
+        with self.lock:
+            self._free.clear()
+
+    def num_free(self):
+        with self.lock:
+            return sum(len(v) for v in self._free.values())
@@ -0,0 +1,200 @@
+from threading import Lock
+
+
+class FrameRing(object):
+    """
+    Fixed capacity single-producer / multi-consumer ring of frames.
+
+    The acquisition thread push()es frames, every consumer (display,
+    recording, analysis...) reads through its own FrameRingCursor, so
+    consumers see the same stream independently and without copies.
+
+    The producer fills a slot with a single (seq, frame, meta) tuple
+    assignment and only then advances self.head, readers check the
+    sequence number of the slot they read to detect that it was
+    overwritten in the meantime.
+
+    With a FramePool, pushed frames are owned by the ring: the producer
+    hands its reference over and the ring releases it to the pool when
+    the slot is overwritten. A cursor retains the frame it returned
+    until its next get() (or release()), anybody keeping a frame longer
+    retains it too. Slot updates and cursor reads then take a short
+    lock, so a frame can not be recycled between reading a slot and
+    retaining its frame.
+    """
+
+    def __init__(self, capacity, pool=None):
+        assert capacity > 0
+        self.capacity = capacity
+        # optional FramePool, overwritten frames are released to it
+        self.pool = pool
+        self.lock = Lock()
+        self._slots = [None]*capacity
+        self.head = 0   # sequence number of the next frame to be pushed
+        self.n_overwritten = 0
+        self.cursors = []
+
+    @property
+    def n_produced(self):
+        return self.head
+
+    @property
+    def n_consumed(self):
+        return sum(c.n_read for c in self.cursors)
+
+    def push(self, frame, meta=None):
+        """
+        Add frame to the ring (producer thread only). Returns its sequence number.
+        With a pool the ring takes over the caller's reference to frame
+        """
+        seq = self.head
+        i = seq % self.capacity
+        pool = self.pool
+        if pool is None:
+            old = self._slots[i]
+            self._slots[i] = (seq, frame, meta)
+            self.head = seq + 1
+        else:
+            with self.lock:
+                old = self._slots[i]
+                self._slots[i] = (seq, frame, meta)
+                self.head = seq + 1
+            if old is not None:
+                pool.release(old[1])
+        if old is not None:
+            self.n_overwritten += 1
+        return seq
+
+    def get(self, seq):
+        """
+        Returns (seq, frame, meta) of frame seq, or None if it has not
+        been produced yet or was already overwritten. With a pool the
+        frame is only safe to use while the ring holds it, see retain()
+        """
+        if seq < 0 or seq >= self.head:
+            return None
+        slot = self._slots[seq % self.capacity]
+        if slot is None or slot[0] != seq:
+            return None
+        return slot
+
+    def retain(self, seq):
+        """
+        Like get(), but with a pool the frame is retained for the caller,
+        who passes it to self.pool.release() when done with it
+        """
+        if self.pool is None:
+            return self.get(seq)
+        with self.lock:
+            slot = self.get(seq)
+            if slot is not None:
+                self.pool.retain(slot[1])
+        return slot
+
+    def latest(self):
+        "Returns (seq, frame, meta) of the newest frame, or None"
+        return self.get(self.head - 1)
+
+    def new_cursor(self, mode='next', name=None):
+        """
+        Returns a FrameRingCursor reading this ring.
+        mode 'next': get() returns every frame in order ("next unseen frame")
+        mode 'latest': get() skips to the newest unseen frame
+        """
+        cursor = FrameRingCursor(self, mode, name)
+        self.cursors.append(cursor)
+        return cursor
+
+    def remove_cursor(self, cursor):
+        cursor.release()
+        if cursor in self.cursors:
+            self.cursors.remove(cursor)
+
+    def clear(self):
+        "Drop all frames, cursors are kept and continue at the current head"
+        with self.lock:
+            slots = self._slots
+            self._slots = [None]*self.capacity
+        if self.pool is not None:
+            for slot in slots:
+                if slot is not None:
+                    self.pool.release(slot[1])
+        for c in self.cursors:
+            c.next_seq = self.head
+
+    def stats(self):
+        return dict(produced=self.n_produced,
+                    consumed=self.n_consumed,
+                    overwritten=self.n_overwritten,
+                    cursors={c.name: c.stats() for c in self.cursors})
+
+
+class FrameRingCursor(object):
+    """
+    Read position of one consumer of a FrameRing.
+    Not shared between threads: each consuming thread gets its own.
+    A frame returned by get() stays valid until the next get() or
+    release(), retain it in the ring's pool to keep it longer.
+    """
+
+    def __init__(self, ring, mode='next', name=None):
+        assert mode in ('next', 'latest')
+        self.ring = ring
+        self.mode = mode
+        self.name = name or "cursor{}".format(id(self))
+        self.next_seq = ring.head
+        self.n_read = 0
+        self.n_skipped = 0  # passed over on purpose in 'latest' mode
+        self.n_missed = 0   # overwritten before this cursor got to them
+        self._held = None   # frame returned last, retained with a pool
+
+    def get(self):
+        """
+        Returns (seq, frame, meta) of the next unseen frame according
+        to self.mode, or None if there is no new frame.
+        """
+        self.release()
+        ring = self.ring
+        while True:
+            head = ring.head
+            seq = self.next_seq
+            if seq >= head:
+                return None
+            if self.mode == 'latest':
+                target = head - 1
+                self.n_skipped += target - seq
+            else:
+                target = max(seq, head - ring.capacity)
+                self.n_missed += target - seq
+            slot = ring.retain(target)
+            self.next_seq = target + 1
+            if slot is None:
+                # overwritten while we were looking, try again
+                self.n_missed += 1
+                continue
+            if ring.pool is not None:
+                self._held = slot[1]
+            self.n_read += 1
+            return slot
+
+    def release(self):
+        "Done with the frame returned last"
+        held = self._held
+        if held is not None:
+            self._held = None
+            self.ring.pool.release(held)
+
+    def get_frame(self):
+        "Like get() but returns only the frame, or None"
+        slot = self.get()
+        if slot is None:
+            return None
+        return slot[1]
+
+    def pending(self):
+        "Number of unseen frames still in the ring"
+        return max(0, min(self.ring.head - self.next_seq, self.ring.capacity))
+
+    def stats(self):
+        return dict(read=self.n_read, skipped=self.n_skipped,
+                    missed=self.n_missed, pending=self.pending())
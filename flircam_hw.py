@@ -1,10 +1,20 @@
 from ScopeFoundry import HardwareComponent
-from .flircam_interface import FlirCamInterface
+from .flircam_interface import FlirCamInterface, FlirCamTimeoutError, \
+    FlirCamIncompleteImageError, INCOMPLETE_POLICIES, STREAM_PRESETS, STREAM_HANDLING_MODES, \
+    TRIGGER_SOURCES, TRIGGER_ACTIVATIONS
+from .flircam_consts import FlirCamImageStatus, GeometryNodes
+from .flircam_frame_ring import FrameRing
+from .flircam_sim_lib import SimSpinnakerLib
+from .flircam_latency import LatencyTracker, LATENCY_STAGES
+from .flircam_demosaic import DEMOSAIC_MODES
+from .flircam_pipeline import FramePipeline
+from .flircam_shm import FrameShmPublisher
 import threading
 import time
+import os
 
 
-IMAGE_BUFFER_SIZE = 3
+IMAGE_BUFFER_SIZE = 8
 
 default_features = {
     # lq_name: ('category', 'feature_name', dtype)
@@ -16,12 +26,27 @@ default_features = {
     #'AutoExposureTimeLowerLimit': ('AcquisitionControl', 'AutoExposureTimeLowerLimit', 'float'),
      'pixel_format': ('ImageFormatControl', 'PixelFormat', 'enum'),
 #     ia.remote_device.node_map.PixelFormat
+    # frame geometry (GeometryNodes): written with acquisition paused, 
+    # cropping and binning on the sensor cut link bandwidth and raise the frame rate
+    'binning_h': ('ImageFormatControl', 'BinningHorizontal', 'int'),
+    'binning_v': ('ImageFormatControl', 'BinningVertical', 'int'),
+    'decimation_h': ('ImageFormatControl', 'DecimationHorizontal', 'int'),
+    'decimation_v': ('ImageFormatControl', 'DecimationVertical', 'int'),
+    'offset_x': ('ImageFormatControl', 'OffsetX', 'int'),
+    'offset_y': ('ImageFormatControl', 'OffsetY', 'int'),
+    'width': ('ImageFormatControl', 'Width', 'int'),
+    'height': ('ImageFormatControl', 'Height', 'int'),
     }
 
+# set_roi() keyword of the ROI nodes
+ROI_NODE_ARGS = {'OffsetX': 'offset_x', 'OffsetY': 'offset_y', 
+                 'Width': 'width', 'Height': 'height'}
+
 
 lq_dtype_map = {
     'enum': str,
-    'float': float
+    'float': float,
+    'int': int,
     }
 
 
@@ -31,14 +56,101 @@ class FlirCamHW(HardwareComponent):
     
     features = default_features
     
+    # keyword arguments of SimSpinnakerLib, used when 'simulate' is set
+    sim_options = dict()
+    
     def setup(self):
         S = self.settings
         S.New('cam_index', dtype=int, initial=0)
+        S.New('simulate', dtype=bool, initial=False)
         S.New('auto_exposure', dtype=int, initial=2)
         S.New('acquiring', dtype=bool, initial=False)
         S.New('exposure', dtype=float, unit='s', spinbox_decimals=6, si=True)
-        S.New('frame_rate', dtype=float, unit='Hz', spinbox_decimals=3)
+        S.New('frame_rate', dtype=float, unit='Hz', spinbox_decimals=3,
+              description='requested frame rate, <= 0: as fast as possible')
+        S.New('frame_rate_camera', dtype=float, unit='Hz', spinbox_decimals=3, ro=True,
+              description='frame rate reported by the camera')
+        S.New('frame_rate_host', dtype=float, unit='Hz', spinbox_decimals=3, ro=True,
+              description='frame rate measured from frame arrival times')
+        S.New('telemetry_period', dtype=float, initial=1.0, vmin=0.1, unit='s')
+        
+        # rolling frame latency percentiles of latency_stage, see flircam_latency
+        self.latency = LatencyTracker()
+        S.New('latency_tracking', dtype=bool, initial=True)
+        S.latency_tracking.add_listener(self.set_latency_tracking)
+        S.New('latency_stage', dtype=str, initial='grab_to_display', choices=LATENCY_STAGES)
+        for p in ('p50', 'p95', 'p99'):
+            S.New('latency_' + p, dtype=float, unit='ms', spinbox_decimals=3, ro=True)
+        self.add_operation('reset_latency', self.latency.reset)
+        self.add_operation('export_latency_csv', self.export_latency_csv)
+        S.New('grab_timeout', dtype=float, initial=1.0, vmin=0.001, unit='s',
+              description='longest wait for a frame, bounds how long the '
+                          'acquisition thread can block (e.g. while waiting for a trigger)')
         #S.New('pixel_format', dtype=str, choices=['UNKNOWN',])
+        S.New('incomplete_policy', dtype=str, initial='retry', choices=INCOMPLETE_POLICIES,
+              description='incomplete frames: retry (drop and grab again), '
+                          'flag (keep partial frame) or raise')
+        S.New('incomplete_retries', dtype=int, initial=3, vmin=0)
+        S.New('demosaic', dtype=str, initial='bilinear', choices=('off',) + DEMOSAIC_MODES,
+              description='host side conversion of Bayer pixel formats to RGB')
+        S.New('stream_mode', dtype=str, initial='live', choices=tuple(STREAM_PRESETS) + ('custom',),
+              description='stream buffers, applied when acquisition starts: live (newest '
+                          'frame, lowest latency), record (deep queue, no drops) or '
+                          'custom (buffer_handling and buffer_count)')
+        S.New('buffer_handling', dtype=str, initial='OldestFirst', choices=STREAM_HANDLING_MODES,
+              description="StreamBufferHandlingMode with stream_mode 'custom'")
+        S.New('buffer_count', dtype=int, initial=10, vmin=1,
+              description="number of stream buffers with stream_mode 'custom'")
+        S.New('n_stream_lost', dtype=int, ro=True,
+              description='frames lost in the stream buffers (StreamLostFrameCount)')
+        # frame start trigger, see acquire_stack()
+        S.New('trigger', dtype=bool, initial=False,
+              description='every frame waits for a trigger from trigger_source')
+        S.New('trigger_source', dtype=str, initial='Software', choices=TRIGGER_SOURCES)
+        S.New('trigger_activation', dtype=str, initial='RisingEdge', choices=TRIGGER_ACTIVATIONS)
+        S.New('trigger_delay', dtype=float, initial=0.0, vmin=0.0, unit='s', si=True,
+              spinbox_decimals=6)
+        # link health, images per FlirCamImageStatus error code
+        S.New('n_incomplete', dtype=int, ro=True)
+        S.New('n_dropped', dtype=int, ro=True,
+              description='frames missing from the frame ID sequence')
+        S.New('chunk_mode', dtype=bool, initial=False,
+              description='per-frame chunk data (frame ID, timestamp, exposure, gain) '
+                          "in the frame info, info['chunk']")
+        for status_name in FlirCamImageStatus[1:]:
+            S.New(self.status_lq_name(status_name), dtype=int, ro=True)
+        
+        # consumers read frames through their own cursor: 
+        #    self.frame_ring.new_cursor('latest') or ('next')
+        self.frame_ring = FrameRing(IMAGE_BUFFER_SIZE)
+        
+        # callables func(img, info) run on the acquisition thread for every
+        # frame, they must return quickly (e.g. put into a queue). The frame
+        # ring owns img, a consumer keeping it retains it in cam.frame_pool
+        self.frame_consumers = []
+        
+        # processing stages fed with every frame, inline or on their own
+        # worker threads, see flircam_pipeline and add_pipeline_stage()
+        self.pipeline = FramePipeline()
+        S.New('pipeline_dropped', dtype=int, ro=True,
+              description='frames dropped at full pipeline stage queues')
+        self.add_operation('print_pipeline_stats', self.print_pipeline_stats)
+        self.add_operation('reset_pipeline_stats', self.pipeline.reset_stats)
+        
+        # frames for other processes, FrameShmClient(shm_name), see flircam_shm
+        self.shm_publisher = None
+        S.New('shm_publish', dtype=bool, initial=False,
+              description='publish frames to a shared memory ring for other local processes')
+        S.New('shm_name', dtype=str, initial='flircam')
+        S.New('shm_slots', dtype=int, initial=8, vmin=2)
+        S.New('shm_slot_size', dtype=float, initial=0.0, vmin=0.0, unit='MB',
+              description='largest frame, 0: size of the first frame published. '
+                          'The ring is recreated for larger frames')
+        S.New('shm_dropped', dtype=int, ro=True,
+              description='frames not published: larger than a slot or publishing too slow')
+        
+        self.add_operation('full_frame', self.set_full_frame)
+        self.add_operation('software_trigger', self.software_trigger)
 
         for lq_name, (node_name, feature_name, dtype) in self.features.items():
             print(lq_name, (node_name, feature_name, dtype))
@@ -54,10 +166,15 @@ class FlirCamHW(HardwareComponent):
         
     def connect(self):
         
-        self.img_buffer = []
-        
         S = self.settings
-        self.cam = FlirCamInterface(debug=S['debug_mode'])
+        if S['simulate']:
+            lib = SimSpinnakerLib(**self.sim_options)
+        else:
+            lib = None
+        self.cam = FlirCamInterface(debug=S['debug_mode'], lib=lib)
+        self.frame_ring.clear()
+        self.frame_ring.pool = self.cam.frame_pool
+        self.pipeline.set_pool(self.cam.frame_pool)
         S.debug_mode.add_listener(self.set_debug_mode)
         S.auto_exposure.connect_to_hardware(
             read_func = self.cam.get_auto_exposure,
@@ -73,30 +190,54 @@ class FlirCamHW(HardwareComponent):
             read_func = self.cam.get_frame_rate,
             write_func = self.cam.set_frame_rate
             )
+        S.frame_rate.read_from_hardware()
         
         S.acquiring.connect_to_hardware(
             write_func = self.start_stop_acquisition
             )     
         
+        def set_incomplete_policy(policy):
+            self.cam.incomplete_policy = policy
+        def set_incomplete_retries(n):
+            self.cam.incomplete_retries = n
+        S.incomplete_policy.connect_to_hardware(write_func=set_incomplete_policy)
+        S.incomplete_policy.write_to_hardware()
+        S.incomplete_retries.connect_to_hardware(write_func=set_incomplete_retries)
+        S.incomplete_retries.write_to_hardware()
+        S.demosaic.connect_to_hardware(write_func=self.cam.set_demosaic)
+        S.demosaic.write_to_hardware()
+        if self.cam.get_node_is_available('StreamBufferHandlingMode'):
+            S.stream_mode.connect_to_hardware(write_func=self.set_stream_mode)
+            S.stream_mode.write_to_hardware()
+            def write_stream_buffers(val):
+                self.set_stream_mode(S['stream_mode'])
+            S.buffer_handling.connect_to_hardware(write_func=write_stream_buffers)
+            S.buffer_count.connect_to_hardware(write_func=write_stream_buffers)
+        S.chunk_mode.connect_to_hardware(write_func=self.cam.set_chunk_mode)
+        S.chunk_mode.write_to_hardware()
+        if self.cam.get_node_is_available('TriggerMode'):
+            for lq_name in ('trigger', 'trigger_source', 'trigger_activation', 'trigger_delay'):
+                S.get_lq(lq_name).connect_to_hardware(write_func=self.write_trigger)
+            self.write_trigger()
+        self.update_image_status_counts()
+        
+        # read all features in one pass
+        snapshot = self.cam.snapshot(self.feature_node_names())
         for lq_name, (cat_name, node_name, dtype) in self.features.items():
             lq = self.settings.get_lq(lq_name)
-            node_type = self.cam.get_node_type(node_name)
+            node = snapshot[node_name]
 
-            print(lq_name, (cat_name, node_name, dtype))
-            if not self.cam.get_node_is_readable(node_name):
+            if S['debug_mode']:
+                print(lq_name, (cat_name, node_name, dtype), node)
+            if not node.readable:
                 print(node_name, 'Not Readable')
                 continue
                 
-            elif dtype == 'enum':
-                choices = self.cam.get_node_enum_values(node_name)
-                lq.change_choice_list(choices)
-                lq.update_value(self.cam.get_node_value(node_name))
-            elif dtype == 'float':
-                lq.update_value(self.cam.get_node_value(node_name))
-                lq.change_min_max(*self.cam.get_node_value_limits(node_name))
-            elif dtype == 'int':
-                lq.update_value(self.cam.get_node_value(node_name))
-                lq.change_min_max(*self.cam.get_node_value_limits(node_name))
+            if node.choices is not None:
+                lq.change_choice_list(node.choices)
+            if node.limits is not None:
+                lq.change_min_max(*node.limits)
+            lq.update_value(node.value)
             
             def read_func(nodeName=node_name):
                 if self.settings['debug_mode']:
@@ -104,31 +245,49 @@ class FlirCamHW(HardwareComponent):
                 return self.cam.get_node_value(nodeName)
             def write_func(val, nodeName=node_name):
                 self.cam.set_node_value(nodeName, val)
-            if not self.cam.get_node_is_writable(node_name):
+            if node_name in GeometryNodes:
+                def write_func(val, nodeName=node_name):
+                    self.write_geometry_node(nodeName, val)
+            if not node.writable:
                 write_func = None
                 lq.change_readonly(True)
             else:
                 lq.change_readonly(False)
                 
             lq.connect_to_hardware(read_func=read_func, write_func=write_func)
+        self.read_geometry()
         
         
         #S.acquiring.add_listener(self.check_for_read_only)
         S.acquiring.update_value(True)
 
         
+        self.pipeline.start()
+        S.shm_publish.connect_to_hardware(write_func=self.set_shm_publish)
+        S.shm_publish.write_to_hardware()
         self.update_thread_interrupted = False
         self.update_thread = threading.Thread(target=self.update_thread_run)
         self.update_thread.start()
         
+        self.telemetry_stop = threading.Event()
+        self.telemetry_thread = threading.Thread(target=self.telemetry_thread_run)
+        self.telemetry_thread.start()
+        
     def disconnect(self):
         self.settings.acquiring.update_value(False)
         self.settings.disconnect_all_from_hardware()
+        
+        if hasattr(self,'telemetry_thread'):
+            self.telemetry_stop.set()
+            self.telemetry_thread.join()
+            del self.telemetry_thread
        
         if hasattr(self,'update_thread'):
             self.update_thread_interrupted = True
-            self.update_thread.join(timeout=1.0)
+            self.update_thread.join(timeout=self.settings['grab_timeout'] + 1.0)
             del self.update_thread
+        self.pipeline.stop()
+        self.set_shm_publish(False)
         
         if hasattr(self,'cam'):
             self.cam.stop_acquisition()
@@ -145,29 +304,258 @@ class FlirCamHW(HardwareComponent):
             self.cam.stop_acquisition()
         self.check_for_read_only()
     
+    def feature_node_names(self):
+        return [node_name for (cat_name, node_name, dtype) in self.features.values()]
+    
     def check_for_read_only(self):
-        print('check_for_read_only')
-        time.sleep(0.001)
+        snapshot = self.cam.snapshot(self.feature_node_names(), values=False)
         for lq_name, (cat_name, node_name, dtype) in self.features.items():
+            if node_name in GeometryNodes:
+                # locked while acquiring, but written with acquisition paused
+                continue
             lq = self.settings.get_lq(lq_name)
-            writable = self.cam.get_node_is_writable(node_name)
-            print(lq_name, 'writable', writable)
-            if not writable:
-                lq.change_readonly(True)
-            else:
-                lq.change_readonly(False)
+            writable = snapshot[node_name].writable
+            if self.settings['debug_mode']:
+                print(lq_name, 'writable', writable)
+            lq.change_readonly(not writable)
 
     
+    def write_geometry_node(self, node_name, val):
+        "Writes a frame geometry node (GeometryNodes) with acquisition paused"
+        if node_name in ROI_NODE_ARGS:
+            # keeps the ROI on the sensor, e.g. a larger width moves the offset
+            self.cam.set_roi(**{ROI_NODE_ARGS[node_name]: val})
+        else:
+            self.cam.reconfigure([(node_name, val)])
+        self.read_geometry()
+    
+    def set_roi(self, offset_x=None, offset_y=None, width=None, height=None):
+        "Sets the sensor region of interest (binned pixels), see FlirCamInterface.set_roi"
+        roi = self.cam.set_roi(offset_x, offset_y, width, height)
+        self.read_geometry()
+        return roi
+    
+    def set_full_frame(self):
+        self.cam.set_full_frame()
+        self.read_geometry()
+    
+    def read_geometry(self):
+        """
+        Updates values and limits of the frame geometry settings, and the 
+        frame rate they limit. Width and height range up to the full 
+        (binned) sensor, set_roi moves the offset to fit.
+        """
+        geometry = [(lq_name, node_name) for lq_name, (cat_name, node_name, dtype) 
+                    in self.features.items() if node_name in GeometryNodes]
+        snapshot = self.cam.snapshot([node_name for lq_name, node_name in geometry])
+        for lq_name, node_name in geometry:
+            node = snapshot[node_name]
+            if not node.readable:
+                continue
+            lq = self.settings.get_lq(lq_name)
+            vmin, vmax = node.limits
+            if node_name in ('Width', 'Height') and self.cam.get_node_is_readable(node_name + 'Max'):
+                vmax = self.cam.get_node_value(node_name + 'Max')
+            lq.change_min_max(vmin, vmax)
+            lq.update_value(node.value, update_hardware=False)
+        self.settings.frame_rate.read_from_hardware()
+    
+    def set_stream_mode(self, mode):
+        "stream buffer preset (STREAM_PRESETS) or 'custom' (buffer_handling and buffer_count)"
+        S = self.settings
+        if mode == 'custom':
+            self.cam.set_stream_buffers(S['buffer_handling'], S['buffer_count'])
+        else:
+            self.cam.set_stream_preset(mode)
+        S.buffer_handling.change_readonly(mode != 'custom')
+        S.buffer_count.change_readonly(mode != 'custom')
+        if mode == 'custom':
+            # buffer count as clamped by the camera
+            handling, count = self.cam.get_stream_buffers()
+            S.buffer_count.update_value(count, update_hardware=False)
+    
+    def write_trigger(self, val=None):
+        S = self.settings
+        self.cam.set_trigger(S['trigger'], S['trigger_source'], S['trigger_activation'],
+                             S['trigger_delay'])
+    
+    def software_trigger(self):
+        self.cam.software_trigger()
+    
+    def acquire_stack(self, n, out=None, timeout=None, info=None):
+        """
+        Grabs a burst of n (triggered) frames into out, (n, height, width[, 3]),
+        in one locked loop, see FlirCamInterface.acquire_stack. The acquisition
+        thread waits meanwhile, the stack frames do not go to the frame ring.
+        timeout: seconds per frame, default grab_timeout.
+        Returns (out, camera timestamps in ns).
+        """
+        if timeout is None:
+            timeout = self.settings['grab_timeout']
+        return self.cam.acquire_stack(n, out, timeout=timeout, info=info)
+    
     def update_thread_run(self):
+        self._grab_error = None
         while not self.update_thread_interrupted:
             if self.settings['acquiring']:
-                self.img = self.cam.get_image()
-                self.img_buffer.append(self.img)
-                if len(self.img_buffer) > IMAGE_BUFFER_SIZE:
-                    self.img_buffer = self.img_buffer[-IMAGE_BUFFER_SIZE:]
-                self.settings.frame_rate.read_from_hardware()
+                try:
+                    self.grab_frame()
+                except FlirCamTimeoutError:
+                    # no frame (e.g. waiting for trigger), check for interrupt
+                    continue
+                except FlirCamIncompleteImageError:
+                    pass
+                except Exception as err:
+                    # e.g. a pixel format get_image can not decode: report once,
+                    # keep the thread alive so a new setting can take effect.
+                    # Acquisition stopped while waiting for a frame is not an error
+                    if self.settings['acquiring'] and repr(err) != self._grab_error:
+                        self._grab_error = repr(err)
+                        print(self.name, 'frame grab failed', err)
+                    time.sleep(0.1)
+                    continue
+                self._grab_error = None
+                if self.cam.n_incomplete != self.settings['n_incomplete'] or \
+                        self.cam.frame_gaps.n_missing != self.settings['n_dropped']:
+                    self.update_image_status_counts()
+            else:
+                time.sleep(0.01)
             #time.sleep(1/self.settings['frame_rate'])
             #time.sleep(1.0)
+    
+    def grab_frame(self):
+        "Acquire one frame, push it to the frame ring, the frame consumers and the pipeline"
+        info = dict()
+        self.img = self.cam.get_image(info=info, timeout=self.settings['grab_timeout'])
+        info['host_time'] = time.time()
+        info['t_enqueue'] = time.perf_counter()
+        self.frame_ring.push(self.img, info)
+        self.latency.record_frame(info)
+        for func in self.frame_consumers:
+            func(self.img, info)
+        if self.pipeline.roots:
+            self.pipeline.process(self.img, info)
+        
+    def telemetry_thread_run(self):
+        "Polls frame rates every telemetry_period, outside of the acquisition loop"
+        self._telemetry_last = None
+        while not self.telemetry_stop.wait(self.settings['telemetry_period']):
+            try:
+                self.update_telemetry()
+            except Exception as err:
+                print(self.name, 'telemetry failed', err)
+    
+    def update_telemetry(self):
+        S = self.settings
+        S.frame_rate.read_from_hardware()
+        S['frame_rate_camera'] = self.cam.get_resulting_frame_rate()
+        if self.cam.get_node_is_readable('StreamLostFrameCount'):
+            S['n_stream_lost'] = self.cam.get_node_value('StreamLostFrameCount')
+        S['pipeline_dropped'] = self.pipeline.n_dropped
+        pub = self.shm_publisher
+        st = self.pipeline.stages.get('shm_publish')
+        if pub is not None and st is not None:
+            S['shm_dropped'] = pub.n_oversize + st.n_dropped
+        
+        lat = self.latency.percentiles(S['latency_stage'])
+        if lat is not None:
+            S['latency_p50'], S['latency_p95'], S['latency_p99'] = 1e3*lat
+        
+        # host frame rate from the arrival times of the newest frames
+        latest = self.frame_ring.latest()
+        if latest is None:
+            return
+        seq, meta = latest[0], latest[2]
+        del latest
+        last = self._telemetry_last
+        if last is not None:
+            last_seq, last_t = last
+            if seq == last_seq:
+                S['frame_rate_host'] = 0.0
+            elif meta['host_time'] > last_t:
+                S['frame_rate_host'] = (seq - last_seq)/(meta['host_time'] - last_t)
+        self._telemetry_last = (seq, meta['host_time'])
+    
+    def set_latency_tracking(self):
+        self.latency.enabled = self.settings['latency_tracking']
+    
+    def export_latency_csv(self, fname=None):
+        "Saves the latency samples of all stages to a CSV file in the app's save_dir"
+        if fname is None:
+            fname = os.path.join(self.app.settings['save_dir'], 
+                                 "%i_%s_latency.csv" % (time.time(), self.name))
+        self.latency.save_csv(fname)
+        print(self.name, 'latency samples saved to', fname)
+        return fname
+    
+    @staticmethod
+    def status_lq_name(status_name):
+        "'IMAGE_CRC_CHECK_FAILED' -> 'n_crc_check_failed'"
+        return 'n_' + status_name.replace('IMAGE_', '', 1).lower()
+    
+    def update_image_status_counts(self):
+        S = self.settings
+        counts = self.cam.image_status_stats()
+        S['n_incomplete'] = self.cam.n_incomplete
+        S['n_dropped'] = self.cam.frame_gaps.n_missing
+        for status_name in FlirCamImageStatus[1:]:
+            S[self.status_lq_name(status_name)] = counts[status_name]
+        
+    def add_frame_consumer(self, func):
+        "func(img, info) is called from the acquisition thread for every new frame"
+        if func not in self.frame_consumers:
+            # replace rather than mutate, update_thread_run may be iterating
+            self.frame_consumers = self.frame_consumers + [func]
+    
+    def remove_frame_consumer(self, func):
+        self.frame_consumers = [f for f in self.frame_consumers if f != func]
+    
+    def add_pipeline_stage(self, name, func, after=None, threaded=False, **kwargs):
+        """
+        func(img, info) runs on every frame (after=None) or on the output of 
+        stage after, inline on the acquisition thread or, if threaded, on 
+        worker threads behind a bounded queue. See FramePipeline.add_stage
+        """
+        return self.pipeline.add_stage(name, func, after=after, threaded=threaded, **kwargs)
+    
+    def remove_pipeline_stage(self, name):
+        self.pipeline.remove_stage(name)
+    
+    def set_shm_publish(self, enable):
+        """
+        Starts or stops publishing frames to shared memory. Frames are
+        copied into the ring by a pipeline stage on its own thread, the
+        ring is created with the first frame.
+        """
+        if enable and 'shm_publish' not in self.pipeline.stages:
+            self.add_pipeline_stage('shm_publish', self.publish_shm_frame, threaded=True,
+                                    queue_size=4, policy='block', block_timeout=0.01)
+        elif not enable and 'shm_publish' in self.pipeline.stages:
+            self.remove_pipeline_stage('shm_publish')
+            if self.shm_publisher is not None:
+                self.shm_publisher.close()
+                self.shm_publisher = None
+    
+    def publish_shm_frame(self, img, info):
+        "pipeline stage of set_shm_publish"
+        pub = self.shm_publisher
+        if pub is not None and img.nbytes > pub.slot_bytes:
+            # frames grew (ROI, binning, pixel format), clients see the
+            # old ring closed and have to attach again
+            pub.close()
+            pub = self.shm_publisher = None
+        if pub is None:
+            S = self.settings
+            slot_bytes = max(int(S['shm_slot_size']*1e6), img.nbytes)
+            # a block of the same name is a leftover of a crashed session
+            pub = self.shm_publisher = FrameShmPublisher(S['shm_name'], S['shm_slots'],
+                                                         slot_bytes, replace=True)
+            print(self.name, 'publishing frames to shared memory', S['shm_name'])
+        pub.publish(img, info)
+    
+    def print_pipeline_stats(self):
+        for name, st in self.pipeline.stats().items():
+            print(self.name, 'pipeline', name, st)
         
     def set_debug_mode(self):
         self.cam.debug = self.settings['debug_mode']
\ No newline at end of file
@@ -1,56 +1,188 @@
+import asyncio
 import ctypes
+import functools
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from ctypes import byref, c_void_p, c_int, c_size_t, c_uint,c_uint16,POINTER,c_uint8, c_double,\
-    c_ulonglong
+    c_ulonglong, c_int64
 from .flircam_consts import FlirCamErrors, FlirCamImageStatus
+from .flircam_spin_api import SpinApi, bool8_t, _err, FlirCamError, FlirCamTimeoutError, \
+    FlirCamAccessError
 import platform
 import logging
-from threading import Lock
+from threading import RLock
 import time
 import numpy as np
 import os
-from ScopeFoundryHW.flircam.flircam_consts import SpinNodeTypeEnum
+from ScopeFoundryHW.flircam.flircam_consts import SpinNodeTypeEnum, NodeDependents, StreamNodes
+from .flircam_frame_pool import FramePool
+from .flircam_demosaic import Demosaicer, bayer_pattern
+from .flircam_unpack import get_unpacker
+from .flircam_chunk import CHUNK_FIELDS, CHUNK_DTYPE, FrameGapDetector
 
 
 logger = logging.getLogger(__name__)
 MAX_BUFF_LEN = 256
 
-def _err(retval):
-    if retval == 0:
-        return retval
-    else:
-        err_name = list(FlirCamErrors.keys())[list(FlirCamErrors.values()).index(retval)]
-        raise IOError( "Flircam Error {}: {}".format(retval, err_name))
-        raise IOError( "Flircam Error {}".format(retval))
+# result of FlirCamInterface.snapshot(), one per node
+# type: SpinNodeTypeEnum or None if node is not available
+# limits: (min, max) for integer and float nodes, choices: enum symbols
+NodeSnapshot = namedtuple('NodeSnapshot', 
+                          ['name', 'type', 'readable', 'writable', 'value', 'limits', 'choices'])
+
+INCOMPLETE_POLICIES = ('retry', 'flag', 'raise')
+
+# image_status_counts index of negative or unknown image status codes
+IMAGE_UNKNOWN_ERROR = FlirCamImageStatus.index('IMAGE_UNKNOWN_ERROR')
+
+# StreamBufferHandlingMode: which frame of the stream buffers GetNextImage returns
+#   'NewestOnly'            the newest, older frames are discarded 
+#   'OldestFirst'           the oldest, new frames are dropped when buffers are full
+#   'OldestFirstOverwrite'  the oldest, which is overwritten when buffers are full
+STREAM_HANDLING_MODES = ('NewestOnly', 'OldestFirst', 'OldestFirstOverwrite')
+
+# stream buffer presets: name -> (StreamBufferHandlingMode, StreamBufferCountManual)
+STREAM_PRESETS = OrderedDict([
+    ('live', ('NewestOnly', 3)),        # lowest latency, stale frames are skipped
+    ('record', ('OldestFirst', 200)),   # deep queue, every frame in order
+    ])
+
+# frame start trigger, see FlirCamInterface.set_trigger()
+TRIGGER_SOURCES = ('Software', 'Line0', 'Line1', 'Line2', 'Line3')
+TRIGGER_ACTIVATIONS = ('RisingEdge', 'FallingEdge', 'AnyEdge', 'LevelHigh', 'LevelLow')
+
+
+class FlirCamIncompleteImageError(IOError):
+    "get_image received an incomplete image, status: FlirCamImageStatus code"
+    
+    def __init__(self, status):
+        self.status = status
+        name = FlirCamImageStatus[status] if 0 <= status < len(FlirCamImageStatus) else status
+        IOError.__init__(self, "Flircam incomplete image: {}".format(name))
+
+
+class FrameDecoder(object):
+    """
+    Copies frames of one pixel format out of the SDK buffer into a frame
+    buffer: shape(height, width, nbytes) is the frame shape, 
+    decode(addr, nbytes, height, width, out) fills out from the nbytes 
+    at address addr.
+    Chosen once per pixel format by FlirCamInterface._get_frame_decoder(),
+    so per frame there is no format dispatch left.
+    """
+    
+    def __init__(self, pixel_format, dtype, channels=0, flat=False, 
+                 bayer=None, demosaicer=None, unpacker=None):
+        self.pixel_format = pixel_format
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.bayer = bayer
+        self.demosaicer = demosaicer
+        self.unpacker = unpacker
+        if flat:
+            self.shape = self._flat_shape
+        elif demosaicer is not None:
+            self.decode = self._demosaic
+        elif unpacker is not None:
+            self.decode = self._unpack
+    
+    def shape(self, height, width, nbytes):
+        if self.demosaicer is not None:
+            return self.demosaicer.output_shape((height, width))
+        if self.channels:
+            return (height, width, self.channels)
+        return (height, width)
+    
+    def _flat_shape(self, height, width, nbytes):
+        return (nbytes//self.dtype.itemsize,)
+    
+    def _sdk_array(self, addr, nbytes, dtype, shape):
+        "numpy view of the SDK buffer, only valid until the image is released"
+        nbytes = min(nbytes, int(np.prod(shape))*np.dtype(dtype).itemsize)
+        return np.frombuffer((ctypes.c_ubyte*nbytes).from_address(addr), dtype=dtype)
+    
+    def decode(self, addr, nbytes, height, width, out):
+        # single copy from the SDK buffer straight into the frame buffer
+        ctypes.memmove(out.ctypes.data, addr, min(out.nbytes, nbytes))
+    
+    def _demosaic(self, addr, nbytes, height, width, out):
+        # demosaic straight from the SDK buffer into the frame buffer
+        raw = self._sdk_array(addr, nbytes, self.dtype, (height, width)).reshape(height, width)
+        self.demosaicer(raw, self.bayer, out)
+    
+    def _unpack(self, addr, nbytes, height, width, out):
+        packed = self._sdk_array(addr, nbytes, np.uint8, (nbytes,))
+        self.unpacker(packed, out)
+
 
 class FlirCamInterface(object):
-    def __init__(self, debug=False):
+    def __init__(self, debug=False, lib=None):
+        """
+        lib: object to use in place of the SpinnakerC library, 
+            e.g. flircam_sim_lib.SimSpinnakerLib() to run without a camera
+        """
         self.debug = debug
         self.acquiring = False
         
-        if platform.architecture()[0] == '64bit':
-            libpath = r"C:\Program Files\Point Grey Research\Spinnaker\bin64\vs2015\SpinnakerC_v140.dll"
-            if not os.path.exists(libpath):
-                libpath = r"C:\Program Files\FLIR Systems\Spinnaker\bin64\vs2015\SpinnakerC_v140.dll"
+        if lib is not None:
+            self.lib = lib
         else:
-            libpath = r"C:\Program Files\Point Grey Research\Spinnaker\bin\vs2015\SpinnakerC_v140.dll"
-            
-        self.lib = ctypes.cdll.LoadLibrary(libpath)
-        self.lock = Lock()
+            if platform.architecture()[0] == '64bit':
+                libpath = r"C:\Program Files\Point Grey Research\Spinnaker\bin64\vs2015\SpinnakerC_v140.dll"
+                if not os.path.exists(libpath):
+                    libpath = r"C:\Program Files\FLIR Systems\Spinnaker\bin64\vs2015\SpinnakerC_v140.dll"
+            else:
+                libpath = r"C:\Program Files\Point Grey Research\Spinnaker\bin\vs2015\SpinnakerC_v140.dll"
+                
+            self.lib = ctypes.cdll.LoadLibrary(libpath)
+        # SpinnakerC functions with declared prototypes, raise FlirCamError on failure
+        self.api = SpinApi(self.lib)
+        # reentrant: paused_acquisition() holds it around node access that locks again
+        self.lock = RLock()
+        self.frame_pool = FramePool()
+        
+        # incomplete image handling, see get_image()
+        self.incomplete_policy = 'retry'
+        self.incomplete_retries = 3
+        # missing frame IDs of the returned frames, see flircam_chunk
+        self.frame_gaps = FrameGapDetector()
+        self.reset_image_status_counts()
+        
+        # (field, chunk name, is float) of the chunk data decoded per frame, see set_chunk_mode()
+        self._chunk_fields = []
+        self._chunk_frame_id = False
+        self._chunk_int = c_int64()
+        self._chunk_float = c_double()
+        
+        # per-camera node metadata cache, see invalidate_node_cache()
+        self._node_handles = dict()      # node name -> handle
+        self._node_types = dict()        # node name -> SpinNodeTypeEnum
+        self._node_limits = dict()       # node name -> (min, max)
+        self._node_incs = dict()         # integer node name -> increment
+        self._enum_tables = dict()       # node name -> enum entry table
+        self._pixel_format_names = dict()  # spinImageGetPixelFormat code -> name
+        self._frame_decoders = dict()      # spinImageGetPixelFormat code -> FrameDecoder or None
+        
+        # Bayer frames are converted to RGB on the host if set, see set_demosaic()
+        self.demosaicer = None
+        
+        # STREAM_PRESETS key applied by start_acquisition(), None: leave stream buffers as set
+        self.stream_preset = None
         
         if self.debug: print("Flircam initializing")
         
         with self.lock:
             self.hSystem = c_void_p()
-            _err(self.lib.spinSystemGetInstance(byref(self.hSystem)))
+            self.api.spinSystemGetInstance(byref(self.hSystem))
             if self.debug: print("hSystem " + str(self.hSystem))
             
             self.hCameraList = c_void_p()
-            _err(self.lib.spinCameraListCreateEmpty(byref(self.hCameraList)))
-            _err(self.lib.spinSystemGetCameras(self.hSystem, self.hCameraList))
+            self.api.spinCameraListCreateEmpty(byref(self.hCameraList))
+            self.api.spinSystemGetCameras(self.hSystem, self.hCameraList)
             if self.debug: print("hCameraList " + str(self.hCameraList))
             
             self.numCameras = c_size_t(0)
-            _err(self.lib.spinCameraListGetSize(self.hCameraList, byref(self.numCameras)))
+            self.api.spinCameraListGetSize(self.hCameraList, byref(self.numCameras))
             
         if self.numCameras == 0:
             self.release_system()
@@ -61,26 +193,31 @@ class FlirCamInterface(object):
                 print("Connecting to first camera")
         
         self.hCamera = c_void_p()
-        _err(self.lib.spinCameraListGet(self.hCameraList, 0, byref(self.hCamera)))
+        self.api.spinCameraListGet(self.hCameraList, 0, byref(self.hCamera))
         if self.debug: print("hCamera " + str(self.hCamera))
         
         hNodeMapTLDevice = c_void_p()
-        _err(self.lib.spinCameraGetTLDeviceNodeMap(self.hCamera, byref(hNodeMapTLDevice)))
+        self.api.spinCameraGetTLDeviceNodeMap(self.hCamera, byref(hNodeMapTLDevice))
         if self.debug: print("hNodeMapTLDevice " + str(hNodeMapTLDevice))
         
         if self.debug: print("Initializing camera")
-        _err(self.lib.spinCameraInit(self.hCamera))
+        self.api.spinCameraInit(self.hCamera)
         
         self.hNodeMap = c_void_p()
-        _err(self.lib.spinCameraGetNodeMap(self.hCamera, byref(self.hNodeMap)))
+        self.api.spinCameraGetNodeMap(self.hCamera, byref(self.hNodeMap))
         if self.debug: print("hNodeMap " + str(self.hNodeMap))
         
+        # stream buffer nodes (StreamNodes)
+        self.hNodeMapTLStream = c_void_p()
+        self.api.spinCameraGetTLStreamNodeMap(self.hCamera, byref(self.hNodeMapTLStream))
+        if self.debug: print("hNodeMapTLStream " + str(self.hNodeMapTLStream))
+        
         hAcquisitionMode = c_void_p()
-        _err(self.lib.spinNodeMapGetNode(self.hNodeMap, b"AcquisitionMode", byref(hAcquisitionMode)))
+        self.api.spinNodeMapGetNode(self.hNodeMap, b"AcquisitionMode", byref(hAcquisitionMode))
         if self.debug: print("hAcquisitionMode " + str(hAcquisitionMode))
         
         if self.debug: print("Setting acquisition mode to continuous.")
-        _err(self.lib.spinEnumerationSetIntValue(hAcquisitionMode, self.get_enum_int_by_name(hAcquisitionMode, b'Continuous')))
+        self.api.spinEnumerationSetIntValue(hAcquisitionMode, self.get_enum_int_by_name(hAcquisitionMode, b'Continuous'))
         
         if self.debug:
             print("Pixel Format Options", self.get_pixel_format_options())
@@ -96,113 +233,179 @@ class FlirCamInterface(object):
     def start_acquisition(self):
         if self.debug: print("Starting acquisition")
         if not self.acquiring:
-            _err(self.lib.spinCameraBeginAcquisition(self.hCamera))
+            # the camera frame counter restarts
+            self.frame_gaps.restart()
+            if self.stream_preset is not None and self.get_node_is_available('StreamBufferHandlingMode'):
+                self._write_stream_buffers(*STREAM_PRESETS[self.stream_preset])
+            self.api.spinCameraBeginAcquisition(self.hCamera)
+            self.acquiring = True
         
     def stop_acquisition(self):
         if self.debug: print("Stopping acquisition")
         if self.acquiring: 
-            _err(self.lib.spinCameraEndAcquisition(self.hCamera))
+            self.acquiring = False
+            self.api.spinCameraEndAcquisition(self.hCamera)
         
-    def get_image(self, save_jpg=False, return_timestamp=False):
+    def get_image(self, save_jpg=False, return_timestamp=False, out=None, info=None,
+                  timeout=None):
         """
         Returns numpy array of image
         for RGB8 images: Ny x Nx x 3 dtype=uint8
         
         if return_timestamp: returns timestamp in nanoseconds and image: (ts, img)
+        
+        timeout: seconds to wait for the next image, raises FlirCamTimeoutError
+            if none arrives. None waits indefinitely.
+        
+        The SDK buffer is copied once, into `out` if given (must match the
+        frame shape and dtype), otherwise into a buffer from self.frame_pool.
+        Pass the image to self.frame_pool.release() when done with it.
+        
+        if info is a dict, it is filled with per-frame metadata: 
+            'timestamp' (camera timestamp in ns), 'status', 'incomplete', 
+            'pixel_format', 't_grab' and 't_copy' (time.perf_counter() when
+            the image was received and copied, see flircam_latency)
+        
+        Incomplete images are handled according to self.incomplete_policy:
+            'retry': release and grab again, up to self.incomplete_retries
+                     times, then raise FlirCamIncompleteImageError
+            'flag':  return the partial image, info['incomplete'] is True
+            'raise': raise FlirCamIncompleteImageError
+        Image status codes are counted in self.image_status_counts.
         """
         hResultImage = c_void_p()
-        isIncomplete = ctypes.c_bool(True)
-        imageStatus = c_uint(-1)
+        isIncomplete = bool8_t(True)
+        imageStatus = c_int(-1)
         if self.debug: print("Grabbing image")
         with self.lock:
-            _err(self.lib.spinCameraGetNextImage(self.hCamera, byref(hResultImage)))
-            _err(self.lib.spinImageIsIncomplete(hResultImage, byref(isIncomplete)))
-            _err(self.lib.spinImageGetStatus(hResultImage, byref(imageStatus)))       
+            n_retry = 0
+            while True:
+                self._get_next_image(hResultImage, timeout)
+                t_grab = time.perf_counter()
+                try:
+                    self.api.spinImageIsIncomplete(hResultImage, byref(isIncomplete))
+                    self.api.spinImageGetStatus(hResultImage, byref(imageStatus))
+                except Exception:
+                    self.api.spinImageRelease(hResultImage)
+                    raise
+                status = imageStatus.value
+                if 0 <= status < len(FlirCamImageStatus):
+                    self.image_status_counts[status] += 1
+                else:
+                    self.image_status_counts[IMAGE_UNKNOWN_ERROR] += 1
+                if not isIncomplete.value:
+                    break
+                self.n_incomplete += 1
+                if self.debug: print('incomplete', status)
+                policy = self.incomplete_policy
+                if policy == 'flag':
+                    break
+                self.api.spinImageRelease(hResultImage)
+                if policy == 'raise' or n_retry >= self.incomplete_retries:
+                    raise FlirCamIncompleteImageError(status)
+                n_retry += 1
+                self.n_incomplete_retried += 1
             
-            #print("isIncomplete", isIncomplete.value)
-            i = 0
-            while isIncomplete.value:
-                print("not ready", i)
-                i += 1
-                if self.debug: print('incomplete',imageStatus)
-
-                _err(self.lib.spinImageRelease(hResultImage))
-                _err(self.lib.spinCameraGetNextImage(self.hCamera, byref(hResultImage)))
-                _err(self.lib.spinImageIsIncomplete(hResultImage, byref(isIncomplete)))
-                _err(self.lib.spinImageGetStatus(hResultImage, byref(imageStatus)))       
-                if imageStatus.value != 0:
-                    print(FlirCamImageStatus[imageStatus.value])
-
-            if imageStatus.value != 0:
-                print("status after", FlirCamImageStatus[imageStatus.value])
-
-            
-            if self.debug: print("hResultImage " + str(hResultImage))
+            # every exit from here on must release the image, or the stream runs out of buffers
+            try:
+                if self.debug: print("hResultImage " + str(hResultImage))
     
-            width = ctypes.c_uint(0)
-            height = ctypes.c_uint(0)
+                width = c_size_t(0)
+                height = c_size_t(0)
             
-            _err(self.lib.spinImageGetWidth(hResultImage,byref(width) ))
-            _err(self.lib.spinImageGetHeight(hResultImage,byref(height) ))
+                self.api.spinImageGetWidth(hResultImage,byref(width) )
+                self.api.spinImageGetHeight(hResultImage,byref(height) )
             
-            ts = ctypes.c_uint64()
-            self.lib.spinImageGetTimeStamp(hResultImage, byref(ts))
-            #print("timestamp", ts.value, time.time())
-            #https://www.flir.com/support-center/iis/machine-vision/knowledge-base/imaging-products-timestamping-and-different-timestamp-mechanisms/
+                ts = ctypes.c_uint64()
+                self.api.spinImageGetTimeStamp(hResultImage, byref(ts))
             
-            if self.debug: 
-                print("w x h: %d %d" % (width.value,height.value))
+                chunk = self._read_chunk_data(hResultImage) if self._chunk_fields else None
+                if self._chunk_frame_id:
+                    frame_id = int(chunk['frame_id'])
+                else:
+                    pFrameID = ctypes.c_uint64()
+                    self.api.spinImageGetFrameID(hResultImage, byref(pFrameID))
+                    frame_id = pFrameID.value
+                n_missing = self.frame_gaps.update(frame_id)
+                #print("timestamp", ts.value, time.time())
+                #https://www.flir.com/support-center/iis/machine-vision/knowledge-base/imaging-products-timestamping-and-different-timestamp-mechanisms/
             
-            width = width.value
-            height = height.value
-            #img_shape = (height.value, width.value)
-#             
-            pBitsPerPixel=c_uint(0)
-            _err(self.lib.spinImageGetBitsPerPixel(hResultImage, byref(pBitsPerPixel)))
-            #print("pBitsPerPixel", pBitsPerPixel.value)
+                if self.debug: 
+                    print("w x h: %d %d" % (width.value,height.value))
             
-            pPixelFormat =c_uint(0)
-            _err(self.lib.spinImageGetPixelFormat(hResultImage, byref(pPixelFormat)))
-            pixel_format = self.get_pixel_format()
-            if self.debug:
-                print(f'pixel format #{pPixelFormat.value}: {self.get_pixel_format()}' )
+                width = width.value
+                height = height.value
+                #img_shape = (height.value, width.value)
+    #             
+                pBitsPerPixel = c_size_t(0)
+                self.api.spinImageGetBitsPerPixel(hResultImage, byref(pBitsPerPixel))
+                #print("pBitsPerPixel", pBitsPerPixel.value)
             
+                pPixelFormat = c_int(0)
+                self.api.spinImageGetPixelFormat(hResultImage, byref(pPixelFormat))
+                pixel_format = self._pixel_format_names.get(pPixelFormat.value)
+                if pixel_format is None:
+                    pixel_format = self._pixel_format_names[pPixelFormat.value] = self.get_pixel_format()
+                if self.debug:
+                    print(f'pixel format #{pPixelFormat.value}: {pixel_format}' )
             
             
-            pSize = c_uint(0)
-            _err(self.lib.spinImageGetBufferSize(hResultImage, byref(pSize)))
-            if self.debug:
-                print("Buffer Size", pSize.value)
-            data = np.zeros(1, dtype=c_void_p)
-            _err(self.lib.spinImageGetData(hResultImage, data.ctypes))
-            if self.debug: print(data)
             
-            if self.debug:
-                print("BitsPerPixel", pBitsPerPixel.value)
-            if pixel_format in ('RGB8', 'RGB8Packed'):
-                img = np.frombuffer((c_uint8*pSize.value).from_address(int(data[0])), dtype=c_uint8).copy()
-                img = img[0:height*width*3].reshape(height, width, 3)
-            elif pixel_format == 'Mono8':
-                img = np.frombuffer((c_uint8*pSize.value).from_address(int(data[0])), dtype=c_uint8).copy()
-                img = img.reshape(height, width)
-            elif pBitsPerPixel.value == 8:
-                #print('8bits')
-                img = np.frombuffer((c_uint8*pSize.value).from_address(int(data[0])), dtype=c_uint8).copy()
-            elif pBitsPerPixel.value == 16:
-                #print('16bits')
-                img = np.frombuffer((c_uint8*pSize.value).from_address(int(data[0])), dtype=c_uint16).copy()
+                pSize = c_size_t(0)
+                self.api.spinImageGetBufferSize(hResultImage, byref(pSize))
+                if self.debug:
+                    print("Buffer Size", pSize.value)
+                pData = c_void_p()
+                self.api.spinImageGetData(hResultImage, byref(pData))
+                if self.debug: print(pData)
             
-            if self.debug:
-                print(img.shape)
-                #print(img.shape, img.reshape(1200,1920).shape)           
+                if self.debug:
+                    print("BitsPerPixel", pBitsPerPixel.value)
+                decoder = self._frame_decoders.get(pPixelFormat.value)
+                if decoder is None:
+                    decoder = self._get_frame_decoder(pPixelFormat.value, pixel_format, 
+                                                      pBitsPerPixel.value)
+                if decoder is None:
+                    raise ValueError("get_image unsupported pixel format {} ({} bits)".format(
+                        pixel_format, pBitsPerPixel.value))
+                shape = decoder.shape(height, width, pSize.value)
+                dtype = decoder.dtype
+            
+                if out is None:
+                    out = self.frame_pool.acquire(shape, dtype)
+                elif out.shape != shape or out.dtype != dtype or not out.flags.c_contiguous:
+                    raise ValueError("get_image out buffer {} {} does not match frame {} {}".format(
+                        out.shape, out.dtype, shape, dtype))
+                decoder.decode(pData.value, pSize.value, height, width, out)
+                t_copy = time.perf_counter()
+                img = out
+            
+                if self.debug:
+                    print(img.shape)
+                    #print(img.shape, img.reshape(1200,1920).shape)           
                         
-            if save_jpg:
-                t0 = time.time()
-                _err(self.lib.spinImageSave(hResultImage, b"flircam_test_%i.jpg" % t0, -1))
+                if save_jpg:
+                    t0 = time.time()
+                    self.api.spinImageSave(hResultImage, b"flircam_test_%i.jpg" % t0, -1)
     
-            #self.convert_img(hResultImage)
-            # _err(self.lib.spinImageDestroy(hConvertedImage))
-            _err(self.lib.spinImageRelease(hResultImage))
+                #self.convert_img(hResultImage)
+                # _err(self.lib.spinImageDestroy(hConvertedImage))
+            finally:
+                self.api.spinImageRelease(hResultImage)
+            
+            if info is not None:
+                info['timestamp'] = ts.value
+                info['status'] = status
+                info['incomplete'] = bool(isIncomplete.value)
+                info['pixel_format'] = pixel_format
+                info['t_grab'] = t_grab
+                info['t_copy'] = t_copy
+                info['frame_id'] = frame_id
+                info['n_missing'] = n_missing
+                if chunk is not None:
+                    info['chunk'] = chunk
+                else:
+                    info.pop('chunk', None)
             
             if return_timestamp:
                 return ts.value, img
@@ -210,11 +413,150 @@ class FlirCamInterface(object):
             return img#.reshape(img_shape)
         
         
+    def reset_image_status_counts(self):
+        # images seen per FlirCamImageStatus code (retried images included)
+        self.image_status_counts = [0]*len(FlirCamImageStatus)
+        self.n_incomplete = 0
+        self.n_incomplete_retried = 0
+        self.frame_gaps.reset()
+    
+    def image_status_stats(self):
+        "Returns OrderedDict FlirCamImageStatus name -> number of images"
+        return OrderedDict(zip(FlirCamImageStatus, self.image_status_counts))
+    
+    def set_chunk_mode(self, enabled, fields=tuple(CHUNK_FIELDS)):
+        """
+        Chunk data mode: the camera appends fields (CHUNK_FIELDS keys) to 
+        every frame, get_image decodes them into info['chunk'] (CHUNK_DTYPE,
+        fields not enabled are 0). Fields the camera does not offer are 
+        skipped. Acquisition is paused while switching.
+        Returns the enabled fields.
+        """
+        chunk_fields = []
+        with self.paused_acquisition():
+            if not self.get_node_is_available('ChunkModeActive'):
+                if enabled:
+                    print('flircam chunk mode not available')
+                enabled = False
+            elif not enabled:
+                self.set_node_value('ChunkModeActive', False)
+            else:
+                self.set_node_value('ChunkModeActive', True)
+                selectors = self.get_node_enum_values('ChunkSelector')
+                for field in fields:
+                    entry, kind = CHUNK_FIELDS[field]
+                    if entry not in selectors:
+                        continue
+                    self.set_node_value('ChunkSelector', entry)
+                    self.set_node_value('ChunkEnable', True)
+                    chunk_fields.append((field, ('Chunk' + entry).encode(), kind == 'float'))
+            self._chunk_fields = chunk_fields
+            # frame gaps are detected from the camera's frame counter if available
+            self._chunk_frame_id = 'frame_id' in [f[0] for f in chunk_fields]
+        return [f[0] for f in chunk_fields]
+    
+    def _read_chunk_data(self, hImage):
+        "CHUNK_DTYPE record of the chunk data of hImage"
+        chunk = np.zeros((), dtype=CHUNK_DTYPE)
+        for field, name, is_float in self._chunk_fields:
+            if is_float:
+                self.api.spinImageChunkDataGetFloatValue(hImage, name, byref(self._chunk_float))
+                chunk[field] = self._chunk_float.value
+            else:
+                self.api.spinImageChunkDataGetIntValue(hImage, name, byref(self._chunk_int))
+                chunk[field] = self._chunk_int.value
+        return chunk
+    
+    def set_demosaic(self, mode):
+        """
+        mode: 'bilinear' or 'superpixel' (half resolution): get_image returns 
+        Bayer frames as RGB, see flircam_demosaic. 
+        None or 'off': raw (height, width) Bayer frames
+        """
+        if mode in (None, 'off'):
+            self.demosaicer = None
+        elif self.demosaicer is None or self.demosaicer.mode != mode:
+            self.demosaicer = Demosaicer(mode)
+        self._frame_decoders.clear()
+    
+    def _get_frame_decoder(self, pixel_format_code, pixel_format, bits_per_pixel):
+        """
+        FrameDecoder for frames of pixel_format, cached per pixel format code.
+        None if the format is not supported.
+        
+        Bayer        raw (height, width), or RGB with set_demosaic()
+        packed mono  unpacked into (height, width) uint16, see flircam_unpack
+        RGB8         (height, width, 3) uint8
+        Mono8/16     (height, width) uint8/uint16, also Mono10/Mono12 (16 bit containers)
+        other 8 and 16 bit formats: flat array of the buffer
+        """
+        name = pixel_format or ''
+        bayer = bayer_pattern(name)
+        unpacker = get_unpacker(name)
+        dtype = np.uint8 if bits_per_pixel == 8 else np.uint16
+        if bayer is not None and bits_per_pixel in (8, 16):
+            if self.get_node_is_readable('PixelColorFilter'):
+                # tile order as reported by the camera, e.g. after ReverseX
+                bayer = bayer_pattern(self.get_node_enum_by_name('PixelColorFilter')) or bayer
+            decoder = FrameDecoder(name, dtype, bayer=bayer, demosaicer=self.demosaicer)
+        elif unpacker is not None:
+            decoder = FrameDecoder(name, np.uint16, unpacker=unpacker)
+        elif name in ('RGB8', 'RGB8Packed'):
+            decoder = FrameDecoder(name, np.uint8, channels=3)
+        elif name.startswith('Mono') and bits_per_pixel in (8, 16):
+            decoder = FrameDecoder(name, dtype)
+        elif bits_per_pixel in (8, 16):
+            decoder = FrameDecoder(name, dtype, flat=True)
+        else:
+            decoder = None
+        if decoder is not None:
+            self._frame_decoders[pixel_format_code] = decoder
+        return decoder
+    
+    def _get_next_image(self, hResultImage, timeout=None):
+        "next image handle into hResultImage, waits at most timeout seconds if given"
+        if timeout is None:
+            self.api.spinCameraGetNextImage(self.hCamera, byref(hResultImage))
+        else:
+            self.api.spinCameraGetNextImageEx(self.hCamera, max(0, int(timeout*1e3)), 
+                                              byref(hResultImage))
+    
+    async def frames(self, timeout=1.0, max_frames=None, executor=None):
+        """
+        Asynchronous frame iterator, yields (img, info):
+        
+            async for img, info in cam.frames(timeout=0.5):
+                ...
+                cam.frame_pool.release(img)
+        
+        Each get_image(timeout=timeout) call runs in executor (default: the
+        event loop's thread pool), so the event loop is free while waiting
+        for the camera. Grab timeouts are skipped, iteration ends after 
+        max_frames frames or when acquisition is stopped. A cancelled
+        iteration still finishes its pending grab within timeout.
+        """
+        loop = asyncio.get_event_loop()
+        n = 0
+        while self.acquiring and (max_frames is None or n < max_frames):
+            info = dict()
+            grab = functools.partial(self.get_image, out=None, info=info, timeout=timeout)
+            try:
+                img = await loop.run_in_executor(executor, grab)
+            except FlirCamTimeoutError:
+                continue
+            except FlirCamError:
+                # acquisition stopped while grabbing
+                if not self.acquiring:
+                    return
+                raise
+            n += 1
+            yield img, info
+        
     def convert_img(self, spin_img):
 
             hConvertedImage = c_void_p()
-            _err(self.lib.spinImageCreateEmpty(byref(hConvertedImage)))
-            _err(self.lib.spinImageConvert(spin_img, 0, hConvertedImage))
+            self.api.spinImageCreateEmpty(byref(hConvertedImage))
+            self.api.spinImageConvert(spin_img, 0, hConvertedImage)
               
             if self.debug: print("hConvertedImage " + str(hConvertedImage))
             
@@ -227,7 +569,7 @@ class FlirCamInterface(object):
             #del ppData
             #img = np.ones((1200,1920),dtype=np.uint16)
             #_err(self.lib.spinImageGetData(hResultImage, byref(img.ctypes.data_as(POINTER(c_uint16)))))
-            _err(self.lib.spinImageDestroy(hConvertedImage))
+            self.api.spinImageDestroy(hConvertedImage)
 #
         # // Assuming image is 640 x 480 resolution. The current pixel format as well as PixelColorFilter indicate the Bayer Tile Mapping for the camera. For example, BayerRG8 is RGGB. 
         # 
@@ -244,91 +586,119 @@ class FlirCamInterface(object):
 
     def release_camera(self):
         if hasattr(self,'hCamera'):
-            _err(self.lib.spinCameraRelease(self.hCamera))
+            self.api.spinCameraRelease(self.hCamera)
         
     def release_system(self):
         if hasattr(self,'hCameraList'):
-            _err(self.lib.spinCameraListClear(self.hCameraList))
-            _err(self.lib.spinCameraListDestroy(self.hCameraList))
+            self.api.spinCameraListClear(self.hCameraList)
+            self.api.spinCameraListDestroy(self.hCameraList)
         if hasattr(self,'hSystem'):
-            _err(self.lib.spinSystemReleaseInstance(self.hSystem))
+            self.api.spinSystemReleaseInstance(self.hSystem)
         
     def get_enum_int_by_name(self, hEnumNode, name):
         hEnumEntry = c_void_p()
-        enumInt = c_int()
-        _err(self.lib.spinEnumerationGetEntryByName(hEnumNode, name, byref(hEnumEntry)))
-        _err(self.lib.spinEnumerationEntryGetIntValue(hEnumEntry, byref(enumInt)))
+        enumInt = c_int64()
+        self.api.spinEnumerationGetEntryByName(hEnumNode, name, byref(hEnumEntry))
+        self.api.spinEnumerationEntryGetIntValue(hEnumEntry, byref(enumInt))
         return enumInt.value
     
     def get_enum_name_by_int(self, hEnumNode, index):
         hEnumEntry = c_void_p()
-        enumInd = c_uint(index)
-        _err(self.lib.spinEnumerationGetEntryByIndex(hEnumNode, enumInd, byref(hEnumEntry)))
+        self.api.spinEnumerationGetEntryByIndex(hEnumNode, index, byref(hEnumEntry))
         
         enumSym = ctypes.create_string_buffer(MAX_BUFF_LEN)
         lenEnumSym = c_size_t(MAX_BUFF_LEN)
-        _err(self.lib.spinEnumerationEntryGetSymbolic(hEnumEntry,byref(enumSym),byref(lenEnumSym)))
+        self.api.spinEnumerationEntryGetSymbolic(hEnumEntry,enumSym,byref(lenEnumSym))
 
         return str(enumSym.value,'utf8')
             
     def print_device_info(self):
         print("\n*** FLIRCAM DEVICE INFORMATION ***\n\n")
         hNodeMapTLDevice = c_void_p()
-        _err(self.lib.spinCameraGetTLDeviceNodeMap(self.hCamera, byref(hNodeMapTLDevice)))
+        self.api.spinCameraGetTLDeviceNodeMap(self.hCamera, byref(hNodeMapTLDevice))
         if self.debug: print("hNodeMapTLDevice " + str(hNodeMapTLDevice))
         
         # Retrieve device information category node
         hDeviceInformation = c_void_p()
-        _err(self.lib.spinNodeMapGetNode(hNodeMapTLDevice, b"DeviceInformation", byref(hDeviceInformation)))
+        self.api.spinNodeMapGetNode(hNodeMapTLDevice, b"DeviceInformation", byref(hDeviceInformation))
         if self.debug: print('hDeviceInformation ' + str(hDeviceInformation))
         
         # Retrieve number of nodes within device information node
-        numFeatures = c_uint(0)
-        _err(self.lib.spinCategoryGetNumFeatures(hDeviceInformation, byref(numFeatures)))
-        
-        # Iterate through nodes and print information
-        for i in range(numFeatures.value):
-            hFeatureNode = c_void_p()
-            ii = c_size_t(i)
-            _err(self.lib.spinCategoryGetFeatureByIndex(hDeviceInformation, ii, byref(hFeatureNode)))
-
-            featureType = c_int(-1);
-
-            # get feature node name
-            featureName = ctypes.create_string_buffer(MAX_BUFF_LEN)
-            lenFeatureName = c_size_t(MAX_BUFF_LEN)
-            _err(self.lib.spinNodeGetName(hFeatureNode, featureName, byref(lenFeatureName)))
-            _err(self.lib.spinNodeGetType(hFeatureNode, byref(featureType)))
-        
-            featureValue = ctypes.create_string_buffer(MAX_BUFF_LEN)
-            lenFeatureValue = c_size_t(MAX_BUFF_LEN)
-
-            _err(self.lib.spinNodeToString(hFeatureNode, featureValue, byref(lenFeatureValue)))
+        numFeatures = c_size_t(0)
+        self.api.spinCategoryGetNumFeatures(hDeviceInformation, byref(numFeatures))
+        
+        # Read all nodes in one locked pass, then print information
+        features = []
+        with self.lock:
+            for i in range(numFeatures.value):
+                hFeatureNode = c_void_p()
+                self.api.spinCategoryGetFeatureByIndex(hDeviceInformation, i, byref(hFeatureNode))
+    
+                # get feature node name
+                featureName = ctypes.create_string_buffer(MAX_BUFF_LEN)
+                lenFeatureName = c_size_t(MAX_BUFF_LEN)
+                self.api.spinNodeGetName(hFeatureNode, featureName, byref(lenFeatureName))
+            
+                featureValue = ctypes.create_string_buffer(MAX_BUFF_LEN)
+                lenFeatureValue = c_size_t(MAX_BUFF_LEN)
+    
+                self.api.spinNodeToString(hFeatureNode, featureValue, byref(lenFeatureValue))
+                features.append((str(featureName.value,'utf8'), str(featureValue.value,'utf8')))
 
-            print("%s: %s" % (str(featureName.value,'utf8'), str(featureValue.value,'utf8')))
+        for name, value in features:
+            print("%s: %s" % (name, value))
     
     def get_exposure_time(self):
         hExposureTime = self.get_node("ExposureTime")
     
         exp_time = c_double()
-        _err(self.lib.spinFloatGetValue(hExposureTime,byref(exp_time)))
+        self.api.spinFloatGetValue(hExposureTime,byref(exp_time))
         if self.debug: print("exp_time " + str(exp_time))
 
         return exp_time.value*1e-6
     
     def set_exposure_time(self,t):
-        hExposureTime = self.get_node("ExposureTime")
-        (minval, maxval) = self.get_exposure_lims()
-        exp_time = c_double(max(min(t,maxval),minval)*1e6)
-        _err(self.lib.spinFloatSetValue(hExposureTime,exp_time))
+        "Sets ExposureTime to t (s), clamped to its limits"
+        self.set_node_value_clamped("ExposureTime", t*1e6)
     
     def get_node(self,nodeName):
-        nodeHandle = c_void_p()
-        if isinstance(nodeName, str):
-            nodeName = nodeName.encode('utf-8')
-        _err(self.lib.spinNodeMapGetNode(self.hNodeMap,nodeName,byref(nodeHandle)))
-        if self.debug: print("%s: %s" % (nodeName,str(nodeHandle)))
+        "Returns the node handle of nodeName, looked up once per camera"
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        nodeHandle = self._node_handles.get(nodeName)
+        if nodeHandle is None:
+            nodeHandle = c_void_p()
+            hNodeMap = self.hNodeMapTLStream if nodeName in StreamNodes else self.hNodeMap
+            self.api.spinNodeMapGetNode(hNodeMap,nodeName.encode('utf-8'),byref(nodeHandle))
+            if self.debug: print("%s: %s" % (nodeName,str(nodeHandle)))
+            self._node_handles[nodeName] = nodeHandle
         return nodeHandle
+    
+    def invalidate_node_cache(self, nodeName=None):
+        """
+        Drop cached limits and enum tables of nodeName and of the nodes
+        it affects (see NodeDependents). Call after writing nodeName.
+        With nodeName=None, the whole metadata cache is cleared.
+        Node handles and types are fixed for the life of the node map
+        and are kept.
+        """
+        if nodeName is None:
+            self._node_limits.clear()
+            self._node_incs.clear()
+            self._enum_tables.clear()
+            self._pixel_format_names.clear()
+            self._frame_decoders.clear()
+            return
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        for name in (nodeName,) + NodeDependents.get(nodeName, ()):
+            self._node_limits.pop(name, None)
+            self._node_incs.pop(name, None)
+            self._enum_tables.pop(name, None)
+        if nodeName == 'PixelFormat':
+            self._pixel_format_names.clear()
+        if nodeName in ('PixelFormat', 'ReverseX', 'ReverseY'):
+            self._frame_decoders.clear()
              
     def get_auto_exposure(self):
 #         hExposureAuto = self.get_node("ExposureAuto")
@@ -352,56 +722,72 @@ class FlirCamInterface(object):
         if ind == setIndex:
             return
         elif ind < numVals:
-            _err(self.lib.spinEnumerationSetIntValue(hExposureAuto,ind))
+            self.api.spinEnumerationSetIntValue(hExposureAuto,ind)
+            self.invalidate_node_cache("ExposureAuto")
         else: 
             print("Error! Cannot set that auto exposure value")
     
-    def get_node_enum_values(self,nodeName):
-        "Returns a list of names of allowed Enums for the given node"
+    def get_enum_table(self, nodeName):
+        """
+        Returns the cached entry table of enum node nodeName:
+        {'symbols': [symbolic names in index order],
+         'by_symbol': {symbolic: int value},
+         'by_entry': {entry handle: (symbolic, int value)}}
+        """
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        table = self._enum_tables.get(nodeName)
+        if table is not None:
+            return table
         nodeHandle = self.get_node(nodeName)
-        numVals = c_uint()
-        _err(self.lib.spinEnumerationGetNumEntries(nodeHandle,byref(numVals)))
+        numVals = c_size_t()
+        self.api.spinEnumerationGetNumEntries(nodeHandle,byref(numVals))
         
-        enumList = list()
+        table = dict(symbols=[], by_symbol=dict(), by_entry=dict())
         for i in range(numVals.value):
-            this_val = self.get_enum_name_by_int(nodeHandle, i)
-            enumList.append(this_val)
-            if self.debug: print("%d %s" % (i, this_val))
-        return enumList
-        
+            hEnumEntry = c_void_p()
+            self.api.spinEnumerationGetEntryByIndex(nodeHandle, i, byref(hEnumEntry))
+            sym = self._get_enum_entry_symbolic(hEnumEntry)
+            enumInt = c_int64()
+            self.api.spinEnumerationEntryGetIntValue(hEnumEntry, byref(enumInt))
+            table['symbols'].append(sym)
+            table['by_symbol'][sym] = enumInt.value
+            table['by_entry'][hEnumEntry.value] = (sym, enumInt.value)
+            if self.debug: print("%d %s %d" % (i, sym, enumInt.value))
+        self._enum_tables[nodeName] = table
+        return table
     
-    def get_node_enum_index(self, nodeName):
-        "Returns the integer index of the value of nodeName"
+    def _get_enum_entry_symbolic(self, hEnumEntry):
+        enumSym = ctypes.create_string_buffer(MAX_BUFF_LEN)
+        lenEnumSym = c_size_t(MAX_BUFF_LEN)
+        self.api.spinEnumerationEntryGetSymbolic(hEnumEntry,enumSym,byref(lenEnumSym))
+        return str(enumSym.value,'utf8')
+    
+    def _get_node_enum_current(self, nodeName):
+        "Returns (symbolic, int value) of the current entry of nodeName"
         hEnum = self.get_node(nodeName)
         pEnum = c_void_p()
-        enumSymbolic = ctypes.create_string_buffer(MAX_BUFF_LEN)
-        lenSymbolic = c_size_t(MAX_BUFF_LEN)
-        enumIndex = c_uint()
-        
-        _err(self.lib.spinEnumerationGetCurrentEntry(hEnum,byref(pEnum)))
+        self.api.spinEnumerationGetCurrentEntry(hEnum,byref(pEnum))
         if self.debug: print("ph%s %s" % (nodeName, str(pEnum)))
-        _err(self.lib.spinEnumerationEntryGetSymbolic(pEnum,byref(enumSymbolic),byref(lenSymbolic)))
-        if self.debug: print("%s %s" % (nodeName, str(enumSymbolic.value,'utf8')))
-        _err(self.lib.spinEnumerationEntryGetIntValue(pEnum,byref(enumIndex)))
-        if self.debug: print("indVal%s %d" % (nodeName, enumIndex.value))
-        return enumIndex.value
+        entry = self.get_enum_table(nodeName)['by_entry'].get(pEnum.value)
+        if entry is None:
+            # entry handle not in table, ask the entry itself
+            enumIndex = c_int64()
+            self.api.spinEnumerationEntryGetIntValue(pEnum,byref(enumIndex))
+            entry = (self._get_enum_entry_symbolic(pEnum), enumIndex.value)
+        if self.debug: print("%s %s %d" % (nodeName, entry[0], entry[1]))
+        return entry
+    
+    def get_node_enum_values(self,nodeName):
+        "Returns a list of names of allowed Enums for the given node"
+        return list(self.get_enum_table(nodeName)['symbols'])
+    
+    def get_node_enum_index(self, nodeName):
+        "Returns the integer index of the value of nodeName"
+        return self._get_node_enum_current(nodeName)[1]
     
     def get_node_enum_by_name(self, nodeName):
-
-        hEnum = self.get_node(nodeName)
-        pEnum = c_void_p()
-        enumSymbolic = ctypes.create_string_buffer(MAX_BUFF_LEN)
-        lenSymbolic = c_size_t(MAX_BUFF_LEN)
-        enumIndex = c_uint()
-        
-        _err(self.lib.spinEnumerationGetCurrentEntry(hEnum,byref(pEnum)))
-        if self.debug: print("ph%s %s" % (nodeName, str(pEnum)))
-        _err(self.lib.spinEnumerationEntryGetSymbolic(pEnum,byref(enumSymbolic),byref(lenSymbolic)))
-        if self.debug: print("%s %s" % (nodeName, str(enumSymbolic.value,'utf8')))
-        _err(self.lib.spinEnumerationEntryGetIntValue(pEnum,byref(enumIndex)))
-        if self.debug: print("indVal%s %d" % (nodeName, enumIndex.value))
-        
-        val = enumSymbolic.value.decode()
+        val = self._get_node_enum_current(nodeName)[0]
         if self.debug: print("get_node_enum_by_name", nodeName, val)
         return val
     
@@ -415,28 +801,228 @@ class FlirCamInterface(object):
         return self.get_node_enum_by_name('PixelFormat')
 
     def get_frame_rate(self):
+        "requested frame rate (Hz)"
         return self.get_float_value("AcquisitionFrameRate")
     
+    def get_resulting_frame_rate(self):
+        "frame rate (Hz) the camera reports it achieves with the current settings"
+        if not self.get_node_is_available("AcquisitionResultingFrameRate"):
+            return self.get_frame_rate()
+        return self.get_float_value("AcquisitionResultingFrameRate")
+    
     def get_float_value(self, nodeName):
         hNode = self.get_node(nodeName)
         val = c_double()
-        _err(self.lib.spinFloatGetValue(hNode,byref(val)))
+        self.api.spinFloatGetValue(hNode,byref(val))
         return val.value
 
 
     def set_frame_rate(self,val):
-        #TODO
-        pass
+        """
+        Sets AcquisitionFrameRate to val (Hz), clamped to the node limits. 
+        Manual frame rate control is enabled first (AcquisitionFrameRateEnable,
+        or AcquisitionFrameRateAuto 'Off' on older firmware). 
+        val <= 0 disables manual control: the camera runs as fast as 
+        exposure and bandwidth allow.
+        """
+        manual = val > 0
+        if self.get_node_is_available("AcquisitionFrameRateEnable"):
+            if bool(self.get_node_value("AcquisitionFrameRateEnable")) != manual:
+                self.set_node_value("AcquisitionFrameRateEnable", manual)
+        elif self.get_node_is_available("AcquisitionFrameRateAuto"):
+            auto = 'Off' if manual else 'Continuous'
+            if self.get_node_value("AcquisitionFrameRateAuto") != auto:
+                self.set_node_value("AcquisitionFrameRateAuto", auto)
+        if not manual:
+            return
+        self.set_node_value_clamped("AcquisitionFrameRate", val)
         
-    def get_exposure_lims(self):
-        hExposureTime = self.get_node(b"ExposureTime")
+    @contextmanager
+    def paused_acquisition(self):
+        """
+        Context manager for changes to nodes that are locked while acquiring
+        (GeometryNodes, ...): holds self.lock, so get_image() waits,
+        stops acquisition for the block and restarts it afterwards if it was 
+        running. Free frame buffers are dropped, the frame shape may change.
+        """
+        with self.lock:
+            was_acquiring = self.acquiring
+            self.stop_acquisition()
+            try:
+                yield
+            finally:
+                self.frame_pool.clear()
+                if was_acquiring:
+                    self.start_acquisition()
+    
+    def reconfigure(self, node_values):
+        "Writes (nodeName, value) pairs of node_values in order, acquisition paused"
+        with self.paused_acquisition():
+            for nodeName, val in node_values:
+                self.set_node_value(nodeName, val)
+    
+    def set_trigger(self, enabled, source='Software', activation='RisingEdge', delay=None):
+        """
+        Frame start trigger. enabled: every frame waits for a trigger from
+        source (TRIGGER_SOURCES, 'Software': see software_trigger()), 
+        otherwise the camera runs free. activation (TRIGGER_ACTIVATIONS) 
+        applies to line sources. delay: TriggerDelay in s, clamped to its 
+        limits, None keeps it. TriggerMode is off while the source changes.
+        """
+        if self.get_node_is_writable('TriggerSelector') and \
+                self.get_node_value('TriggerSelector') != 'FrameStart':
+            self.set_node_value('TriggerSelector', 'FrameStart')
+        if self.get_node_value('TriggerMode') != 'Off':
+            self.set_node_value('TriggerMode', 'Off')
+        if not enabled:
+            return
+        self.set_node_value('TriggerSource', source)
+        if source != 'Software' and self.get_node_is_writable('TriggerActivation'):
+            self.set_node_value('TriggerActivation', activation)
+        if delay is not None and self.get_node_is_writable('TriggerDelay'):
+            self.set_node_value_clamped('TriggerDelay', delay*1e6)
+        self.set_node_value('TriggerMode', 'On')
     
-        exp_time_min = c_double()
-        exp_time_max = c_double()
+    def get_trigger_source(self):
+        "TriggerSource if the frame start trigger is on, else None"
+        if not self.get_node_is_readable('TriggerMode') or self.get_node_value('TriggerMode') != 'On':
+            return None
+        return self.get_node_value('TriggerSource')
+    
+    def software_trigger(self):
+        "Starts a frame, with TriggerSource 'Software'"
+        self.api.spinCommandExecute(self.get_node('TriggerSoftware'))
+    
+    def acquire_stack(self, n, out=None, timeout=None, info=None):
+        """
+        Grabs n frames into out, (n, height, width[, 3]) as from get_image(),
+        in a single loop holding self.lock. out is allocated after the first
+        frame if None. With a software trigger every frame is triggered 
+        here, otherwise the loop waits for n hardware triggers (or takes the
+        next n free running frames). timeout: seconds per frame.
         
-        _err(self.lib.spinFloatGetMin(hExposureTime,byref(exp_time_min)))
-        _err(self.lib.spinFloatGetMax(hExposureTime,byref(exp_time_max)))
-        retval = (exp_time_min.value*1e-6,exp_time_max.value*1e-6)
+        An incomplete frame is triggered again (software trigger) or kept
+        and flagged (hardware trigger, one frame per trigger). With
+        incomplete_policy 'raise', FlirCamIncompleteImageError is raised.
+        Acquisition is started for the stack if it is not running.
+        
+        Returns (out, timestamps), camera timestamps in ns (uint64). 
+        If info is a dict it is filled with per-frame arrays 
+        't_grab' (time.perf_counter()) and 'incomplete'.
+        """
+        timestamps = np.zeros(n, dtype=np.uint64)
+        t_grab = np.zeros(n)
+        incomplete = np.zeros(n, dtype=bool)
+        frame_info = dict()
+        with self.lock:
+            software = self.get_trigger_source() == 'Software'
+            policy = self.incomplete_policy
+            if policy != 'raise':
+                self.incomplete_policy = 'raise' if software else 'flag'
+            started = not self.acquiring
+            self.start_acquisition()
+            try:
+                for i in range(n):
+                    for n_retry in range(self.incomplete_retries + 1):
+                        if software:
+                            self.software_trigger()
+                        try:
+                            if out is None:
+                                img = self.get_image(info=frame_info, timeout=timeout)
+                                out = np.empty((n,) + img.shape, dtype=img.dtype)
+                                out[0] = img
+                                self.frame_pool.release(img)
+                            else:
+                                self.get_image(out=out[i], info=frame_info, timeout=timeout)
+                            break
+                        except FlirCamIncompleteImageError:
+                            if policy == 'raise' or n_retry == self.incomplete_retries:
+                                raise
+                            self.n_incomplete_retried += 1
+                    timestamps[i] = frame_info['timestamp']
+                    t_grab[i] = frame_info['t_grab']
+                    incomplete[i] = frame_info['incomplete']
+            finally:
+                self.incomplete_policy = policy
+                if started:
+                    self.stop_acquisition()
+        if info is not None:
+            info['t_grab'] = t_grab
+            info['incomplete'] = incomplete
+        return out, timestamps
+    
+    def get_stream_buffers(self):
+        "Returns (StreamBufferHandlingMode, number of stream buffers)"
+        return (self.get_node_value('StreamBufferHandlingMode'), 
+                self.get_node_value('StreamBufferCountResult'))
+    
+    def set_stream_buffers(self, handling_mode=None, buffer_count=None):
+        """
+        Sets StreamBufferHandlingMode (see STREAM_HANDLING_MODES) and the
+        number of stream buffers (StreamBufferCountManual, clamped to its
+        limits), None keeps the current setting. Buffers are allocated
+        when acquisition starts, a running acquisition is restarted if
+        anything changes. Replaces self.stream_preset.
+        """
+        self.stream_preset = None
+        self._write_stream_buffers(handling_mode, buffer_count)
+    
+    def set_stream_preset(self, preset):
+        "Applies STREAM_PRESETS[preset] now and whenever acquisition starts"
+        handling_mode, buffer_count = STREAM_PRESETS[preset]
+        # set first, a restart of the acquisition applies the preset
+        self.stream_preset = preset
+        self._write_stream_buffers(handling_mode, buffer_count)
+    
+    def _write_stream_buffers(self, handling_mode=None, buffer_count=None):
+        writes = []
+        if handling_mode is not None and \
+                handling_mode != self.get_node_value('StreamBufferHandlingMode'):
+            writes.append(('StreamBufferHandlingMode', handling_mode))
+        if buffer_count is not None:
+            if self.get_node_value('StreamBufferCountMode') != 'Manual':
+                writes.append(('StreamBufferCountMode', 'Manual'))
+            if self.snap_node_value('StreamBufferCountManual', buffer_count) != \
+                    self.get_node_value('StreamBufferCountManual'):
+                writes.append(('StreamBufferCountManual', buffer_count))
+        if writes:
+            self.reconfigure(writes)
+    
+    def get_roi(self):
+        "Returns sensor region of interest (offset_x, offset_y, width, height), in binned pixels"
+        return tuple(self.get_node_value(name) for name in ('OffsetX', 'OffsetY', 'Width', 'Height'))
+    
+    def set_roi(self, offset_x=None, offset_y=None, width=None, height=None):
+        """
+        Sets the sensor region of interest, None keeps the current value.
+        Values are snapped to the node increments, a region that extends
+        past the sensor is moved back onto it (or shrunk).
+        Acquisition is paused while writing. Returns the new get_roi()
+        """
+        roi = self.get_roi()
+        with self.paused_acquisition():
+            for axis, off, size in (('X', offset_x, width), ('Y', offset_y, height)):
+                if off is None and size is None:
+                    continue
+                off_name, size_name = 'Offset' + axis, {'X':'Width', 'Y':'Height'}[axis]
+                if off is None:
+                    off = roi[0 if axis == 'X' else 1]
+                if size is None:
+                    size = roi[2 if axis == 'X' else 3]
+                # offset 0 first: the size limit is the sensor size minus the offset
+                self.set_node_value(off_name, 0)
+                self.set_node_value(size_name, size)
+                size_max = self.get_node_value(size_name + 'Max')
+                self.set_node_value(off_name, min(off, size_max - self.get_node_value(size_name)))
+        return self.get_roi()
+    
+    def set_full_frame(self):
+        "Largest region of interest at the current binning and decimation"
+        return self.set_roi(0, 0, self.get_node_value('WidthMax'), self.get_node_value('HeightMax'))
+    
+    def get_exposure_lims(self):
+        exp_time_min, exp_time_max = self.get_node_value_limits("ExposureTime")
+        retval = (exp_time_min*1e-6,exp_time_max*1e-6)
         if self.debug: print("exp_time lims %f %f" % retval)
 
         return retval
@@ -447,73 +1033,195 @@ class FlirCamInterface(object):
         node_type = self.get_node_type(nodeName)
         if self.debug: print("get_node_value", nodeName, hNode, node_type)
         if   node_type == SpinNodeTypeEnum.IntegerNode:
-            x = c_int()
-            _err(self.lib.spinIntegerGetValue(hNode,byref(x)))
+            x = c_int64()
+            self.api.spinIntegerGetValue(hNode,byref(x))
             return x.value
         elif node_type == SpinNodeTypeEnum.FloatNode:
             x = c_double()
-            _err(self.lib.spinFloatGetValue(hNode,byref(x)))
+            self.api.spinFloatGetValue(hNode,byref(x))
             return x.value
         elif node_type == SpinNodeTypeEnum.EnumerationNode:
             return self.get_node_enum_by_name(nodeName)
+        elif node_type == SpinNodeTypeEnum.BooleanNode:
+            x = bool8_t()
+            self.api.spinBooleanGetValue(hNode,byref(x))
+            return x.value
         else:
             raise ValueError("get_node_value failed {} {}".format(nodeName, node_type))
         
         
     def set_node_value(self, nodeName, val):
+        "Writes val to nodeName, raises FlirCamAccessError if it is not writable now"
         hNode = self.get_node(nodeName)
+        if not self.get_node_is_writable(nodeName):
+            raise FlirCamAccessError(FlirCamErrors['GENICAM_ERR_ACCESS'],
+                                     "{} is not writable".format(nodeName))
         node_type = self.get_node_type(nodeName)
         if self.debug: print('set_node_value', nodeName, val, type(val), node_type)
         if   node_type == SpinNodeTypeEnum.IntegerNode:
-            _err(self.lib.spinIntegerSetValue(hNode,val))
+            try:
+                self.api.spinIntegerSetValue(hNode,self.snap_node_value(nodeName, val))
+            except FlirCamAccessError:
+                raise
+            except FlirCamError:
+                # limits changed by the camera since they were cached, snap again
+                self.invalidate_node_cache(nodeName)
+                self.api.spinIntegerSetValue(hNode,self.snap_node_value(nodeName, val))
         elif node_type == SpinNodeTypeEnum.FloatNode:
-            _err(self.lib.spinFloatSetValue(hNode,c_double(val)))
+            self.api.spinFloatSetValue(hNode,float(val))
         elif node_type == SpinNodeTypeEnum.EnumerationNode:
             #sb = ctypes.create_string_buffer(val.encode())
             #_err(self.lib.spinNodeFromString(hNode, byref(sb)))
-            _err(self.lib.spinNodeFromString(hNode, val.encode()))
+            self.api.spinNodeFromString(hNode, val.encode())
+        elif node_type == SpinNodeTypeEnum.BooleanNode:
+            self.api.spinBooleanSetValue(hNode,bool(val))
         else:
             raise ValueError("set_node_value failed {} {}".format(nodeName, node_type))
+        self.invalidate_node_cache(nodeName)
+    
+    def set_node_value_clamped(self, nodeName, val):
+        """
+        Writes number val to nodeName clamped to its limits, returns the
+        value written. The camera changes some limits on its own (the
+        AcquisitionFrameRate max under ExposureAuto, ...), so the cached
+        ones can be stale: if the write fails, the limits are read again
+        and the write is retried once.
+        """
+        for retry in (False, True):
+            vmin, vmax = self.get_node_value_limits(nodeName)
+            x = max(min(val, vmax), vmin)
+            try:
+                self.set_node_value(nodeName, x)
+                return x
+            except FlirCamAccessError:
+                raise
+            except FlirCamError:
+                if retry:
+                    raise
+                self.invalidate_node_cache(nodeName)
     
     #def get_node_access_mode(self, nodeName):
     #    hNode = self.get_node(nodeName)
     
+    def get_node_is_available(self, nodeName):
+        "False if the camera does not have nodeName or it is unavailable in the current configuration"
+        hNode = self.get_node(nodeName)
+        if hNode.value is None:
+            return False
+        available = bool8_t()
+        self.api.spinNodeIsAvailable(hNode, byref(available))
+        return available.value
+    
     def get_node_is_readable(self, nodeName):
         hNode = self.get_node(nodeName)
-        readable = c_int()
-        _err(self.lib.spinNodeIsReadable(hNode, byref(readable)))
+        if hNode.value is None:
+            return False
+        readable = bool8_t()
+        self.api.spinNodeIsReadable(hNode, byref(readable))
         return readable.value
          
     def get_node_is_writable(self, nodeName):
         hNode = self.get_node(nodeName)
-        writable = c_int()
-        _err(self.lib.spinNodeIsWritable(hNode, byref(writable)))
+        if hNode.value is None:
+            return False
+        writable = bool8_t()
+        self.api.spinNodeIsWritable(hNode, byref(writable))
         return writable.value
+    
+    def snapshot(self, node_names, values=True):
+        """
+        Reads access mode, value, limits and enum choices of all 
+        node_names in one pass while holding self.lock.
+        Returns OrderedDict node name -> NodeSnapshot.
+        
+        with values=False only type and access mode are read 
+        (value, limits and choices are None).
+        Unavailable nodes give a NodeSnapshot with type None.
+        """
+        result = OrderedDict()
+        with self.lock:
+            for name in node_names:
+                if not self.get_node_is_available(name):
+                    result[name] = NodeSnapshot(name, None, False, False, None, None, None)
+                    continue
+                node_type = self.get_node_type(name)
+                readable = bool(self.get_node_is_readable(name))
+                writable = bool(self.get_node_is_writable(name))
+                value = limits = choices = None
+                if values and readable:
+                    if node_type in (SpinNodeTypeEnum.IntegerNode, SpinNodeTypeEnum.FloatNode):
+                        limits = self.get_node_value_limits(name)
+                    elif node_type == SpinNodeTypeEnum.EnumerationNode:
+                        choices = self.get_node_enum_values(name)
+                    try:
+                        value = self.get_node_value(name)
+                    except ValueError:
+                        # node type without value support
+                        pass
+                result[name] = NodeSnapshot(name, node_type, readable, writable, 
+                                            value, limits, choices)
+        return result
 
     def get_node_type(self, nodeName):
-        hNode = self.get_node(nodeName)
-        pType = c_uint()
-        _err(self.lib.spinNodeGetType(hNode, byref(pType)))
-        #print( nodeName, 'type', pType.value, SpinNodeTypeEnum(pType.value))
-        return SpinNodeTypeEnum(pType.value)
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        node_type = self._node_types.get(nodeName)
+        if node_type is None:
+            hNode = self.get_node(nodeName)
+            pType = c_int()
+            self.api.spinNodeGetType(hNode, byref(pType))
+            #print( nodeName, 'type', pType.value, SpinNodeTypeEnum(pType.value))
+            node_type = self._node_types[nodeName] = SpinNodeTypeEnum(pType.value)
+        return node_type
     
     def get_node_value_limits(self, nodeName):
+        "Returns (min, max) of nodeName, cached until invalidate_node_cache()"
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        limits = self._node_limits.get(nodeName)
+        if limits is None:
+            limits = self._node_limits[nodeName] = self._read_node_value_limits(nodeName)
+        return limits
+    
+    def get_node_value_inc(self, nodeName):
+        "Returns the increment of integer node nodeName, cached like the limits"
+        if isinstance(nodeName, bytes):
+            nodeName = nodeName.decode()
+        inc = self._node_incs.get(nodeName)
+        if inc is None:
+            x = c_int64()
+            self.api.spinIntegerGetInc(self.get_node(nodeName), byref(x))
+            inc = self._node_incs[nodeName] = max(1, x.value)
+        return inc
+    
+    def snap_node_value(self, nodeName, val):
+        "Integer val clamped to the limits of nodeName and snapped to its increment"
+        vmin, vmax = self.get_node_value_limits(nodeName)
+        inc = self.get_node_value_inc(nodeName)
+        val = max(min(int(round(val)), vmax), vmin)
+        val = vmin + inc*int(round((val - vmin)/inc))
+        if val > vmax:
+            val -= inc
+        return val
+    
+    def _read_node_value_limits(self, nodeName):
         hNode = self.get_node(nodeName)
         node_type = self.get_node_type(nodeName)
         if   node_type == SpinNodeTypeEnum.IntegerNode:
-            xmin = c_int()
-            xmax = c_int()
-            _err(self.lib.spinIntegerGetMin(hNode,byref(xmin)))
-            _err(self.lib.spinIntegerGetMax(hNode,byref(xmax)))
+            xmin = c_int64()
+            xmax = c_int64()
+            self.api.spinIntegerGetMin(hNode,byref(xmin))
+            self.api.spinIntegerGetMax(hNode,byref(xmax))
             if self.debug:
                 print('get_node_value_limits', nodeName, xmin.value, xmax.value)
             return xmin.value, xmax.value
         elif node_type == SpinNodeTypeEnum.FloatNode:
             xmin = c_double()
             xmax = c_double()
-            _err(self.lib.spinFloatGetMin(hNode,byref(xmin)))
-            _err(self.lib.spinFloatGetMax(hNode,byref(xmax)))
-            print('get_node_value_limits', nodeName, xmin.value, xmax.value)
+            self.api.spinFloatGetMin(hNode,byref(xmin))
+            self.api.spinFloatGetMax(hNode,byref(xmax))
+            if self.debug:
+                print('get_node_value_limits', nodeName, xmin.value, xmax.value)
             return xmin.value, xmax.value
         else:
             raise ValueError("get_node_value_limits failed {} {}".format(nodeName, node_type))
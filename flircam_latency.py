@@ -0,0 +1,110 @@
+"""
+Per-frame latency bookkeeping.
+
+Host times in the frame info dict are time.perf_counter() values:
+    't_grab'     spinCameraGetNextImage(Ex) returned (FlirCamInterface.get_image)
+    't_copy'     frame copied out of the SDK buffer (FlirCamInterface.get_image)
+    't_enqueue'  frame pushed to the frame ring (FlirCamHW.grab_frame)
+    't_display'  frame handed to the image item (FlirCamLiveMeasure.update_display)
+and 'timestamp' is the camera timestamp in ns.
+
+LatencyTracker keeps the last `capacity` samples of each stage in a
+preallocated ring of floats, so recording costs a few array stores per
+frame and can stay enabled.
+"""
+import csv
+import numpy as np
+
+LATENCY_STAGES = (
+    'camera_to_grab',     # camera timestamp -> grab, above the smallest seen
+    'grab_to_copy',
+    'copy_to_enqueue',
+    'enqueue_to_display',
+    'grab_to_display',
+    )
+
+
+class LatencyTracker(object):
+    """
+    Rolling latency samples (seconds) per stage in LATENCY_STAGES.
+
+    Camera and host clocks are not synchronized, 'camera_to_grab' is
+    therefore measured relative to the smallest camera-to-host offset
+    seen since the last reset(): the transport and buffering delay on top
+    of the best case.
+    """
+
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.enabled = True
+        self.reset()
+
+    def reset(self):
+        self.samples = {stage: np.zeros(self.capacity) for stage in LATENCY_STAGES}
+        self.counts = {stage: 0 for stage in LATENCY_STAGES}
+        self._min_clock_offset = None
+
+    def add(self, stage, dt):
+        n = self.counts[stage]
+        self.samples[stage][n % self.capacity] = dt
+        self.counts[stage] = n + 1
+
+    def record_frame(self, info):
+        "acquisition side stages, from the info dict of a grabbed frame"
+        if not self.enabled:
+            return
+        t_grab = info['t_grab']
+        offset = t_grab - info['timestamp']*1e-9
+        if self._min_clock_offset is None or offset < self._min_clock_offset:
+            self._min_clock_offset = offset
+        self.add('camera_to_grab', offset - self._min_clock_offset)
+        self.add('grab_to_copy', info['t_copy'] - t_grab)
+        self.add('copy_to_enqueue', info['t_enqueue'] - info['t_copy'])
+
+    def record_display(self, info):
+        "display stages, info must have 't_display' set"
+        if not self.enabled:
+            return
+        t_display = info['t_display']
+        self.add('enqueue_to_display', t_display - info['t_enqueue'])
+        self.add('grab_to_display', t_display - info['t_grab'])
+
+    def get_samples(self, stage):
+        "Returns the stored samples of stage, oldest first"
+        n = self.counts[stage]
+        s = self.samples[stage]
+        if n <= self.capacity:
+            return s[:n].copy()
+        i = n % self.capacity
+        return np.concatenate((s[i:], s[:i]))
+
+    def percentiles(self, stage, q=(50, 95, 99)):
+        "Returns percentiles q of stage (seconds), or None without samples"
+        n = min(self.counts[stage], self.capacity)
+        if n == 0:
+            return None
+        return np.percentile(self.samples[stage][:n], q)
+
+    def stats(self):
+        "Returns {stage: dict(n, mean, p50, p95, p99)} in seconds"
+        result = dict()
+        for stage in LATENCY_STAGES:
+            n = min(self.counts[stage], self.capacity)
+            if n == 0:
+                continue
+            p50, p95, p99 = self.percentiles(stage)
+            result[stage] = dict(n=self.counts[stage], mean=float(self.samples[stage][:n].mean()),
+                                 p50=float(p50), p95=float(p95), p99=float(p99))
+        return result
+
+    def save_csv(self, fname):
+        """
+        Writes the stored samples as rows 'stage, sample, latency_ms',
+        oldest sample first
+        """
+        with open(fname, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'sample', 'latency_ms'])
+            for stage in LATENCY_STAGES:
+                for i, dt in enumerate(self.get_samples(stage)):
+                    writer.writerow([stage, i, '%.6f' % (1e3*dt)])
@@ -6,17 +6,41 @@ import time
 import os
 from ScopeFoundry.helper_funcs import load_qt_ui_file, sibling_path
 from pyqtgraph.functions import makeQImage
+import numpy as np
+from .flircam_display import DisplayWorker, DOWNSAMPLE_MODES
 
 class FlirCamLiveMeasure(Measurement):
     
     name = 'flircam_live'
     
     def setup(self):
-        self.settings.New('auto_level', dtype=bool, initial=False)
-        self.settings.New('crosshairs', dtype=bool, initial=False)
-        self.settings.New('flip_x', dtype=bool, initial=False)
-        self.settings.New('flip_y', dtype=bool, initial=False)
-        self.settings.New('downsample_view', dtype=int, initial=1)
+        self.setup_display_settings(self.settings)
+        self.add_operation('full_frame', self.set_full_frame)
+        
+        self.display_worker = None
+        self.display_seq = None
+        self.display_transform = None
+    
+    @staticmethod
+    def setup_display_settings(settings):
+        "Adds the live view settings update_display reads to LQCollection settings"
+        settings.New('auto_level', dtype=bool, initial=False)
+        settings.New('crosshairs', dtype=bool, initial=False)
+        settings.New('flip_x', dtype=bool, initial=False)
+        settings.New('flip_y', dtype=bool, initial=False)
+        settings.New('downsample_view', dtype=int, initial=1, vmin=1,
+                     description='smallest decimation factor of the live view')
+        settings.New('fit_viewport', dtype=bool, initial=True,
+                     description='decimate further to what the view can show')
+        settings.New('display_downsample', dtype=str, initial='stride', 
+                     choices=DOWNSAMPLE_MODES)
+        settings.New('auto_level_low', dtype=float, initial=0.5, vmin=0, vmax=100, unit='%')
+        settings.New('auto_level_high', dtype=float, initial=99.5, vmin=0, vmax=100, unit='%')
+        settings.New('auto_level_smoothing', dtype=float, initial=0.8, vmin=0, vmax=0.99,
+                     description='weight of the previous levels, 0: no smoothing')
+        settings.New('auto_level_per_channel', dtype=bool, initial=False)
+        settings.New('show_roi', dtype=bool, initial=False,
+                     description='draggable rectangle, sets the camera ROI when released')
     
     def setup_figure(self):
         self.ui = load_qt_ui_file(sibling_path(__file__,'flircam_live_measure.ui'))
@@ -27,6 +51,7 @@ class FlirCamLiveMeasure(Measurement):
         
         self.hw.settings.connected.connect_to_widget(self.ui.cam_connect_checkBox)
         self.hw.settings.cam_index.connect_to_widget(self.ui.cam_index_doubleSpinBox)
+        self.hw.settings.simulate.connect_to_widget(self.ui.simulate_checkBox)
         self.hw.settings.frame_rate.connect_to_widget(self.ui.framerate_doubleSpinBox)
         self.hw.settings.exposure.connect_to_widget(self.ui.exp_doubleSpinBox)
         
@@ -41,6 +66,15 @@ class FlirCamLiveMeasure(Measurement):
         self.img_item = pg.ImageItem()
         self.plot.addItem(self.img_item)
         self.plot.setAspectLocked(lock=True, ratio=1)
+        self.display_update_period = 0.01
+        
+        # sensor region of interest, in (binned) sensor pixels like the image item
+        self.roi_rect = pg.RectROI((0, 0), (64, 64), pen=(255, 255, 0, 200))
+        self.roi_rect.setZValue(10)
+        self.roi_rect.setVisible(False)
+        self.plot.addItem(self.roi_rect)
+        self.roi_rect.sigRegionChangeFinished.connect(self.on_roi_rect_changed)
+        self.settings.show_roi.add_listener(self.on_show_roi)
         
         self.ui.plot_groupBox.layout().addWidget(self.img_label)
         
@@ -74,36 +108,55 @@ class FlirCamLiveMeasure(Measurement):
             self.ui.auto_exposure_comboBox.removeItem(0)
             self.ui.auto_exposure_comboBox.setCurrentIndex(2)
 
-        while not self.interrupt_measurement_called:
-            time.sleep(0.5)
-            self.hw.settings.exposure.read_from_hardware()
+        # frames are prepared for display on this thread, update_display only shows them
+        self.display_worker = DisplayWorker(self.hw.frame_ring, name=self.name + '_display')
+        self.display_worker.start()
+        try:
+            while not self.interrupt_measurement_called:
+                time.sleep(0.5)
+                self.hw.settings.exposure.read_from_hardware()
+        finally:
+            self.display_worker.stop()
             
             
-    def get_rgb_image(self):
-        if not self.hw.img_buffer:
-            return False
-        else:
-            return self.hw.img_buffer.pop(0).copy()
-        
-                    
     def update_display(self):
-        self.display_update_period = 0.01
-        self.im = im = self.get_rgb_image()
-        if type(im)==bool:
+        worker = self.display_worker
+        if worker is None:
             return
-        
-        #print('imshape', im.shape)
-        # print("buffer len:", len(self.hw.img_buffer))
-        # self.hw.img.copy()
-        #self.imview.setImage(im.swapaxes(0,1),autoLevels=self.settings['auto_level'])
-        ds = self.settings['downsample_view']
-        if ds > 1:
-            self.im = im = im[::ds,::ds]
-        self.img_item.setImage(im.swapaxes(0,1),autoLevels=self.settings['auto_level'])
+        S = self.settings
+        worker.min_ds = S['downsample_view']
+        worker.view_ds = self.get_view_ds() if S['fit_viewport'] else 1
+        worker.mode = S['display_downsample']
+        worker.auto_level = S['auto_level']
+        al = worker.autolevels
+        al.low, al.high = S['auto_level_low'], S['auto_level_high']
+        al.smoothing = S['auto_level_smoothing']
+        al.per_channel = S['auto_level_per_channel']
+        worker.flip_x = S['flip_x']
+        worker.flip_y = S['flip_y']
+        
+        out = worker.output
+        if out is None or out.seq == self.display_seq:
+            return
+        self.display_seq = out.seq
+        self.im = out.image
+        
+        # image is ready to show: uint8, levels already applied
+        self.img_item.setImage(out.image.swapaxes(0,1), autoLevels=False, levels=(0,255))
+        transform = (out.ds,) + self.get_roi_offset()
+        if transform != self.display_transform:
+            # keep item coordinates in full frame pixels, placed at the ROI offset on the sensor
+            ds, x0, y0 = transform
+            self.img_item.setTransform(QtGui.QTransform(ds, 0, 0, ds, x0, y0))
+            self.display_transform = transform
+        if out.info is not None:
+            out.info['t_display'] = time.perf_counter()
+            self.hw.latency.record_display(out.info)
         
         
         if hasattr(self, 'crosshairs'):
-            for ch,(x,y) in zip(self.crosshairs, [(im.shape[1]/2,0), (0,im.shape[0]/2)]):
+            h, w = out.frame_shape[:2]
+            for ch,(x,y) in zip(self.crosshairs, [(w/2,0), (0,h/2)]):
                 ch.setPos((x,y))
                 #ch.setVisible(self.settings['crosshairs'])
                 ch.setZValue({True:1, False:-1}[self.settings['crosshairs']])
@@ -112,6 +165,49 @@ class FlirCamLiveMeasure(Measurement):
         #    makeQImage(imgData=im, alpha=False, copy=False, transpose=True)))
             
             
+    def get_roi_offset(self):
+        HS = self.hw.settings
+        if 'offset_x' in HS.keys() and 'offset_y' in HS.keys():
+            return HS['offset_x'], HS['offset_y']
+        return 0, 0
+    
+    def on_show_roi(self):
+        show = self.settings['show_roi']
+        if show and self.hw.settings['connected']:
+            self.update_roi_rect()
+        self.roi_rect.setVisible(show)
+    
+    def update_roi_rect(self):
+        "move the rectangle to the camera ROI, without applying it again"
+        x, y, w, h = self.hw.cam.get_roi()
+        self.roi_rect.setPos((x, y), update=False, finish=False)
+        self.roi_rect.setSize((w, h), finish=False)
+    
+    def on_roi_rect_changed(self):
+        if not self.settings['show_roi'] or not self.hw.settings['connected']:
+            return
+        x, y = self.roi_rect.pos()
+        w, h = self.roi_rect.size()
+        self.hw.set_roi(max(0, int(x)), max(0, int(y)), int(w), int(h))
+        # camera snaps the ROI to its increments
+        self.update_roi_rect()
+    
+    def set_full_frame(self):
+        self.hw.set_full_frame()
+        if self.settings['show_roi']:
+            self.update_roi_rect()
+    
+    def get_view_ds(self):
+        "largest decimation factor at which an image pixel still covers a screen pixel"
+        try:
+            sx, sy = self.plot.getViewBox().viewPixelSize()
+        except Exception:
+            return 1
+        s = min(sx, sy)
+        if not np.isfinite(s):
+            return 1
+        return max(1, int(s))
+            
     def save_image(self):
         print('flircam_live_measure save_image')
         t = time.localtime(time.time())
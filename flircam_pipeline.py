@@ -0,0 +1,292 @@
+"""
+Per-frame processing pipeline.
+
+Stages are callables func(img, info) arranged in a tree below the frame
+source: a stage receives what its parent stage returned, stages with the
+same parent all receive the same frame (e.g. several analyses side by
+side). A stage returns the frame for its children, (img, info), or None
+to stop processing that frame (e.g. publish or analysis stages at the
+leaves).
+
+    pipeline = FramePipeline()
+    pipeline.add_stage('crop', lambda img, info: img[100:400, 200:600])
+    pipeline.add_stage('spot', spot_analysis, after='crop', threaded=True)
+    pipeline.add_stage('save', save_frame, after='crop', threaded=True,
+                       policy='block', block_timeout=0.005)
+    pipeline.start()
+    pipeline.process(img, info)     # acquisition thread, every frame
+
+Inline stages (threaded=False) run on the thread that called process(),
+they must be fast. A threaded stage has a bounded input queue and
+n_workers threads, process() only enqueues. When the queue is full the
+stage policy applies:
+    'drop_oldest'  (default) drop the oldest queued frame, the stage always
+                   works on the newest frames and process() never waits
+    'block'        wait up to block_timeout for space, then drop the frame.
+                   Fewer frames are lost to short hiccups of the stage, but
+                   the acquisition thread stalls meanwhile; keep block_timeout
+                   well below the frame period or the camera's stream
+                   buffers fill up and frames are lost there instead
+Frames are shared between stages and with the frame ring, stages must
+not modify img in place. info is shared too, stages may add keys. With
+a FramePool (FramePipeline(pool=...)) frames queued for threaded stages
+are retained until the stage is done with them, so the frame ring can
+not recycle them meanwhile.
+"""
+import threading
+import queue
+import time
+
+STAGE_POLICIES = ('drop_oldest', 'block')
+
+
+class PipelineStage(object):
+    """
+    One stage of a FramePipeline, see module docstring.
+    Keeps per-stage counters and processing time (seconds), see stats().
+    """
+
+    def __init__(self, name, func, parent=None, threaded=False, n_workers=1,
+                 queue_size=4, policy='drop_oldest', block_timeout=0.01, pool=None):
+        assert policy in STAGE_POLICIES
+        self.name = name
+        self.pool = pool
+        self.func = func
+        self.parent = parent
+        self.children = []
+        self.threaded = threaded
+        self.n_workers = max(1, int(n_workers))
+        self.policy = policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size) if threaded else None
+        self.workers = []
+
+        self.n_in = 0
+        self.n_processed = 0
+        self.n_dropped = 0
+        self.n_errors = 0
+        self.last_error = None
+        self.t_total = 0.0
+        self.t_max = 0.0
+        self.max_queue_depth = 0
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def submit(self, img, info):
+        "Hand a frame to this stage: run it inline or enqueue it for the workers"
+        with self._lock:
+            self.n_in += 1
+        if not self.threaded:
+            self.run_frame(img, info)
+            return
+        item = (img, info)
+        pool = self.pool
+        if pool is not None:
+            pool.retain(img)
+        try:
+            if self.policy == 'block':
+                self.queue.put(item, timeout=self.block_timeout)
+            else:
+                while True:
+                    try:
+                        self.queue.put_nowait(item)
+                        break
+                    except queue.Full:
+                        try:
+                            dropped = self.queue.get_nowait()
+                        except queue.Empty:
+                            continue
+                        if pool is not None:
+                            pool.release(dropped[0])
+                        del dropped
+                        with self._lock:
+                            self.n_dropped += 1
+        except queue.Full:
+            if pool is not None:
+                pool.release(img)
+            with self._lock:
+                self.n_dropped += 1
+            return
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def run_frame(self, img, info):
+        "Run func on a frame and pass the result on to the child stages"
+        t0 = time.perf_counter()
+        try:
+            result = self.func(img, info)
+        except Exception as err:
+            with self._lock:
+                self.n_errors += 1
+            if self.last_error is None:
+                print('pipeline stage', self.name, 'failed', repr(err))
+            self.last_error = err
+            return
+        dt = time.perf_counter() - t0
+        with self._lock:
+            self.n_processed += 1
+            self.t_total += dt
+            if dt > self.t_max:
+                self.t_max = dt
+        if result is None:
+            return
+        if isinstance(result, tuple):
+            img, info = result
+        else:
+            img = result
+        for child in self.children:
+            child.submit(img, info)
+
+    def worker_run(self):
+        while not self._stop_event.is_set():
+            try:
+                img, info = self.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                self.run_frame(img, info)
+            finally:
+                if self.pool is not None:
+                    self.pool.release(img)
+            del img, info
+
+    def start(self):
+        if not self.threaded or self.workers:
+            return
+        self._stop_event.clear()
+        for i in range(self.n_workers):
+            t = threading.Thread(target=self.worker_run, daemon=True,
+                                 name='pipeline_{}_{}'.format(self.name, i))
+            t.start()
+            self.workers.append(t)
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        for t in self.workers:
+            t.join(timeout)
+        self.workers = []
+        if self.threaded:
+            # queued frames are dropped, releases their buffers
+            while True:
+                try:
+                    img, info = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if self.pool is not None:
+                    self.pool.release(img)
+
+    def queue_depth(self):
+        return self.queue.qsize() if self.threaded else 0
+
+    def stats(self):
+        n = self.n_processed
+        return dict(threaded=self.threaded,
+                    policy=self.policy if self.threaded else 'inline',
+                    received=self.n_in,
+                    processed=n,
+                    dropped=self.n_dropped,
+                    errors=self.n_errors,
+                    queue_depth=self.queue_depth(),
+                    max_queue_depth=self.max_queue_depth,
+                    t_mean=self.t_total/n if n else 0.0,
+                    t_max=self.t_max)
+
+    def reset_stats(self):
+        with self._lock:
+            self.n_in = self.n_processed = self.n_dropped = self.n_errors = 0
+            self.t_total = self.t_max = 0.0
+            self.max_queue_depth = 0
+            self.last_error = None
+
+
+class FramePipeline(object):
+    """
+    Tree of PipelineStages fed by process(img, info), see module
+    docstring. Stages can be added and removed while the pipeline runs.
+    pool: FramePool of the frames, see set_pool()
+    """
+
+    def __init__(self, pool=None):
+        self.pool = pool
+        self.stages = dict()
+        self.roots = []
+        self.running = False
+        self._lock = threading.Lock()
+
+    def add_stage(self, name, func, after=None, threaded=False, n_workers=1,
+                  queue_size=4, policy='drop_oldest', block_timeout=0.01):
+        """
+        Adds stage name running func(img, info) on the output of stage
+        after (None: on every frame). Returns the PipelineStage.
+        """
+        with self._lock:
+            if name in self.stages:
+                raise ValueError("pipeline stage {} exists".format(name))
+            parent = None
+            if after is not None:
+                parent = self.stages[after]
+            stage = PipelineStage(name, func, parent=parent, threaded=threaded,
+                                  n_workers=n_workers, queue_size=queue_size,
+                                  policy=policy, block_timeout=block_timeout,
+                                  pool=self.pool)
+            if self.running:
+                stage.start()
+            self.stages[name] = stage
+            # replace rather than mutate, process() may be iterating
+            if parent is None:
+                self.roots = self.roots + [stage]
+            else:
+                parent.children = parent.children + [stage]
+        return stage
+
+    def remove_stage(self, name):
+        "Removes stage name and all stages below it"
+        with self._lock:
+            stage = self.stages[name]
+            if stage.parent is None:
+                self.roots = [s for s in self.roots if s is not stage]
+            else:
+                stage.parent.children = [s for s in stage.parent.children if s is not stage]
+            todo = [stage]
+            while todo:
+                s = todo.pop()
+                todo.extend(s.children)
+                s.stop()
+                del self.stages[s.name]
+
+    def set_pool(self, pool):
+        "FramePool the frames come from, e.g. after the camera was replaced"
+        with self._lock:
+            self.pool = pool
+            for stage in self.stages.values():
+                stage.pool = pool
+
+    def process(self, img, info):
+        "Feed a frame to the root stages, called from the acquisition thread"
+        for stage in self.roots:
+            stage.submit(img, info)
+
+    def start(self):
+        with self._lock:
+            self.running = True
+            for stage in self.stages.values():
+                stage.start()
+
+    def stop(self):
+        with self._lock:
+            self.running = False
+            for stage in self.stages.values():
+                stage.stop()
+
+    @property
+    def n_dropped(self):
+        return sum(s.n_dropped for s in self.stages.values())
+
+    def stats(self):
+        "Returns {stage name: PipelineStage.stats()}"
+        return {name: s.stats() for name, s in list(self.stages.items())}
+
+    def reset_stats(self):
+        for s in list(self.stages.values()):
+            s.reset_stats()
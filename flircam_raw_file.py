@@ -0,0 +1,156 @@
+"""
+Append-only raw frame container.
+
+<fname>        fixed size header (HEADER_SIZE bytes: MAGIC followed by a
+               json description: shape, dtype, pixel_format, n_frames)
+               then back-to-back frames
+<fname>.idx    sidecar index, one INDEX_DTYPE record per frame:
+               byte offset of the frame, camera timestamp (ns),
+               host timestamp (s)
+
+RawFrameWriter writes straight from the frame buffers produced by
+FlirCamInterface.get_image, RawFrameReader opens the frames with
+np.memmap, so any frame or range can be sliced without loading the file.
+"""
+import json
+import os
+import numpy as np
+
+MAGIC = b'FLIRRAW1'
+HEADER_SIZE = 4096
+INDEX_DTYPE = np.dtype([('offset', '<u8'),
+                        ('timestamp', '<u8'),
+                        ('host_time', '<f8')])
+
+
+def _index_fname(fname):
+    return fname + '.idx'
+
+
+class RawFrameWriter(object):
+    """
+    Frame sink writing a raw frame container, see module docstring.
+    The file is created with the first frame, all frames need to have
+    the same shape and dtype.
+    """
+
+    index_flush_frames = 256
+
+    def __init__(self, fname, pixel_format=None):
+        self.fname = fname
+        self.pixel_format = pixel_format
+        self.n_frames = 0
+        self.f = None
+
+    def _open(self, img, info):
+        self.shape = img.shape
+        self.dtype = img.dtype
+        self.frame_nbytes = img.nbytes
+        if self.pixel_format is None and info:
+            self.pixel_format = info.get('pixel_format')
+        self.f = open(self.fname, 'wb')
+        self.f.write(self._header())
+        self.idx_f = open(_index_fname(self.fname), 'wb')
+        self.idx_block = np.zeros(self.index_flush_frames, dtype=INDEX_DTYPE)
+        self.n_idx_block = 0
+
+    def _header(self):
+        desc = dict(shape=list(self.shape), dtype=self.dtype.str,
+                    pixel_format=self.pixel_format, n_frames=self.n_frames,
+                    header_size=HEADER_SIZE)
+        header = MAGIC + json.dumps(desc).encode()
+        assert len(header) <= HEADER_SIZE
+        return header.ljust(HEADER_SIZE, b'\0')
+
+    def write(self, img, info=None):
+        if self.f is None:
+            self._open(img, info)
+        if img.shape != self.shape or img.dtype != self.dtype:
+            raise ValueError("RawFrameWriter frame {} {} does not match file {} {}".format(
+                img.shape, img.dtype, self.shape, self.dtype))
+        rec = self.idx_block[self.n_idx_block]
+        rec['offset'] = HEADER_SIZE + self.n_frames*self.frame_nbytes
+        if info:
+            rec['timestamp'] = info.get('timestamp', 0)
+            rec['host_time'] = info.get('host_time', 0)
+        else:
+            rec['timestamp'] = 0
+            rec['host_time'] = 0
+        # write directly from the frame buffer, no intermediate bytes object
+        self.f.write(np.ascontiguousarray(img).data)
+        self.n_frames += 1
+        self.n_idx_block += 1
+        if self.n_idx_block == self.index_flush_frames:
+            self.flush_index()
+
+    def flush_index(self):
+        if self.n_idx_block:
+            self.idx_f.write(self.idx_block[:self.n_idx_block].data)
+            # visible to a reader of the unclosed file
+            self.idx_f.flush()
+            self.n_idx_block = 0
+
+    def close(self):
+        if self.f is None:
+            return
+        self.flush_index()
+        self.idx_f.close()
+        # rewrite header with final frame count
+        self.f.seek(0)
+        self.f.write(self._header())
+        self.f.close()
+        self.f = None
+
+
+class RawFrameReader(object):
+    """
+    Random access reader of a raw frame container.
+    reader[i], reader[i:j] return (memory-mapped) frames,
+    reader.index the per-frame INDEX_DTYPE records.
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, 'rb') as f:
+            header = f.read(HEADER_SIZE)
+        if not header.startswith(MAGIC):
+            raise IOError("{} is not a flircam raw frame file".format(fname))
+        desc = json.loads(header[len(MAGIC):].rstrip(b'\0').decode())
+        self.desc = desc
+        self.shape = tuple(desc['shape'])
+        self.dtype = np.dtype(desc['dtype'])
+        self.pixel_format = desc['pixel_format']
+        self.frame_nbytes = int(np.prod(self.shape))*self.dtype.itemsize
+
+        # frame count from file size, valid even if the writer did not close
+        n = (os.path.getsize(fname) - HEADER_SIZE)//self.frame_nbytes
+        self.n_frames = n
+        if n > 0:
+            self.frames = np.memmap(fname, dtype=self.dtype, mode='r',
+                                    offset=HEADER_SIZE, shape=(n,)+self.shape)
+        else:
+            self.frames = np.zeros((0,)+self.shape, dtype=self.dtype)
+
+        idx_fname = _index_fname(fname)
+        if os.path.exists(idx_fname) and os.path.getsize(idx_fname) >= INDEX_DTYPE.itemsize:
+            self.index = np.memmap(idx_fname, dtype=INDEX_DTYPE, mode='r')[:n]
+        else:
+            self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, key):
+        return self.frames[key]
+
+    @property
+    def timestamps(self):
+        return self.index['timestamp']
+
+    @property
+    def host_times(self):
+        return self.index['host_time']
+
+    def close(self):
+        del self.frames
+        del self.index
@@ -0,0 +1,197 @@
+from ScopeFoundry import Measurement, h5_io
+import numpy as np
+import time
+import os
+from .flircam_writer import FrameWriterThread
+from .flircam_raw_file import RawFrameWriter
+from .flircam_chunk import CHUNK_DTYPE
+
+
+class H5FrameSink(object):
+    """
+    Appends frames to a chunked, resizable 'frames' dataset in h5_group,
+    with per-frame 'timestamp' (camera, ns), 'host_time' (s) and 'frame_id'
+    datasets, and 'chunk' (CHUNK_DTYPE) if the frames carry chunk data.
+    Datasets are created from the first frame written, all frames need
+    to have the same shape and dtype. chunk_frames frames are collected
+    in a preallocated block and written together.
+    """
+
+    grow_frames = 256
+
+    def __init__(self, h5_group, chunk_frames=1, compression=None):
+        self.h5_group = h5_group
+        self.chunk_frames = max(1, int(chunk_frames))
+        self.compression = compression
+        self.n_frames = 0
+        self.frames_ds = None
+
+    def _create_datasets(self, img, info):
+        g = self.h5_group
+        shape = img.shape
+        self.frames_ds = g.create_dataset('frames', shape=(0,)+shape,
+                                          maxshape=(None,)+shape, dtype=img.dtype,
+                                          chunks=(self.chunk_frames,)+shape,
+                                          compression=self.compression)
+        if info and 'pixel_format' in info:
+            self.frames_ds.attrs['pixel_format'] = info['pixel_format']
+        self.timestamp_ds = g.create_dataset('timestamp', shape=(0,), maxshape=(None,),
+                                             dtype=np.uint64, chunks=(4096,))
+        self.host_time_ds = g.create_dataset('host_time', shape=(0,), maxshape=(None,),
+                                             dtype=np.float64, chunks=(4096,))
+        self.frame_id_ds = g.create_dataset('frame_id', shape=(0,), maxshape=(None,),
+                                            dtype=np.uint64, chunks=(4096,))
+        self.block = np.empty((self.chunk_frames,)+shape, dtype=img.dtype)
+        self.block_timestamp = np.zeros(self.chunk_frames, dtype=np.uint64)
+        self.block_host_time = np.zeros(self.chunk_frames, dtype=np.float64)
+        self.block_frame_id = np.zeros(self.chunk_frames, dtype=np.uint64)
+        self.per_frame = [(self.timestamp_ds, self.block_timestamp),
+                          (self.host_time_ds, self.block_host_time),
+                          (self.frame_id_ds, self.block_frame_id)]
+        self.block_chunk = None
+        if info and 'chunk' in info:
+            self.chunk_ds = g.create_dataset('chunk', shape=(0,), maxshape=(None,),
+                                             dtype=CHUNK_DTYPE, chunks=(4096,))
+            self.block_chunk = np.zeros(self.chunk_frames, dtype=CHUNK_DTYPE)
+            self.per_frame.append((self.chunk_ds, self.block_chunk))
+        self.n_block = 0
+
+    def write(self, img, info=None):
+        if self.frames_ds is None:
+            self._create_datasets(img, info)
+        if img.shape != self.block.shape[1:] or img.dtype != self.block.dtype:
+            raise ValueError("H5FrameSink frame {} {} does not match recording {} {}".format(
+                img.shape, img.dtype, self.block.shape[1:], self.block.dtype))
+        i = self.n_block
+        self.block[i] = img
+        if info:
+            self.block_timestamp[i] = info.get('timestamp', 0)
+            self.block_host_time[i] = info.get('host_time', 0)
+            self.block_frame_id[i] = info.get('frame_id', 0)
+            if self.block_chunk is not None and 'chunk' in info:
+                self.block_chunk[i] = info['chunk']
+        self.n_block += 1
+        if self.n_block == self.chunk_frames:
+            self.flush()
+
+    def flush(self):
+        n = self.n_block
+        if self.frames_ds is None or n == 0:
+            return
+        i0 = self.n_frames
+        if i0 + n > self.frames_ds.shape[0]:
+            new_len = i0 + max(n, self.grow_frames)
+            self.frames_ds.resize(new_len, axis=0)
+            for ds, block in self.per_frame:
+                ds.resize(new_len, axis=0)
+        self.frames_ds[i0:i0+n] = self.block[:n]
+        for ds, block in self.per_frame:
+            ds[i0:i0+n] = block[:n]
+        self.n_frames += n
+        self.n_block = 0
+
+    def close(self):
+        self.flush()
+        if self.frames_ds is not None:
+            self.frames_ds.resize(self.n_frames, axis=0)
+            for ds, block in self.per_frame:
+                ds.resize(self.n_frames, axis=0)
+
+
+def save_writer_stats(h5_group, writer):
+    """
+    Stores the stats of FrameWriterThread writer as 'writer_*' attributes
+    of h5_group, and the gaps in the recorded frame IDs as 'drop_log'
+    dataset of (index, frame_id, n_missing) records, see flircam_chunk
+    """
+    for k, v in writer.stats().items():
+        h5_group.attrs['writer_' + k] = v
+    h5_group.create_dataset('drop_log', data=writer.frame_gaps.get_drop_log())
+
+
+class FlirCamRecordMeasure(Measurement):
+    """
+    Streams every acquired frame of the flircam hardware to an HDF5 file,
+    or to a raw frame container (see flircam_raw_file) for very long runs.
+    Frames are handed from the acquisition thread to a writer thread
+    through a bounded queue, see FrameWriterThread.
+    """
+
+    name = 'flircam_record'
+
+    def setup(self):
+        S = self.settings
+        S.New('file_format', dtype=str, initial='hdf5', choices=('hdf5', 'raw'))
+        S.New('n_frames', dtype=int, initial=0, vmin=0,
+              description='number of frames to record, 0: until interrupted')
+        S.New('queue_size', dtype=int, initial=256, vmin=1)
+        S.New('block_when_full', dtype=bool, initial=False,
+              description='apply back-pressure to the acquisition thread '
+                          'instead of dropping frames when the queue is full')
+        S.New('chunk_frames', dtype=int, initial=4, vmin=1)
+        S.New('compression', dtype=str, initial='none', choices=('none', 'lzf', 'gzip'))
+        S.New('record_stream_mode', dtype=bool, initial=True,
+              description="switch the camera to the 'record' stream buffer preset "
+                          "(deep queue, no drops) while recording")
+        S.New('frames_received', dtype=int, ro=True)
+        S.New('frames_written', dtype=int, ro=True)
+        S.New('frames_dropped', dtype=int, ro=True)
+        S.New('frames_missing', dtype=int, ro=True,
+              description='frame IDs missing from the recording (camera, stream '
+                          'buffer and queue drops), see drop_log')
+        S.New('queue_depth', dtype=int, ro=True)
+
+        self.hw = self.app.hardware['flircam']
+
+    def run(self):
+        S = self.settings
+        if not self.hw.settings['connected']:
+            self.hw.settings['connected'] = True
+
+        self.h5file = h5_io.h5_base_file(app=self.app, measurement=self)
+        self.h5_meas_group = h5_io.h5_create_measurement_group(self, self.h5file)
+
+        if S['file_format'] == 'raw':
+            # frames go to a raw file next to the h5 file, which keeps settings and stats
+            fname = os.path.splitext(self.h5file.filename)[0] + '.flirraw'
+            self.h5_meas_group.attrs['raw_frame_file'] = os.path.basename(fname)
+            sink = RawFrameWriter(fname)
+        else:
+            compression = None if S['compression'] == 'none' else S['compression']
+            sink = H5FrameSink(self.h5_meas_group, chunk_frames=S['chunk_frames'],
+                               compression=compression)
+        self.writer = FrameWriterThread(sink, queue_size=S['queue_size'],
+                                        block=S['block_when_full'],
+                                        max_frames=S['n_frames'],
+                                        pool=self.hw.cam.frame_pool)
+        self.writer.start()
+        HS = self.hw.settings
+        prev_stream_mode = HS['stream_mode']
+        if S['record_stream_mode']:
+            HS['stream_mode'] = 'record'
+        self.hw.add_frame_consumer(self.writer.put)
+        try:
+            while not self.interrupt_measurement_called:
+                self.update_writer_stats()
+                if self.writer.error is not None or self.writer.is_done():
+                    break
+                if S['n_frames']:
+                    self.set_progress(100.0*self.writer.n_written/S['n_frames'])
+                time.sleep(0.1)
+        finally:
+            self.hw.remove_frame_consumer(self.writer.put)
+            HS['stream_mode'] = prev_stream_mode
+            self.writer.stop()
+            self.update_writer_stats()
+            save_writer_stats(self.h5_meas_group, self.writer)
+            self.h5file.close()
+        if self.writer.error is not None:
+            raise self.writer.error
+
+    def update_writer_stats(self):
+        S = self.settings
+        S['frames_received'] = self.writer.n_received
+        S['frames_written'] = self.writer.n_written
+        S['frames_dropped'] = self.writer.n_dropped
+        S['frames_missing'] = self.writer.frame_gaps.n_missing
+        S['queue_depth'] = self.writer.queue_depth()
@@ -0,0 +1,298 @@
+"""
+Frame publishing to other local processes through shared memory.
+
+FrameShmPublisher writes frames into a ring of n_slots fixed size slots
+in a multiprocessing.shared_memory block, FrameShmClient attaches to the
+block by name from any process on the machine and reads frames without
+pickling, as a copy or as a zero-copy view:
+
+    # camera process (FlirCamHW with shm_publish on does this)
+    pub = FrameShmPublisher('flircam', n_slots=8, slot_bytes=img.nbytes)
+    pub.publish(img, info)
+
+    # analysis process
+    client = FrameShmClient('flircam', mode='next')
+    while True:
+        entry = client.wait(timeout=1.0)     # (seq, frame, meta) or None
+
+Layout: a header (SHM_HEADER_DTYPE), one SHM_SLOT_DTYPE record per slot
+(shape, dtype, sequence number, camera timestamp, frame ID, host time)
+and the slot data, all aligned to 64 bytes.
+
+Slots are guarded by a seqlock: the writer makes the slot's 'lock'
+counter odd, writes meta data and frame, then makes it even again. A
+reader notes the counter before reading and checks it is unchanged
+afterwards, otherwise the frame was overwritten while being read (torn)
+and is discarded. A zero-copy view stays valid only until the writer
+comes around the ring, check with client.is_current(meta) after using it.
+
+Only numpy and the standard library are used here, so clients do not need
+Qt or ScopeFoundry.
+"""
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+SHM_MAGIC = 0x464c4952    # 'FLIR'
+SHM_VERSION = 1
+SHM_MAX_NDIM = 3
+SHM_ALIGN = 64
+
+SHM_HEADER_DTYPE = np.dtype([('magic', '<u4'),
+                             ('version', '<u4'),
+                             ('n_slots', '<u4'),
+                             ('closed', '<u4'),
+                             ('slot_bytes', '<u8'),
+                             ('head', '<u8'),       # sequence number of the next frame
+                             ])
+
+SHM_SLOT_DTYPE = np.dtype([('lock', '<u8'),        # seqlock counter, odd while writing
+                           ('seq', '<u8'),
+                           ('ndim', '<u4'),
+                           ('shape', '<u4', (SHM_MAX_NDIM,)),
+                           ('dtype', 'S8'),
+                           ('nbytes', '<u8'),
+                           ('timestamp', '<u8'),   # camera, ns
+                           ('frame_id', '<u8'),
+                           ('host_time', '<f8'),   # time.time()
+                           ])
+
+
+def _aligned(n):
+    return -(-n//SHM_ALIGN)*SHM_ALIGN
+
+
+def shm_layout(n_slots, slot_bytes):
+    "Returns (slot table offset, data offset, slot stride, total size) in bytes"
+    table = _aligned(SHM_HEADER_DTYPE.itemsize)
+    data = table + _aligned(n_slots*SHM_SLOT_DTYPE.itemsize)
+    stride = _aligned(slot_bytes)
+    return table, data, stride, data + n_slots*stride
+
+
+class _ShmRing(object):
+    "numpy views of header, slot table and slot data of a shared memory block"
+
+    def _map(self, shm, n_slots, slot_bytes):
+        self.shm = shm
+        table, data, stride, size = shm_layout(n_slots, slot_bytes)
+        self.n_slots = n_slots
+        self.slot_bytes = slot_bytes
+        self.data_offset = data
+        self.stride = stride
+        self.header = np.ndarray((), dtype=SHM_HEADER_DTYPE, buffer=shm.buf)
+        self.slots = np.ndarray((n_slots,), dtype=SHM_SLOT_DTYPE, buffer=shm.buf, offset=table)
+
+    def slot_array(self, i, shape, dtype):
+        "array of shape and dtype on the data of slot i"
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf,
+                          offset=self.data_offset + i*self.stride)
+
+    def _release(self):
+        # views must go before the mapping can be closed
+        self.header = None
+        self.slots = None
+
+
+class FrameShmPublisher(_ShmRing):
+    """
+    Creates shared memory block `name` and publishes frames into it,
+    see module docstring. Single writer, frames larger than slot_bytes
+    are dropped (n_oversize). With replace=True an existing block of the
+    same name (e.g. left behind by a crashed process) is removed first.
+    """
+
+    def __init__(self, name, n_slots=8, slot_bytes=1 << 22, replace=False):
+        n_slots = int(n_slots)
+        slot_bytes = int(slot_bytes)
+        size = shm_layout(n_slots, slot_bytes)[3]
+        try:
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            if not replace:
+                raise
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self._map(shm, n_slots, slot_bytes)
+        self.slots[...] = 0
+        h = self.header
+        h['magic'] = SHM_MAGIC
+        h['version'] = SHM_VERSION
+        h['n_slots'] = n_slots
+        h['slot_bytes'] = slot_bytes
+        h['head'] = 0
+        h['closed'] = 0
+        self.name = name
+        self.n_published = 0
+        self.n_oversize = 0
+
+    def publish(self, img, info=None):
+        "Copy img into the next slot. Returns its sequence number, None if dropped"
+        if img.nbytes > self.slot_bytes or img.ndim > SHM_MAX_NDIM:
+            self.n_oversize += 1
+            return None
+        seq = int(self.header['head'])
+        i = seq % self.n_slots
+        slot = self.slots[i:i+1]
+        slot['lock'] += 1
+        slot['seq'] = seq
+        slot['ndim'] = img.ndim
+        slot['shape'] = img.shape + (0,)*(SHM_MAX_NDIM - img.ndim)
+        slot['dtype'] = img.dtype.str
+        slot['nbytes'] = img.nbytes
+        info = info or dict()
+        slot['timestamp'] = info.get('timestamp', 0)
+        slot['frame_id'] = info.get('frame_id', 0)
+        slot['host_time'] = info.get('host_time', 0.0)
+        np.copyto(self.slot_array(i, img.shape, img.dtype), img)
+        slot['lock'] += 1
+        self.header['head'] = seq + 1
+        self.n_published += 1
+        return seq
+
+    def close(self):
+        "mark the ring closed for the clients and remove the shared memory block"
+        if self.shm is None:
+            return
+        self.header['closed'] = 1
+        self._release()
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+        self.shm = None
+
+
+class FrameShmClient(_ShmRing):
+    """
+    Reads frames of the FrameShmPublisher `name`, like a FrameRingCursor:
+    mode 'next': get() returns every frame in order ("next unseen frame")
+    mode 'latest': get() skips to the newest unseen frame
+    Frames that were overwritten before or while they were read are
+    counted in n_missed and n_torn.
+    """
+
+    def __init__(self, name, mode='next'):
+        assert mode in ('next', 'latest')
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13 has no track argument: the resource tracker
+            # would remove the block when this process exits, only the
+            # publisher should. Unregistering afterwards is not an option,
+            # forked processes share the publisher's tracker.
+            from multiprocessing import resource_tracker
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                shm = shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+        header = np.ndarray((), dtype=SHM_HEADER_DTYPE, buffer=shm.buf)
+        if header['magic'] != SHM_MAGIC or header['version'] != SHM_VERSION:
+            del header
+            shm.close()
+            raise ValueError("{} is not a flircam frame ring".format(name))
+        n_slots, slot_bytes = int(header['n_slots']), int(header['slot_bytes'])
+        del header
+        self._map(shm, n_slots, slot_bytes)
+        self.name = name
+        self.mode = mode
+        self.next_seq = self.head
+        self.n_read = 0
+        self.n_skipped = 0
+        self.n_missed = 0
+        self.n_torn = 0
+
+    @property
+    def head(self):
+        return int(self.header['head'])
+
+    @property
+    def closed(self):
+        return bool(self.header['closed'])
+
+    def read(self, seq, copy=True, out=None):
+        """
+        Returns (frame, meta) of frame seq, None if it is not in the ring
+        (not yet published or overwritten). With copy=False frame is a
+        view into shared memory, see is_current().
+        """
+        i = seq % self.n_slots
+        slot = self.slots[i]
+        lock = int(slot['lock'])
+        if lock % 2 or int(slot['seq']) != seq or seq >= self.head:
+            return None
+        ndim = int(slot['ndim'])
+        shape = tuple(int(n) for n in slot['shape'][:ndim])
+        dtype = np.dtype(slot['dtype'].decode())
+        meta = dict(seq=seq, timestamp=int(slot['timestamp']),
+                    frame_id=int(slot['frame_id']), host_time=float(slot['host_time']))
+        frame = self.slot_array(i, shape, dtype)
+        if copy:
+            if out is None:
+                out = np.empty(shape, dtype=dtype)
+            np.copyto(out, frame)
+            frame = out
+        if int(slot['lock']) != lock:
+            self.n_torn += 1
+            return None
+        meta['lock'] = lock
+        return frame, meta
+
+    def is_current(self, meta):
+        "True if the frame of meta (from read() or get()) was not overwritten since"
+        i = meta['seq'] % self.n_slots
+        return int(self.slots[i]['lock']) == meta['lock']
+
+    def get(self, copy=True, out=None):
+        """
+        Returns (seq, frame, meta) of the next unseen frame according to
+        self.mode, or None if there is no new frame
+        """
+        while True:
+            head = self.head
+            seq = self.next_seq
+            if seq >= head:
+                return None
+            if self.mode == 'latest':
+                target = head - 1
+                self.n_skipped += target - seq
+            else:
+                target = max(seq, head - self.n_slots)
+                self.n_missed += target - seq
+            self.next_seq = target + 1
+            result = self.read(target, copy=copy, out=out)
+            if result is None:
+                self.n_missed += 1
+                continue
+            self.n_read += 1
+            return (target,) + result
+
+    def wait(self, timeout=1.0, copy=True, out=None, poll=0.0005):
+        "Like get(), but waits up to timeout seconds for a new frame"
+        t_end = time.perf_counter() + timeout
+        while True:
+            entry = self.get(copy=copy, out=out)
+            if entry is not None or self.closed:
+                return entry
+            if time.perf_counter() > t_end:
+                return None
+            time.sleep(poll)
+
+    def pending(self):
+        return max(0, min(self.head - self.next_seq, self.n_slots))
+
+    def stats(self):
+        return dict(read=self.n_read, skipped=self.n_skipped, missed=self.n_missed,
+                    torn=self.n_torn, pending=self.pending())
+
+    def close(self):
+        if self.shm is None:
+            return
+        self._release()
+        self.shm.close()
+        self.shm = None
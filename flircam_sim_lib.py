@@ -0,0 +1,1059 @@
+"""
+Simulated SpinnakerC backend.
+
+SimSpinnakerLib stands in for the ctypes SpinnakerC library object
+(FlirCamInterface.lib). It implements the spinXxx entry points used by
+this package with the same calling convention (handles passed as
+c_void_p, outputs written through ctypes.byref / string buffers, error
+codes as return values) on top of a virtual camera with a configurable
+node map. Acquisition code can run, and be timed, without a camera:
+
+    lib = SimSpinnakerLib(width=640, height=480, pixel_format='Mono8',
+                          frame_rate=100.0, incomplete_rate=0.01)
+    cam = FlirCamInterface(lib=lib)
+"""
+from collections import OrderedDict, deque
+import time
+import numpy as np
+from .flircam_consts import FlirCamErrors, SpinNodeTypeEnum
+
+ERR = FlirCamErrors
+SUCCESS = 0
+
+# PixelFormat entries of the virtual camera: name -> (PFNC value, bits per pixel)
+SIM_PIXEL_FORMATS = OrderedDict([
+    ('Mono8',        (0x01080001, 8)),
+    ('Mono10Packed', (0x010C0004, 12)),
+    ('Mono10p',      (0x010A0046, 10)),
+    ('Mono12Packed', (0x010C0006, 12)),
+    ('Mono12p',      (0x010C0047, 12)),
+    ('Mono16',       (0x01100007, 16)),
+    ('RGB8',         (0x02180014, 24)),
+    ('BayerRG8',     (0x01080009, 8)),
+    ('BayerGB8',     (0x0108000A, 8)),
+    ('BayerGR8',     (0x01080008, 8)),
+    ('BayerBG8',     (0x0108000B, 8)),
+    ])
+
+# StreamBufferHandlingMode entries of the TL stream node map
+SIM_STREAM_HANDLING_MODES = [('NewestFirst', 0), ('NewestOnly', 1), 
+                             ('OldestFirst', 2), ('OldestFirstOverwrite', 3)]
+
+# Bayer tile rows, top-left first
+BAYER_TILES = {'RG': ('RG', 'GB'), 'GB': ('GB', 'RG'),
+               'GR': ('GR', 'BG'), 'BG': ('BG', 'GR')}
+
+_NT = SpinNodeTypeEnum
+
+
+def _val(x):
+    "python value of an argument passed by value (ctypes object or python)"
+    x = getattr(x, '_obj', x)
+    return getattr(x, 'value', x)
+
+
+def _set(p, value):
+    "write value through an output argument (byref() or ctypes buffer)"
+    getattr(p, '_obj', p).value = value
+
+
+def _set_str(buf, plen, s):
+    "write string s to buffer buf with length pointer plen"
+    b = s.encode() if isinstance(s, str) else s
+    obj = getattr(buf, '_obj', buf)
+    if len(b) + 1 > len(obj):
+        return ERR['SPINNAKER_ERR_BUFFER_TOO_SMALL']
+    obj.value = b
+    _set(plen, len(b) + 1)
+    return SUCCESS
+
+
+class _SimObject(object):
+    "system and camera handles"
+    pass
+
+
+class SimNode(object):
+    """
+    Node of the virtual node map. value, vmin, vmax, available,
+    readable and writable may be callables, evaluated on access. A node
+    that is not available is neither readable nor writable. Without
+    vmin/vmax the limits of a number node are its value.
+    """
+
+    def __init__(self, name, node_type, value=None, vmin=None, vmax=None, inc=None,
+                 entries=None, available=True, readable=True, writable=True,
+                 locked_while_acquiring=False, on_write=None, features=None):
+        self.name = name
+        self.node_type = node_type
+        self._value = value
+        self.vmin = vmin
+        self.vmax = vmax
+        self.inc = inc
+        self.available = available
+        self.readable = readable
+        self.writable = writable
+        self.locked_while_acquiring = locked_while_acquiring
+        self.on_write = on_write
+        self.features = features or []  # child nodes of category nodes
+        self.parent = None
+        self.entries = []
+        for sym, int_val in (entries or []):
+            e = SimNode(sym, _NT.EnumEntryNode, value=int_val, writable=False)
+            e.parent = self
+            self.entries.append(e)
+
+    @staticmethod
+    def _eval(x):
+        return x() if callable(x) else x
+
+    @property
+    def value(self):
+        return self._eval(self._value)
+
+    def get_min(self):
+        return self.value if self.vmin is None else self._eval(self.vmin)
+
+    def get_max(self):
+        return self.value if self.vmax is None else self._eval(self.vmax)
+
+    def current_entry(self):
+        v = self.value
+        for e in self.entries:
+            if e.value == v:
+                return e
+        return None
+
+    def entry_by_name(self, sym):
+        for e in self.entries:
+            if e.name == sym:
+                return e
+        return None
+
+    def to_string(self):
+        if self.node_type == _NT.EnumerationNode:
+            e = self.current_entry()
+            return e.name if e else ''
+        if self.node_type == _NT.BooleanNode:
+            return 'true' if self.value else 'false'
+        return str(self.value)
+
+
+class SimNodeMap(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.nodes = OrderedDict()
+
+    def add(self, name, node_type, **kwargs):
+        node = SimNode(name, node_type, **kwargs)
+        self.nodes[name] = node
+        return node
+
+    def __getitem__(self, name):
+        return self.nodes[name]
+
+    def get(self, name):
+        return self.nodes.get(name)
+
+
+class SimImage(object):
+
+    def __init__(self, data, width, height, pixel_format_index, bits_per_pixel,
+                 timestamp, frame_id, status=0, incomplete=False, chunk=None):
+        self.data = data
+        self.width = width
+        self.height = height
+        self.pixel_format_index = pixel_format_index
+        self.bits_per_pixel = bits_per_pixel
+        self.timestamp = timestamp
+        self.frame_id = frame_id
+        self.status = status
+        self.incomplete = incomplete
+        self.chunk = chunk or dict()  # 'ChunkFrameID' ... -> value
+
+
+class SimSpinnakerLib(object):
+    """
+    Virtual camera behind the SpinnakerC API.
+
+    width, height       sensor size
+    pixel_format        initial PixelFormat, one of SIM_PIXEL_FORMATS
+    frame_rate          initial AcquisitionFrameRate (enabled), None: free run
+    exposure_time       initial ExposureTime in us
+    incomplete_rate     probability of a frame being reported incomplete
+    latency             delay from end of frame to availability (s)
+    latency_jitter      std. dev. of additional random delay (s)
+    link_bandwidth      bytes/s, limits the maximum frame rate
+    full_frame_rate     sensor readout limit at full height (fps)
+    realtime            if False, frames are delivered without waiting
+    buffer_count        stream buffers with StreamBufferCountMode 'Auto', 
+                        what happens when they are full depends on 
+                        StreamBufferHandlingMode (default 'OldestFirst': 
+                        new frames are dropped)
+    """
+
+    def __init__(self, width=1920, height=1200, pixel_format='RGB8', frame_rate=30.0,
+                 exposure_time=10000.0, incomplete_rate=0.0, latency=0.0,
+                 latency_jitter=0.0, link_bandwidth=380e6, full_frame_rate=163.0,
+                 realtime=True, buffer_count=10, n_sim_frames=8, seed=None):
+        self.sensor_width = width
+        self.sensor_height = height
+        self.incomplete_rate = incomplete_rate
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.link_bandwidth = link_bandwidth
+        self.full_frame_rate = full_frame_rate
+        self.realtime = realtime
+        self.buffer_count = buffer_count
+        self.n_sim_frames = n_sim_frames
+        self.rng = np.random.RandomState(seed)
+
+        self._handles = dict()
+        self._next_handle = 0x1000
+        self.acquiring = False
+        self.initialized = False
+        self.frame_id = 0
+        self.n_dropped = 0
+        self.t0 = time.perf_counter()
+        self._next_frame_time = None
+        self._stream_queue = deque()   # (frame_id, t_frame) of frames in the stream buffers
+        self._triggers = deque()       # frame times of accepted triggers, see trigger()
+        self._trigger_ready_time = 0.0
+        self.n_triggers_ignored = 0
+        self._bank = None
+
+        self._system = _SimObject()
+        self._camera = _SimObject()
+        self.node_map = self._build_node_map(pixel_format, frame_rate, exposure_time)
+        self.tl_device_node_map = self._build_tl_device_node_map()
+        self.tl_stream_node_map = self._build_tl_stream_node_map()
+
+    ### handles
+
+    def _handle(self, obj):
+        "returns the integer handle of obj, creating it on first use"
+        h = getattr(obj, '_sim_handle', None)
+        if h is None:
+            h = obj._sim_handle = self._next_handle
+            self._next_handle += 16
+            self._handles[h] = obj
+        return h
+
+    def _obj(self, h):
+        return self._handles.get(_val(h))
+
+    def _new_handle(self, img):
+        h = self._next_handle
+        self._next_handle += 16
+        self._handles[h] = img
+        return h
+
+    ### virtual camera model
+
+    def _build_node_map(self, pixel_format, frame_rate, exposure_time):
+        nm = SimNodeMap('device')
+        self._nm = nm
+        I, F, E, B, C = _NT.IntegerNode, _NT.FloatNode, _NT.EnumerationNode, \
+            _NT.BooleanNode, _NT.CommandNode
+        locked = dict(locked_while_acquiring=True)
+        sw, sh = self.sensor_width, self.sensor_height
+
+        nm.add('AcquisitionMode', E, value=0, locked_while_acquiring=True,
+               entries=[('Continuous', 0), ('SingleFrame', 1), ('MultiFrame', 2)])
+        nm.add('PixelFormat', E, value=SIM_PIXEL_FORMATS[pixel_format][0], **locked,
+               entries=[(k, v[0]) for k, v in SIM_PIXEL_FORMATS.items()])
+        nm.add('PixelColorFilter', E, value=self._color_filter_value, writable=False,
+               entries=[('None', 0), ('BayerRG', 1), ('BayerGB', 2),
+                        ('BayerGR', 3), ('BayerBG', 4)])
+
+        nm.add('SensorWidth', I, value=sw, writable=False)
+        nm.add('SensorHeight', I, value=sh, writable=False)
+        nm.add('WidthMax', I, value=lambda: self._binned_sensor_size()[0], writable=False)
+        nm.add('HeightMax', I, value=lambda: self._binned_sensor_size()[1], writable=False)
+        nm.add('Width', I, value=sw, vmin=8, inc=8, **locked,
+               vmax=lambda: nm['WidthMax'].value - nm['OffsetX'].value)
+        nm.add('Height', I, value=sh, vmin=2, inc=2, **locked,
+               vmax=lambda: nm['HeightMax'].value - nm['OffsetY'].value)
+        nm.add('OffsetX', I, value=0, vmin=0, inc=4, **locked,
+               vmax=lambda: nm['WidthMax'].value - nm['Width'].value)
+        nm.add('OffsetY', I, value=0, vmin=0, inc=2, **locked,
+               vmax=lambda: nm['HeightMax'].value - nm['Height'].value)
+        for name in ('BinningHorizontal', 'BinningVertical',
+                     'DecimationHorizontal', 'DecimationVertical'):
+            nm.add(name, I, value=1, vmin=1, vmax=4, inc=1, **locked,
+                   on_write=self._clamp_geometry)
+
+        nm.add('ExposureAuto', E, value=0,
+               entries=[('Off', 0), ('Once', 1), ('Continuous', 2)])
+        nm.add('ExposureTime', F, value=float(exposure_time), vmin=6.0,
+               vmax=self._max_exposure_time,
+               writable=lambda: nm['ExposureAuto'].value == 0)
+        nm.add('AcquisitionFrameRateEnable', B, value=frame_rate is not None)
+        nm.add('AcquisitionFrameRate', F, value=float(frame_rate or 1.0), vmin=1.0,
+               vmax=self._max_frame_rate,
+               writable=lambda: bool(nm['AcquisitionFrameRateEnable'].value))
+        nm.add('AcquisitionResultingFrameRate', F, value=self._resulting_frame_rate,
+               writable=False)
+        # frame start trigger, TriggerSource can only change with TriggerMode 'Off'
+        nm.add('TriggerSelector', E, value=0, entries=[('FrameStart', 0)])
+        nm.add('TriggerMode', E, value=0, entries=[('Off', 0), ('On', 1)],
+               on_write=self._restart_frame_clock)
+        nm.add('TriggerSource', E, value=0,
+               entries=[('Software', 0), ('Line0', 1), ('Line1', 2), ('Line2', 3), ('Line3', 4)],
+               writable=lambda: nm['TriggerMode'].value == 0)
+        nm.add('TriggerActivation', E, value=0,
+               entries=[('RisingEdge', 0), ('FallingEdge', 1), ('AnyEdge', 2),
+                        ('LevelHigh', 3), ('LevelLow', 4)])
+        nm.add('TriggerDelay', F, value=9.0, vmin=9.0, vmax=65520.0)
+        nm.add('TriggerSoftware', C, writable=lambda: self._trigger_source() == 'Software',
+               on_write=lambda node: self.trigger())
+        # chunk data, ChunkEnable of the selected chunk
+        self._chunk_enabled = OrderedDict([('FrameID', False), ('Timestamp', False),
+                                           ('ExposureTime', False), ('Gain', False)])
+        nm.add('ChunkModeActive', B, value=False, **locked)
+        nm.add('ChunkSelector', E, value=0,
+               entries=[(k, i) for i, k in enumerate(self._chunk_enabled)])
+        nm.add('ChunkEnable', B, **locked,
+               value=lambda: self._chunk_enabled[nm['ChunkSelector'].current_entry().name],
+               on_write=self._write_chunk_enable)
+        nm.add('GainAuto', E, value=0,
+               entries=[('Off', 0), ('Once', 1), ('Continuous', 2)])
+        nm.add('Gain', F, value=0.0, vmin=0.0, vmax=47.9,
+               writable=lambda: nm['GainAuto'].value == 0)
+        return nm
+
+    def _build_tl_device_node_map(self):
+        nm = SimNodeMap('tl_device')
+        S = _NT.StringNode
+        info = [nm.add('DeviceVendorName', S, value='FLIR (simulated)', writable=False),
+                nm.add('DeviceModelName', S, value='SimSpinnakerLib', writable=False),
+                nm.add('DeviceSerialNumber', S, value='00000000', writable=False)]
+        nm.add('DeviceInformation', _NT.CategoryNode, features=info, writable=False)
+        return nm
+
+    def _build_tl_stream_node_map(self):
+        nm = SimNodeMap('tl_stream')
+        I, E = _NT.IntegerNode, _NT.EnumerationNode
+        locked = dict(locked_while_acquiring=True)
+        nm.add('StreamBufferCountMode', E, value=1, entries=[('Manual', 0), ('Auto', 1)], 
+               **locked)
+        nm.add('StreamBufferCountManual', I, value=self.buffer_count, vmin=1, vmax=2048, 
+               inc=1, **locked)
+        nm.add('StreamBufferCountResult', I, value=self._stream_buffer_count, writable=False)
+        nm.add('StreamBufferHandlingMode', E, value=2, entries=SIM_STREAM_HANDLING_MODES)
+        nm.add('StreamLostFrameCount', I, value=lambda: self.n_dropped, writable=False)
+        return nm
+
+    def _stream_buffer_count(self):
+        nm = self.tl_stream_node_map
+        if nm['StreamBufferCountMode'].current_entry().name == 'Manual':
+            return nm['StreamBufferCountManual'].value
+        return self.buffer_count
+
+    def _write_chunk_enable(self, node):
+        nm = self._nm
+        self._chunk_enabled[nm['ChunkSelector'].current_entry().name] = bool(node._value)
+        node._value = lambda: self._chunk_enabled[nm['ChunkSelector'].current_entry().name]
+
+    def _chunk_data(self, frame_id, timestamp):
+        "chunk data of a frame: 'Chunk' + selector -> value"
+        nm = self._nm
+        if not nm['ChunkModeActive'].value:
+            return None
+        values = dict(FrameID=frame_id, Timestamp=timestamp,
+                      ExposureTime=nm['ExposureTime'].value, Gain=nm['Gain'].value)
+        return {'Chunk' + k: values[k] for k, on in self._chunk_enabled.items() if on}
+
+    def _restart_frame_clock(self, node=None):
+        "free running frames start over after a trigger mode change"
+        self._triggers.clear()
+        if self.acquiring:
+            self._next_frame_time = time.perf_counter() + 1.0/self._resulting_frame_rate()
+
+    def _trigger_source(self):
+        "TriggerSource name if TriggerMode is 'On', else None"
+        nm = self._nm
+        if nm['TriggerMode'].value == 0:
+            return None
+        return nm['TriggerSource'].current_entry().name
+
+    def trigger(self, line=None, t=None):
+        """
+        Trigger edge at time t (time.perf_counter(), default now): a software
+        trigger, or with line ('Line0', ...) an edge on that input line. 
+        Starts a frame if the trigger source matches and the camera is ready
+        (the previous triggered frame is read out), otherwise it is ignored.
+        Without realtime, a trigger at the default time is taken as arriving
+        once the camera is ready, as the frames do not wait for the clock.
+        Returns True if a frame was started.
+        """
+        source = self._trigger_source()
+        if not self.acquiring or source is None or source != (line or 'Software'):
+            return False
+        if t is None:
+            t = time.perf_counter()
+            if not self.realtime:
+                t = max(t, self._trigger_ready_time)
+        if t < self._trigger_ready_time:
+            self.n_triggers_ignored += 1
+            return False
+        # frame time: end of readout, the next trigger is accepted from then on
+        t_frame = t + 1e-6*(self._nm['TriggerDelay'].value + self._nm['ExposureTime'].value) \
+            + 1.0/self._max_frame_rate()
+        self._trigger_ready_time = t_frame
+        self._triggers.append(t_frame)
+        return True
+
+    def pixel_format_name(self):
+        return self._nm['PixelFormat'].current_entry().name
+
+    def _color_filter_value(self):
+        fmt = self.pixel_format_name()
+        if fmt.startswith('Bayer'):
+            return 1 + list(BAYER_TILES.keys()).index(fmt[5:7])
+        return 0
+
+    def _binned_sensor_size(self):
+        nm = self._nm
+        fx = nm['BinningHorizontal'].value*nm['DecimationHorizontal'].value
+        fy = nm['BinningVertical'].value*nm['DecimationVertical'].value
+        return self.sensor_width//fx, self.sensor_height//fy
+
+    def _clamp_geometry(self, node=None):
+        nm = self._nm
+        wmax, hmax = self._binned_sensor_size()
+        nm['Width']._value = min(nm['Width'].value, wmax)
+        nm['Height']._value = min(nm['Height'].value, hmax)
+        nm['OffsetX']._value = min(nm['OffsetX'].value, wmax - nm['Width'].value)
+        nm['OffsetY']._value = min(nm['OffsetY'].value, hmax - nm['Height'].value)
+
+    def _frame_nbytes(self):
+        nm = self._nm
+        bpp = SIM_PIXEL_FORMATS[self.pixel_format_name()][1]
+        return (nm['Width'].value*nm['Height'].value*bpp + 7)//8
+
+    def _max_frame_rate(self):
+        nm = self._nm
+        readout = self.full_frame_rate*self._binned_sensor_size()[1]/nm['Height'].value
+        return min(readout, self.link_bandwidth/self._frame_nbytes())
+
+    def _max_exposure_time(self):
+        if self._nm['AcquisitionFrameRateEnable'].value:
+            return 1e6/self._nm['AcquisitionFrameRate'].value
+        return 30e6
+
+    def _resulting_frame_rate(self):
+        nm = self._nm
+        rate = self._max_frame_rate()
+        if nm['AcquisitionFrameRateEnable'].value:
+            rate = min(rate, nm['AcquisitionFrameRate'].value)
+        return min(rate, 1e6/nm['ExposureTime'].value)
+
+    def _node_readable(self, node):
+        return node is not None and bool(node._eval(node.available)) \
+            and bool(node._eval(node.readable))
+
+    def _node_writable(self, node):
+        if node is None or not node._eval(node.available) or not node._eval(node.writable):
+            return False
+        if node.locked_while_acquiring and self.acquiring:
+            return False
+        return True
+
+    def _write_node(self, node, value):
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        if not self._node_writable(node):
+            return ERR['GENICAM_ERR_ACCESS']
+        t = node.node_type
+        if t in (_NT.IntegerNode, _NT.FloatNode):
+            vmin, vmax = node.get_min(), node.get_max()
+            if (vmin is not None and value < vmin) or (vmax is not None and value > vmax):
+                return ERR['GENICAM_ERR_OUT_OF_RANGE']
+            if t == _NT.IntegerNode:
+                value = int(value)
+                if node.inc and (value - (vmin or 0)) % node.inc:
+                    return ERR['GENICAM_ERR_OUT_OF_RANGE']
+            else:
+                value = float(value)
+        elif t == _NT.EnumerationNode:
+            if value not in [e.value for e in node.entries]:
+                return ERR['GENICAM_ERR_INVALID_ARGUMENT']
+        elif t == _NT.BooleanNode:
+            value = bool(value)
+        node._value = value
+        if node.on_write is not None:
+            node.on_write(node)
+        return SUCCESS
+
+    ### frame synthesis
+
+    def _render(self, k):
+        "k-th frame of the bank as float image in [0,1], (h, w) mono and (h, w, 3) rgb"
+        nm = self._nm
+        w, h = nm['Width'].value, nm['Height'].value
+        fx = nm['BinningHorizontal'].value*nm['DecimationHorizontal'].value
+        fy = nm['BinningVertical'].value*nm['DecimationVertical'].value
+        x = (nm['OffsetX'].value + np.arange(w))*fx
+        y = (nm['OffsetY'].value + np.arange(h))*fy
+        sw, sh = self.sensor_width, self.sensor_height
+        phi = 2*np.pi*k/self.n_sim_frames
+        cx, cy = sw*(0.5 + 0.25*np.cos(phi)), sh*(0.5 + 0.25*np.sin(phi))
+        sigma = sw/30.0
+        gx = np.exp(-(x - cx)**2/(2*sigma**2))
+        gy = np.exp(-(y - cy)**2/(2*sigma**2))
+        mono = 0.05 + 0.1*(x/sw)[None, :] + 0.8*np.outer(gy, gx)
+        mono += self.rng.normal(0, 0.01, size=mono.shape)
+        mono = np.clip(mono, 0, 1)
+        rgb = np.clip(mono[:, :, None]*np.array([1.0, 0.75, 0.5])
+                      + 0.1*(y/sh)[:, None, None]*np.array([0, 0, 1.0]), 0, 1)
+        return mono, rgb
+
+    def _encode(self, mono, rgb, fmt):
+        "raw buffer (flat uint8) of a frame in pixel format fmt"
+        if fmt == 'RGB8':
+            return (rgb*255).astype(np.uint8).ravel()
+        if fmt.startswith('Bayer'):
+            tile = BAYER_TILES[fmt[5:7]]
+            raw = np.empty(mono.shape, dtype=np.uint8)
+            rgb8 = (rgb*255).astype(np.uint8)
+            for r in (0, 1):
+                for c in (0, 1):
+                    ch = 'RGB'.index(tile[r][c])
+                    raw[r::2, c::2] = rgb8[r::2, c::2, ch]
+            return raw.ravel()
+        if fmt == 'Mono8':
+            return (mono*255).astype(np.uint8).ravel()
+        if fmt == 'Mono16':
+            return (mono*65535).astype('<u2').ravel().view(np.uint8)
+        if fmt in ('Mono12Packed', 'Mono12p'):
+            return _pack(fmt, (mono*4095).astype(np.uint16).ravel())
+        if fmt in ('Mono10Packed', 'Mono10p'):
+            return _pack(fmt, (mono*1023).astype(np.uint16).ravel())
+        raise ValueError("SimSpinnakerLib can't encode {}".format(fmt))
+
+    def _make_bank(self):
+        fmt = self.pixel_format_name()
+        frames = []
+        for k in range(self.n_sim_frames):
+            mono, rgb = self._render(k)
+            frames.append(self._encode(mono, rgb, fmt))
+        self._bank = frames
+
+    def _fill_stream_buffers(self, now, at_least=0):
+        """
+        Frames read out (plus latency) by time now go to the stream
+        buffers, according to StreamBufferHandlingMode. Returns the
+        number of new frames.
+        """
+        if self._trigger_source() is not None:
+            # triggered frames, in trigger order
+            times = []
+            while self._triggers and (self._triggers[0] + self.latency <= now or 
+                                      len(times) < at_least):
+                times.append(self._triggers.popleft())
+            n = len(times)
+            frame_time = times.__getitem__
+        else:
+            period = 1.0/self._resulting_frame_rate()
+            n = int(np.floor((now - self.latency - self._next_frame_time)/period)) + 1
+            n = max(n, at_least, 0)
+            t0 = self._next_frame_time
+            frame_time = lambda i: t0 + i*period
+            self._next_frame_time += n*period
+        if n == 0:
+            return 0
+        mode = self.tl_stream_node_map['StreamBufferHandlingMode'].current_entry().name
+        capacity = 1 if mode == 'NewestOnly' else self._stream_buffer_count()
+        q = self._stream_queue
+        if mode == 'OldestFirst':
+            # full buffers: new frames are dropped
+            first, last = 0, min(n, max(0, capacity - len(q)))
+        else:
+            # full buffers: oldest frames are overwritten, only the newest survive
+            first, last = max(0, n - capacity), n
+        for i in range(first, last):
+            q.append((self.frame_id + i, frame_time(i)))
+        lost = n - (last - first)
+        while len(q) > capacity:
+            q.popleft()
+            lost += 1
+        self.n_dropped += lost
+        self.frame_id += n
+        return n
+
+    def _grab(self, timeout_s):
+        "returns (error, SimImage) for the next frame"
+        if not self.acquiring:
+            return ERR['SPINNAKER_ERR_NOT_AVAILABLE'], None
+        if self.realtime:
+            now = time.perf_counter()
+            self._fill_stream_buffers(now)
+            if not self._stream_queue and self._trigger_source() is not None:
+                # waiting for a trigger, e.g. from another thread
+                while not self._triggers and self._trigger_source() is not None:
+                    if timeout_s is not None and time.perf_counter() - now >= timeout_s:
+                        return ERR['SPINNAKER_ERR_TIMEOUT'], None
+                    time.sleep(0.0005)
+                if timeout_s is not None:
+                    timeout_s = max(0.0, timeout_s - (time.perf_counter() - now))
+                now = time.perf_counter()
+                self._fill_stream_buffers(now)
+            if not self._stream_queue:
+                if self._trigger_source() is not None and self._triggers:
+                    t_ready = self._triggers[0] + self.latency
+                else:
+                    t_ready = self._next_frame_time + self.latency
+                if self.latency_jitter:
+                    t_ready += abs(self.rng.normal(0, self.latency_jitter))
+                wait = t_ready - now
+                if timeout_s is not None and wait > timeout_s:
+                    time.sleep(timeout_s)
+                    return ERR['SPINNAKER_ERR_TIMEOUT'], None
+                time.sleep(max(0.0, wait))
+                self._fill_stream_buffers(time.perf_counter(), at_least=1)
+        elif self._trigger_source() is not None:
+            if not self._stream_queue and not self._triggers:
+                return ERR['SPINNAKER_ERR_TIMEOUT'], None
+            self._fill_stream_buffers(-np.inf, at_least=1)
+        else:
+            self._fill_stream_buffers(self._next_frame_time + self.latency, at_least=1)
+        if not self._stream_queue:
+            # trigger mode changed while waiting
+            return ERR['SPINNAKER_ERR_TIMEOUT'], None
+        mode = self.tl_stream_node_map['StreamBufferHandlingMode'].current_entry().name
+        if mode in ('NewestFirst', 'NewestOnly'):
+            frame_id, t_frame = self._stream_queue.pop()
+        else:
+            frame_id, t_frame = self._stream_queue.popleft()
+
+        nm = self._nm
+        fmt = self.pixel_format_name()
+        status, incomplete = 0, False
+        if self.incomplete_rate and self.rng.random_sample() < self.incomplete_rate:
+            status, incomplete = int(self.rng.choice([1, 2, 3, 7])), True
+        timestamp = int((t_frame - self.t0)*1e9)
+        img = SimImage(data=self._bank[frame_id % len(self._bank)],
+                       width=nm['Width'].value, height=nm['Height'].value,
+                       pixel_format_index=list(SIM_PIXEL_FORMATS.keys()).index(fmt),
+                       bits_per_pixel=SIM_PIXEL_FORMATS[fmt][1],
+                       timestamp=timestamp, frame_id=frame_id, status=status,
+                       incomplete=incomplete, chunk=self._chunk_data(frame_id, timestamp))
+        return SUCCESS, img
+
+    ### SpinnakerC API: system and camera
+
+    def spinSystemGetInstance(self, phSystem):
+        _set(phSystem, self._handle(self._system))
+        return SUCCESS
+
+    def spinSystemReleaseInstance(self, hSystem):
+        return SUCCESS
+
+    def spinCameraListCreateEmpty(self, phCameraList):
+        cam_list = []
+        h = self._new_handle(cam_list)
+        _set(phCameraList, h)
+        return SUCCESS
+
+    def spinSystemGetCameras(self, hSystem, hCameraList):
+        cam_list = self._obj(hCameraList)
+        if cam_list is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        cam_list[:] = [self._camera]
+        return SUCCESS
+
+    def spinCameraListGetSize(self, hCameraList, pSize):
+        cam_list = self._obj(hCameraList)
+        if cam_list is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        _set(pSize, len(cam_list))
+        return SUCCESS
+
+    def spinCameraListGet(self, hCameraList, index, phCamera):
+        cam_list = self._obj(hCameraList)
+        i = _val(index)
+        if cam_list is None or i >= len(cam_list):
+            return ERR['SPINNAKER_ERR_INVALID_PARAMETER']
+        _set(phCamera, self._handle(cam_list[i]))
+        return SUCCESS
+
+    def spinCameraListClear(self, hCameraList):
+        cam_list = self._obj(hCameraList)
+        if cam_list is not None:
+            cam_list[:] = []
+        return SUCCESS
+
+    def spinCameraListDestroy(self, hCameraList):
+        self._handles.pop(_val(hCameraList), None)
+        return SUCCESS
+
+    def spinCameraInit(self, hCamera):
+        self.initialized = True
+        return SUCCESS
+
+    def spinCameraDeInit(self, hCamera):
+        self.initialized = False
+        return SUCCESS
+
+    def spinCameraRelease(self, hCamera):
+        return SUCCESS
+
+    def spinCameraGetNodeMap(self, hCamera, phNodeMap):
+        if not self.initialized:
+            return ERR['SPINNAKER_ERR_NOT_INITIALIZED']
+        _set(phNodeMap, self._handle(self.node_map))
+        return SUCCESS
+
+    def spinCameraGetTLDeviceNodeMap(self, hCamera, phNodeMap):
+        _set(phNodeMap, self._handle(self.tl_device_node_map))
+        return SUCCESS
+
+    def spinCameraGetTLStreamNodeMap(self, hCamera, phNodeMap):
+        _set(phNodeMap, self._handle(self.tl_stream_node_map))
+        return SUCCESS
+
+    def spinCameraBeginAcquisition(self, hCamera):
+        if self.acquiring:
+            return ERR['SPINNAKER_ERR_RESOURCE_IN_USE']
+        self._make_bank()
+        self._stream_queue.clear()
+        self._triggers.clear()
+        self._trigger_ready_time = 0.0
+        self.acquiring = True
+        self._next_frame_time = time.perf_counter() + 1.0/self._resulting_frame_rate()
+        return SUCCESS
+
+    def spinCameraEndAcquisition(self, hCamera):
+        if not self.acquiring:
+            return ERR['SPINNAKER_ERR_NOT_AVAILABLE']
+        self.acquiring = False
+        return SUCCESS
+
+    def spinCameraGetNextImage(self, hCamera, phImage):
+        err, img = self._grab(None)
+        if err == SUCCESS:
+            _set(phImage, self._new_handle(img))
+        return err
+
+    def spinCameraGetNextImageEx(self, hCamera, grabTimeout, phImage):
+        err, img = self._grab(_val(grabTimeout)*1e-3)
+        if err == SUCCESS:
+            _set(phImage, self._new_handle(img))
+        return err
+
+    ### SpinnakerC API: images
+
+    def _image(self, hImage):
+        img = self._obj(hImage)
+        return img if isinstance(img, SimImage) else None
+
+    def _image_get(self, hImage, p, attr):
+        img = self._image(hImage)
+        if img is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        _set(p, attr(img))
+        return SUCCESS
+
+    def spinImageIsIncomplete(self, hImage, pbIsIncomplete):
+        return self._image_get(hImage, pbIsIncomplete, lambda img: img.incomplete)
+
+    def spinImageGetStatus(self, hImage, pStatus):
+        return self._image_get(hImage, pStatus, lambda img: img.status)
+
+    def spinImageGetWidth(self, hImage, pWidth):
+        return self._image_get(hImage, pWidth, lambda img: img.width)
+
+    def spinImageGetHeight(self, hImage, pHeight):
+        return self._image_get(hImage, pHeight, lambda img: img.height)
+
+    def spinImageGetTimeStamp(self, hImage, pTimeStamp):
+        return self._image_get(hImage, pTimeStamp, lambda img: img.timestamp)
+
+    def spinImageGetFrameID(self, hImage, pFrameID):
+        return self._image_get(hImage, pFrameID, lambda img: img.frame_id)
+
+    def spinImageGetBitsPerPixel(self, hImage, pBitsPerPixel):
+        return self._image_get(hImage, pBitsPerPixel, lambda img: img.bits_per_pixel)
+
+    def spinImageGetPixelFormat(self, hImage, pPixelFormat):
+        return self._image_get(hImage, pPixelFormat, lambda img: img.pixel_format_index)
+
+    def spinImageGetBufferSize(self, hImage, pSize):
+        return self._image_get(hImage, pSize, lambda img: img.data.nbytes)
+
+    def spinImageGetData(self, hImage, ppData):
+        return self._image_get(hImage, ppData, lambda img: img.data.ctypes.data)
+
+    def _chunk_get(self, hImage, pName, p):
+        img = self._image(hImage)
+        if img is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        name = _val(pName)
+        if isinstance(name, bytes):
+            name = name.decode()
+        if name not in img.chunk:
+            return ERR['SPINNAKER_ERR_NOT_AVAILABLE']
+        _set(p, img.chunk[name])
+        return SUCCESS
+
+    def spinImageChunkDataGetIntValue(self, hImage, pName, pValue):
+        return self._chunk_get(hImage, pName, pValue)
+
+    def spinImageChunkDataGetFloatValue(self, hImage, pName, pValue):
+        return self._chunk_get(hImage, pName, pValue)
+
+    def spinImageRelease(self, hImage):
+        if self._handles.pop(_val(hImage), None) is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        return SUCCESS
+
+    def spinImageSave(self, hImage, pFilename, format):
+        return ERR['SPINNAKER_ERR_NOT_IMPLEMENTED']
+
+    def spinImageCreateEmpty(self, phImage):
+        return ERR['SPINNAKER_ERR_NOT_IMPLEMENTED']
+
+    def spinImageConvert(self, hSrcImage, format, hDestImage):
+        return ERR['SPINNAKER_ERR_NOT_IMPLEMENTED']
+
+    def spinImageDestroy(self, hImage):
+        return ERR['SPINNAKER_ERR_NOT_IMPLEMENTED']
+
+    ### SpinnakerC API: nodes
+
+    def _node(self, hNode):
+        node = self._obj(hNode)
+        return node if isinstance(node, SimNode) else None
+
+    def spinNodeMapGetNode(self, hNodeMap, pName, phNode):
+        nm = self._obj(hNodeMap)
+        if not isinstance(nm, SimNodeMap):
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        name = _val(pName)
+        if isinstance(name, bytes):
+            name = name.decode()
+        node = nm.get(name)
+        # like the SDK, unknown nodes give a NULL handle that is not available
+        _set(phNode, None if node is None else self._handle(node))
+        return SUCCESS
+
+    def spinNodeIsAvailable(self, hNode, pbResult):
+        node = self._node(hNode)
+        _set(pbResult, node is not None and bool(node._eval(node.available)))
+        return SUCCESS
+
+    def spinNodeIsReadable(self, hNode, pbResult):
+        node = self._node(hNode)
+        _set(pbResult, self._node_readable(node))
+        return SUCCESS
+
+    def spinNodeIsWritable(self, hNode, pbResult):
+        _set(pbResult, self._node_writable(self._node(hNode)))
+        return SUCCESS
+
+    def spinNodeGetType(self, hNode, pType):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        _set(pType, node.node_type.value)
+        return SUCCESS
+
+    def spinNodeGetName(self, hNode, pBuf, pBufLen):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        return _set_str(pBuf, pBufLen, node.name)
+
+    def spinNodeToString(self, hNode, pBuf, pBufLen):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        return _set_str(pBuf, pBufLen, node.to_string())
+
+    def spinNodeFromString(self, hNode, pBuf):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        s = _val(pBuf)
+        if isinstance(s, bytes):
+            s = s.decode()
+        t = node.node_type
+        try:
+            if t == _NT.EnumerationNode:
+                e = node.entry_by_name(s)
+                if e is None:
+                    return ERR['GENICAM_ERR_INVALID_ARGUMENT']
+                value = e.value
+            elif t == _NT.IntegerNode:
+                value = int(s)
+            elif t == _NT.FloatNode:
+                value = float(s)
+            elif t == _NT.BooleanNode:
+                value = s.strip().lower() in ('1', 'true')
+            else:
+                value = s
+        except ValueError:
+            return ERR['GENICAM_ERR_INVALID_ARGUMENT']
+        return self._write_node(node, value)
+
+    def spinCategoryGetNumFeatures(self, hCategory, pValue):
+        node = self._node(hCategory)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        _set(pValue, len(node.features))
+        return SUCCESS
+
+    def spinCategoryGetFeatureByIndex(self, hCategory, index, phFeature):
+        node = self._node(hCategory)
+        i = _val(index)
+        if node is None or i >= len(node.features):
+            return ERR['SPINNAKER_ERR_INVALID_PARAMETER']
+        _set(phFeature, self._handle(node.features[i]))
+        return SUCCESS
+
+    def _read_value(self, hNode, p, attr=lambda node: node.value):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        if not self._node_readable(node):
+            return ERR['GENICAM_ERR_ACCESS']
+        _set(p, attr(node))
+        return SUCCESS
+
+    def spinIntegerGetValue(self, hNode, pValue):
+        return self._read_value(hNode, pValue)
+
+    def spinIntegerGetMin(self, hNode, pValue):
+        return self._read_value(hNode, pValue, lambda node: node.get_min())
+
+    def spinIntegerGetMax(self, hNode, pValue):
+        return self._read_value(hNode, pValue, lambda node: node.get_max())
+
+    def spinIntegerGetInc(self, hNode, pValue):
+        return self._read_value(hNode, pValue, lambda node: node.inc or 1)
+
+    def spinIntegerSetValue(self, hNode, value):
+        return self._write_node(self._node(hNode), int(_val(value)))
+
+    def spinFloatGetValue(self, hNode, pValue):
+        return self._read_value(hNode, pValue)
+
+    def spinFloatGetMin(self, hNode, pValue):
+        return self._read_value(hNode, pValue, lambda node: node.get_min())
+
+    def spinFloatGetMax(self, hNode, pValue):
+        return self._read_value(hNode, pValue, lambda node: node.get_max())
+
+    def spinFloatSetValue(self, hNode, value):
+        return self._write_node(self._node(hNode), float(_val(value)))
+
+    def spinBooleanGetValue(self, hNode, pbValue):
+        return self._read_value(hNode, pbValue, lambda node: bool(node.value))
+
+    def spinBooleanSetValue(self, hNode, value):
+        return self._write_node(self._node(hNode), bool(_val(value)))
+
+    def spinStringGetValue(self, hNode, pBuf, pBufLen):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        return _set_str(pBuf, pBufLen, str(node.value))
+
+    def spinCommandExecute(self, hNode):
+        node = self._node(hNode)
+        if node is None or node.node_type != _NT.CommandNode:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        if not self._node_writable(node):
+            return ERR['GENICAM_ERR_ACCESS']
+        if node.on_write is not None:
+            node.on_write(node)
+        return SUCCESS
+
+    ### SpinnakerC API: enumerations
+
+    def spinEnumerationGetNumEntries(self, hNode, pValue):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        _set(pValue, len(node.entries))
+        return SUCCESS
+
+    def spinEnumerationGetEntryByIndex(self, hNode, index, phEntry):
+        node = self._node(hNode)
+        i = _val(index)
+        if node is None or i >= len(node.entries):
+            return ERR['SPINNAKER_ERR_INVALID_PARAMETER']
+        _set(phEntry, self._handle(node.entries[i]))
+        return SUCCESS
+
+    def spinEnumerationGetEntryByName(self, hNode, pName, phEntry):
+        node = self._node(hNode)
+        name = _val(pName)
+        if isinstance(name, bytes):
+            name = name.decode()
+        e = None if node is None else node.entry_by_name(name)
+        if e is None:
+            return ERR['SPINNAKER_ERR_INVALID_PARAMETER']
+        _set(phEntry, self._handle(e))
+        return SUCCESS
+
+    def spinEnumerationGetCurrentEntry(self, hNode, phEntry):
+        node = self._node(hNode)
+        if node is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        e = node.current_entry()
+        if e is None:
+            return ERR['SPINNAKER_ERR_ERROR']
+        _set(phEntry, self._handle(e))
+        return SUCCESS
+
+    def spinEnumerationSetIntValue(self, hNode, value):
+        return self._write_node(self._node(hNode), int(_val(value)))
+
+    def spinEnumerationSetEnumValue(self, hNode, value):
+        node = self._node(hNode)
+        i = _val(value)
+        if node is None or i >= len(node.entries):
+            return ERR['SPINNAKER_ERR_INVALID_PARAMETER']
+        return self._write_node(node, node.entries[i].value)
+
+    def spinEnumerationEntryGetIntValue(self, hEntry, pValue):
+        return self._read_value(hEntry, pValue)
+
+    def spinEnumerationEntryGetEnumValue(self, hEntry, pValue):
+        return self._read_value(hEntry, pValue, lambda e: e.parent.entries.index(e))
+
+    def spinEnumerationEntryGetSymbolic(self, hEntry, pBuf, pBufLen):
+        e = self._node(hEntry)
+        if e is None:
+            return ERR['SPINNAKER_ERR_INVALID_HANDLE']
+        return _set_str(pBuf, pBufLen, e.name)
+
+
+def _pack(fmt, v):
+    "pack uint16 pixel values v (flat) into the byte layout of fmt"
+    if fmt == 'Mono10p':
+        # 4 pixels in 5 bytes, LSB first
+        q = v.reshape(-1, 4).astype(np.uint64)
+        packed = q[:, 0] | (q[:, 1] << 10) | (q[:, 2] << 20) | (q[:, 3] << 30)
+        return np.ascontiguousarray(
+            packed.astype('<u8').view(np.uint8).reshape(-1, 8)[:, :5]).ravel()
+    p0, p1 = v[0::2], v[1::2]
+    out = np.empty((p0.size, 3), dtype=np.uint8)
+    if fmt == 'Mono12p':
+        out[:, 0] = p0 & 0xFF
+        out[:, 1] = (p0 >> 8) | ((p1 & 0xF) << 4)
+        out[:, 2] = p1 >> 4
+    elif fmt == 'Mono12Packed':
+        out[:, 0] = p0 >> 4
+        out[:, 1] = (p0 & 0xF) | ((p1 & 0xF) << 4)
+        out[:, 2] = p1 >> 4
+    elif fmt == 'Mono10Packed':
+        out[:, 0] = p0 >> 2
+        out[:, 1] = (p0 & 0x3) | ((p1 & 0x3) << 4)
+        out[:, 2] = p1 >> 2
+    else:
+        raise ValueError(fmt)
+    return out.ravel()
@@ -0,0 +1,173 @@
+"""
+Typed, prebound SpinnakerC function prototypes.
+
+SpinApi(lib) declares argtypes / restype / errcheck once for every
+SpinnakerC function used in this package, so calls skip ctypes' untyped
+argument conversion and raise FlirCamError on a non-zero return code:
+
+    api = SpinApi(ctypes.cdll.LoadLibrary(libpath))
+    api.spinCameraBeginAcquisition(hCamera)
+
+For a lib that is not a ctypes library (e.g. SimSpinnakerLib) the
+functions are wrapped with the same error check instead.
+"""
+import ctypes
+from ctypes import POINTER, c_void_p, c_int, c_size_t, c_double, c_char_p, \
+    c_int64, c_uint64
+from .flircam_consts import FlirCamErrorNames
+
+
+class FlirCamError(IOError):
+    "SpinnakerC call returned an error code"
+
+    def __init__(self, code, detail=None):
+        self.code = code
+        self.err_name = FlirCamErrorNames.get(code, 'UNKNOWN_ERROR')
+        msg = "Flircam Error {}: {}".format(code, self.err_name)
+        if detail:
+            msg += " ({})".format(detail)
+        IOError.__init__(self, msg)
+
+
+class FlirCamTimeoutError(FlirCamError):
+    "SPINNAKER_ERR_TIMEOUT, e.g. no image within the grab timeout"
+    pass
+
+
+class FlirCamAccessError(FlirCamError):
+    "GENICAM_ERR_ACCESS, e.g. writing a node that is not writable right now"
+    pass
+
+
+_ERR_CLASSES = {-1011: FlirCamTimeoutError, -2006: FlirCamAccessError}
+
+
+def _err(retval):
+    if retval == 0:
+        return retval
+    raise _ERR_CLASSES.get(retval, FlirCamError)(retval)
+
+
+def _errcheck(result, func, args):
+    if result != 0:
+        raise _ERR_CLASSES.get(result, FlirCamError)(result)
+    return result
+
+
+# SpinnakerC typedefs
+spinHandle = c_void_p   # spinSystem, spinCamera, spinImage, spinNodeHandle, ...
+bool8_t = ctypes.c_bool
+spinEnum = c_int        # spinNodeType, spinImageStatus, spinPixelFormatEnums, ...
+
+P = POINTER
+H = spinHandle
+
+SPIN_PROTOTYPES = {
+    # system and camera list
+    'spinSystemGetInstance':            (P(H),),
+    'spinSystemReleaseInstance':        (H,),
+    'spinSystemGetCameras':             (H, H),
+    'spinCameraListCreateEmpty':        (P(H),),
+    'spinCameraListGetSize':            (H, P(c_size_t)),
+    'spinCameraListGet':                (H, c_size_t, P(H)),
+    'spinCameraListClear':              (H,),
+    'spinCameraListDestroy':            (H,),
+    # camera
+    'spinCameraInit':                   (H,),
+    'spinCameraDeInit':                 (H,),
+    'spinCameraRelease':                (H,),
+    'spinCameraGetNodeMap':             (H, P(H)),
+    'spinCameraGetTLDeviceNodeMap':     (H, P(H)),
+    'spinCameraGetTLStreamNodeMap':     (H, P(H)),
+    'spinCameraBeginAcquisition':       (H,),
+    'spinCameraEndAcquisition':         (H,),
+    'spinCameraGetNextImage':           (H, P(H)),
+    'spinCameraGetNextImageEx':         (H, c_uint64, P(H)),
+    # image
+    'spinImageIsIncomplete':            (H, P(bool8_t)),
+    'spinImageGetStatus':               (H, P(spinEnum)),
+    'spinImageGetWidth':                (H, P(c_size_t)),
+    'spinImageGetHeight':               (H, P(c_size_t)),
+    'spinImageGetTimeStamp':            (H, P(c_uint64)),
+    'spinImageGetFrameID':              (H, P(c_uint64)),
+    'spinImageGetBitsPerPixel':         (H, P(c_size_t)),
+    'spinImageGetPixelFormat':          (H, P(spinEnum)),
+    'spinImageGetBufferSize':           (H, P(c_size_t)),
+    'spinImageGetData':                 (H, P(c_void_p)),
+    'spinImageRelease':                 (H,),
+    'spinImageSave':                    (H, c_char_p, spinEnum),
+    'spinImageCreateEmpty':             (P(H),),
+    'spinImageConvert':                 (H, spinEnum, H),
+    'spinImageDestroy':                 (H,),
+    'spinImageChunkDataGetIntValue':    (H, c_char_p, P(c_int64)),
+    'spinImageChunkDataGetFloatValue':  (H, c_char_p, P(c_double)),
+    # nodes
+    'spinNodeMapGetNode':               (H, c_char_p, P(H)),
+    'spinNodeIsAvailable':              (H, P(bool8_t)),
+    'spinNodeIsReadable':               (H, P(bool8_t)),
+    'spinNodeIsWritable':               (H, P(bool8_t)),
+    'spinNodeGetType':                  (H, P(spinEnum)),
+    'spinNodeGetName':                  (H, c_char_p, P(c_size_t)),
+    'spinNodeToString':                 (H, c_char_p, P(c_size_t)),
+    'spinNodeFromString':               (H, c_char_p),
+    'spinCategoryGetNumFeatures':       (H, P(c_size_t)),
+    'spinCategoryGetFeatureByIndex':    (H, c_size_t, P(H)),
+    'spinIntegerGetValue':              (H, P(c_int64)),
+    'spinIntegerSetValue':              (H, c_int64),
+    'spinIntegerGetMin':                (H, P(c_int64)),
+    'spinIntegerGetMax':                (H, P(c_int64)),
+    'spinIntegerGetInc':                (H, P(c_int64)),
+    'spinFloatGetValue':                (H, P(c_double)),
+    'spinFloatSetValue':                (H, c_double),
+    'spinFloatGetMin':                  (H, P(c_double)),
+    'spinFloatGetMax':                  (H, P(c_double)),
+    'spinBooleanGetValue':              (H, P(bool8_t)),
+    'spinBooleanSetValue':              (H, bool8_t),
+    'spinStringGetValue':               (H, c_char_p, P(c_size_t)),
+    'spinCommandExecute':               (H,),
+    # enumerations
+    'spinEnumerationGetNumEntries':     (H, P(c_size_t)),
+    'spinEnumerationGetEntryByIndex':   (H, c_size_t, P(H)),
+    'spinEnumerationGetEntryByName':    (H, c_char_p, P(H)),
+    'spinEnumerationGetCurrentEntry':   (H, P(H)),
+    'spinEnumerationSetIntValue':       (H, c_int64),
+    'spinEnumerationSetEnumValue':      (H, c_size_t),
+    'spinEnumerationEntryGetIntValue':  (H, P(c_int64)),
+    'spinEnumerationEntryGetEnumValue': (H, P(c_size_t)),
+    'spinEnumerationEntryGetSymbolic':  (H, c_char_p, P(c_size_t)),
+    }
+
+
+def _checked(func):
+    "error-checking wrapper for non-ctypes (simulated) functions"
+    def call(*args):
+        retval = func(*args)
+        if retval != 0:
+            raise _ERR_CLASSES.get(retval, FlirCamError)(retval)
+        return retval
+    call.__name__ = getattr(func, '__name__', 'spin_func')
+    return call
+
+
+class SpinApi(object):
+    """
+    SpinnakerC functions of lib, prebound as attributes with their
+    prototypes declared. Functions missing from lib (older SDK versions)
+    are left out and raise AttributeError when used.
+    """
+
+    def __init__(self, lib):
+        self.lib = lib
+        is_ctypes_lib = isinstance(lib, ctypes.CDLL)
+        for name, argtypes in SPIN_PROTOTYPES.items():
+            try:
+                func = getattr(lib, name)
+            except AttributeError:
+                continue
+            if is_ctypes_lib:
+                func.argtypes = argtypes
+                func.restype = c_int
+                func.errcheck = _errcheck
+            else:
+                func = _checked(func)
+            setattr(self, name, func)
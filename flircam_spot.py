@@ -0,0 +1,218 @@
+"""
+Spot centroid, second moments and focus metrics of camera frames.
+
+    analyzer = SpotAnalyzer(background=100, focus_metric='laplacian')
+    result = analyzer(img)              # SpotResult
+    result = analyzer(img, roi=(x0, y0, w, h))
+
+Moments are computed from background subtracted intensities
+I = max(img - background, 0):
+    x, y                  centroid
+    sigma_x, sigma_y      square roots of the second central moments
+    cov_xy                mixed second central moment
+in pixels of the full frame (ROI offsets included).
+
+Focus metrics ('focus', larger is sharper):
+    'gradient'   gradient energy, mean of dI/dx**2 + dI/dy**2
+    'laplacian'  variance of the 4-neighbor Laplacian
+
+uint8/uint16 frames are processed in blocks of block_rows rows, only
+block-sized scratch buffers and row/column projections are allocated,
+never a float copy of the frame.
+
+With coarse_ds > 1 the spot is first located on a strided (coarse_ds)
+view of the frame, the full resolution moments and focus are then
+computed on a window of +-coarse_window sigma around it.
+"""
+from collections import namedtuple
+import numpy as np
+
+FOCUS_METRICS = ('gradient', 'laplacian', 'none')
+
+# roi: (x0, y0, w, h) of the pixels analysed
+SpotResult = namedtuple('SpotResult', ['sum', 'x', 'y', 'sigma_x', 'sigma_y', 'cov_xy',
+                                       'focus', 'roi'])
+
+SPOT_HISTORY_DTYPE = np.dtype([('t', '<f8'),
+                               ('frame_id', '<u8'),
+                               ('sum', '<f8'),
+                               ('x', '<f8'),
+                               ('y', '<f8'),
+                               ('sigma_x', '<f8'),
+                               ('sigma_y', '<f8'),
+                               ('focus', '<f8')])
+
+
+def clip_roi(roi, shape):
+    "(x0, y0, w, h) clipped to a frame of shape, None: full frame"
+    h, w = shape[:2]
+    if roi is None:
+        return (0, 0, w, h)
+    x0, y0, rw, rh = [int(round(v)) for v in roi]
+    x0 = min(max(x0, 0), w - 1)
+    y0 = min(max(y0, 0), h - 1)
+    rw = max(1, min(rw, w - x0)) if rw > 0 else w - x0
+    rh = max(1, min(rh, h - y0)) if rh > 0 else h - y0
+    return (x0, y0, rw, rh)
+
+
+class SpotAnalyzer(object):
+    """
+    Callable computing a SpotResult of a 2D frame, see module docstring.
+    Color frames (h, w, 3) are analysed in channel `channel`.
+    Parameters are plain attributes, scratch buffers are reused.
+    """
+
+    def __init__(self, background=0, focus_metric='gradient', coarse_ds=1,
+                 coarse_window=4.0, channel=1, block_rows=64):
+        self.background = background
+        self.focus_metric = focus_metric
+        self.coarse_ds = coarse_ds
+        self.coarse_window = coarse_window
+        self.channel = channel
+        self.block_rows = block_rows
+        self._scratch = dict()
+
+    def __call__(self, img, roi=None):
+        assert self.focus_metric in FOCUS_METRICS
+        if img.ndim == 3:
+            img = img[..., self.channel]
+        roi = clip_roi(roi, img.shape)
+        ds = int(self.coarse_ds)
+        if ds > 1:
+            x0, y0, w, h = roi
+            coarse = self.moments(img[y0:y0+h:ds, x0:x0+w:ds])
+            if coarse is not None:
+                m0, cx, cy, vx, vy, cxy = coarse
+                hx = max(self.coarse_window*np.sqrt(vx), 2.0)*ds
+                hy = max(self.coarse_window*np.sqrt(vy), 2.0)*ds
+                cx = x0 + cx*ds
+                cy = y0 + cy*ds
+                fine = clip_roi((cx - hx, cy - hy, 2*hx + 1, 2*hy + 1), img.shape)
+                # stay inside the requested roi
+                fx0, fy0 = max(fine[0], x0), max(fine[1], y0)
+                fx1 = min(fine[0] + fine[2], x0 + w)
+                fy1 = min(fine[1] + fine[3], y0 + h)
+                if fx1 > fx0 and fy1 > fy0:
+                    roi = (fx0, fy0, fx1 - fx0, fy1 - fy0)
+        x0, y0, w, h = roi
+        sub = img[y0:y0+h, x0:x0+w]
+        m = self.moments(sub)
+        focus = self.focus(sub)
+        if m is None:
+            nan = float('nan')
+            return SpotResult(0.0, nan, nan, nan, nan, nan, focus, roi)
+        m0, cx, cy, vx, vy, cxy = m
+        return SpotResult(float(m0), float(x0 + cx), float(y0 + cy),
+                          float(np.sqrt(vx)), float(np.sqrt(vy)), float(cxy), focus, roi)
+
+    def _buffer(self, name, shape, dtype):
+        buf = self._scratch.get(name)
+        if buf is None or buf.shape[1] < shape[1] or buf.shape[0] < shape[0] or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._scratch[name] = buf
+        return buf[:shape[0], :shape[1]]
+
+    def moments(self, img):
+        """
+        Returns (m0, cx, cy, var_x, var_y, cov_xy) of the background
+        subtracted image, in its own pixel coordinates, None if m0 == 0
+        """
+        h, w = img.shape
+        xs = np.arange(w, dtype=np.float64)
+        col = np.zeros(w)
+        row = np.empty(h)
+        row_x = np.empty(h)     # sum over x of x*I, per row
+        bg = self.background
+        for r0 in range(0, h, self.block_rows):
+            r1 = min(r0 + self.block_rows, h)
+            b = img[r0:r1]
+            if bg:
+                # cast before subtracting, unsigned pixels below bg would wrap around;
+                # float32 holds uint16 exactly and takes a fractional background
+                s = self._buffer('bg', b.shape, np.float32)
+                np.copyto(s, b, casting='unsafe')
+                np.subtract(s, np.float32(bg), out=s)
+                np.maximum(s, 0, out=s)
+                b = s
+            col += b.sum(axis=0, dtype=np.float64)
+            row[r0:r1] = b.sum(axis=1, dtype=np.float64)
+            row_x[r0:r1] = np.dot(b, xs)
+        m0 = col.sum()
+        if m0 <= 0:
+            return None
+        ys = np.arange(h, dtype=np.float64)
+        cx = np.dot(col, xs)/m0
+        cy = np.dot(row, ys)/m0
+        var_x = np.dot(col, (xs - cx)**2)/m0
+        var_y = np.dot(row, (ys - cy)**2)/m0
+        cov_xy = np.dot(row_x, ys)/m0 - cx*cy
+        return m0, cx, cy, var_x, var_y, cov_xy
+
+    def focus(self, img):
+        "focus metric of img (see FOCUS_METRICS), nan for images too small"
+        metric = self.focus_metric
+        h, w = img.shape
+        if metric == 'none' or h < 3 or w < 3:
+            return float('nan')
+        acc = 0.0
+        acc2 = 0.0
+        n = 0
+        if metric == 'gradient':
+            for r0 in range(0, h - 1, self.block_rows):
+                r1 = min(r0 + self.block_rows, h - 1)
+                b = img[r0:r1 + 1]
+                t = self._buffer('focus', (r1 - r0, w - 1), np.float32)
+                np.subtract(b[:-1, 1:], b[:-1, :-1], out=t, dtype=np.float32)
+                np.multiply(t, t, out=t)
+                acc += t.sum(dtype=np.float64)
+                np.subtract(b[1:, :-1], b[:-1, :-1], out=t, dtype=np.float32)
+                np.multiply(t, t, out=t)
+                acc += t.sum(dtype=np.float64)
+            return float(acc/((h - 1)*(w - 1)))
+        # laplacian, interior pixels
+        for r0 in range(1, h - 1, self.block_rows):
+            r1 = min(r0 + self.block_rows, h - 1)
+            t = self._buffer('focus', (r1 - r0, w - 2), np.float32)
+            np.multiply(img[r0:r1, 1:-1], -4, out=t, dtype=np.float32)
+            np.add(t, img[r0-1:r1-1, 1:-1], out=t, dtype=np.float32)
+            np.add(t, img[r0+1:r1+1, 1:-1], out=t, dtype=np.float32)
+            np.add(t, img[r0:r1, :-2], out=t, dtype=np.float32)
+            np.add(t, img[r0:r1, 2:], out=t, dtype=np.float32)
+            acc += t.sum(dtype=np.float64)
+            np.multiply(t, t, out=t)
+            acc2 += t.sum(dtype=np.float64)
+            n += t.size
+        mean = acc/n
+        return float(acc2/n - mean*mean)
+
+
+class SpotHistory(object):
+    """
+    Rolling time series of the last `capacity` SpotResults, in a
+    preallocated SPOT_HISTORY_DTYPE ring.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=SPOT_HISTORY_DTYPE)
+        self.count = 0
+
+    def reset(self):
+        self.count = 0
+
+    def append(self, result, t, frame_id=0):
+        rec = self.data[self.count % self.capacity]
+        rec['t'] = t
+        rec['frame_id'] = frame_id
+        for name in ('sum', 'x', 'y', 'sigma_x', 'sigma_y', 'focus'):
+            rec[name] = getattr(result, name)
+        self.count += 1
+
+    def get(self):
+        "Returns the stored samples, oldest first"
+        n = self.count
+        if n <= self.capacity:
+            return self.data[:n].copy()
+        i = n % self.capacity
+        return np.concatenate((self.data[i:], self.data[:i]))
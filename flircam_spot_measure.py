@@ -0,0 +1,145 @@
+from ScopeFoundry import Measurement, h5_io
+import pyqtgraph as pg
+import numpy as np
+import time
+from .flircam_spot import SpotAnalyzer, SpotHistory, FOCUS_METRICS
+
+
+class FlirCamSpotMeasure(Measurement):
+    """
+    Spot centroid, size and focus metric of every frame, for beam
+    alignment and autofocus (see flircam_spot).
+
+    The analysis runs as a stage of the flircam hardware pipeline, on its
+    own worker thread (drop_oldest: always the newest frames) or inline
+    on the acquisition thread. Results go to a SpotHistory time series
+    and, every publish_period, to the result settings. Feedback loops
+    at the frame rate can read self.latest (SpotResult) directly.
+    """
+
+    name = 'flircam_spot'
+
+    result_names = ('x', 'y', 'sigma_x', 'sigma_y', 'cov_xy', 'sum', 'focus')
+
+    def setup(self):
+        S = self.settings
+        # ROI of the analysis in frame pixels, width/height 0: to the frame edge
+        S.New('roi_x', dtype=int, initial=0, vmin=0)
+        S.New('roi_y', dtype=int, initial=0, vmin=0)
+        S.New('roi_w', dtype=int, initial=0, vmin=0)
+        S.New('roi_h', dtype=int, initial=0, vmin=0)
+        S.New('background', dtype=float, initial=0.0, vmin=0.0,
+              description='counts subtracted (clipped at 0) before the moments')
+        S.New('focus_metric', dtype=str, initial='gradient', choices=FOCUS_METRICS)
+        S.New('coarse_ds', dtype=int, initial=1, vmin=1,
+              description='> 1: locate the spot on a decimated frame first, '
+                          'then analyse a window around it')
+        S.New('coarse_window', dtype=float, initial=4.0, vmin=1.0,
+              description='half size of the fine window in spot sigmas')
+        S.New('channel', dtype=int, initial=1, vmin=0, vmax=2,
+              description='channel analysed in color frames')
+        S.New('threaded', dtype=bool, initial=True,
+              description='analyse on a pipeline worker thread instead of the acquisition thread')
+        S.New('history_len', dtype=int, initial=4096, vmin=16)
+        S.New('publish_period', dtype=float, initial=0.05, vmin=0.001, unit='s')
+        S.New('save_h5', dtype=bool, initial=False,
+              description='save the time series when the measurement stops')
+        for name in self.result_names:
+            S.New(name, dtype=float, ro=True, spinbox_decimals=3)
+        S.New('t_analysis', dtype=float, unit='ms', spinbox_decimals=3, ro=True)
+        S.New('analysis_rate', dtype=float, unit='Hz', spinbox_decimals=1, ro=True)
+        S.New('frames_analyzed', dtype=int, ro=True)
+        S.New('frames_dropped', dtype=int, ro=True)
+
+        self.analyzer = SpotAnalyzer()
+        self.history = SpotHistory()
+        self.latest = None
+        self.hw = self.app.hardware['flircam']
+
+    def setup_figure(self):
+        self.ui = self.graph_layout = pg.GraphicsLayoutWidget()
+        self.pos_plot = self.graph_layout.addPlot(title='centroid')
+        self.pos_plot.addLegend()
+        self.x_line = self.pos_plot.plot(pen='r', name='x')
+        self.y_line = self.pos_plot.plot(pen='g', name='y')
+        self.graph_layout.nextRow()
+        self.focus_plot = self.graph_layout.addPlot(title='focus')
+        self.focus_line = self.focus_plot.plot(pen='y')
+        self.focus_plot.setXLink(self.pos_plot)
+
+    def update_analyzer(self):
+        "copy the analysis settings to the analyzer, may change while running"
+        S = self.settings
+        a = self.analyzer
+        a.background = S['background']
+        a.focus_metric = S['focus_metric']
+        a.coarse_ds = S['coarse_ds']
+        a.coarse_window = S['coarse_window']
+        a.channel = S['channel']
+        self.roi = (S['roi_x'], S['roi_y'], S['roi_w'], S['roi_h'])
+
+    def analyze_frame(self, img, info):
+        "pipeline stage: analyse img and record the result"
+        result = self.analyzer(img, self.roi)
+        self.history.append(result, info.get('host_time', time.time()), info.get('frame_id', 0))
+        self.latest = result
+        return None
+
+    def run(self):
+        S = self.settings
+        if not self.hw.settings['connected']:
+            self.hw.settings['connected'] = True
+        if self.history.capacity != S['history_len']:
+            self.history = SpotHistory(S['history_len'])
+        self.history.reset()
+        self.latest = None
+        self.update_analyzer()
+
+        stage = self.hw.add_pipeline_stage(self.name, self.analyze_frame, threaded=S['threaded'],
+                                           queue_size=2, policy='drop_oldest')
+        t_last = time.time()
+        n_last = 0
+        try:
+            while not self.interrupt_measurement_called:
+                time.sleep(S['publish_period'])
+                self.update_analyzer()
+                self.publish(stage)
+                now = time.time()
+                n = stage.n_processed
+                if now - t_last >= 1.0:
+                    S['analysis_rate'] = (n - n_last)/(now - t_last)
+                    t_last, n_last = now, n
+        finally:
+            self.hw.remove_pipeline_stage(self.name)
+        self.publish(stage)
+        if S['save_h5']:
+            self.save_h5()
+
+    def publish(self, stage):
+        "latest result and stage stats to the settings"
+        S = self.settings
+        result = self.latest
+        if result is not None:
+            for name in self.result_names:
+                S[name] = getattr(result, name)
+        st = stage.stats()
+        S['t_analysis'] = 1e3*st['t_mean']
+        S['frames_analyzed'] = st['processed']
+        S['frames_dropped'] = st['dropped']
+
+    def save_h5(self):
+        h5file = h5_io.h5_base_file(app=self.app, measurement=self)
+        try:
+            M = h5_io.h5_create_measurement_group(self, h5file)
+            M['spot_history'] = self.history.get()
+        finally:
+            h5file.close()
+
+    def update_display(self):
+        data = self.history.get()
+        if len(data) == 0:
+            return
+        t = data['t'] - data['t'][-1]
+        self.x_line.setData(t, data['x'])
+        self.y_line.setData(t, data['y'])
+        self.focus_line.setData(t, data['focus'])
@@ -1,5 +1,6 @@
 from ScopeFoundry import BaseMicroscopeApp
-from ScopeFoundryHW.flircam import FlirCamHW, FlirCamLiveMeasure
+from ScopeFoundryHW.flircam import FlirCamHW, FlirCamLiveMeasure, FlirCamRecordMeasure, \
+    FlirCamAverageMeasure, FlirCamSpotMeasure
 
 class FlirCamTestApp(BaseMicroscopeApp):
     
@@ -9,6 +10,9 @@ class FlirCamTestApp(BaseMicroscopeApp):
         hw = self.add_hardware(FlirCamHW(self))
         
         self.add_measurement(FlirCamLiveMeasure(self))
+        self.add_measurement(FlirCamRecordMeasure(self))
+        self.add_measurement(FlirCamAverageMeasure(self))
+        self.add_measurement(FlirCamSpotMeasure(self))
         
                 
 if __name__ == '__main__':
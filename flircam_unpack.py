@@ -0,0 +1,104 @@
+"""
+Unpacking of packed 10- and 12-bit mono pixel formats, vectorized with numpy.
+
+    unpack = get_unpacker('Mono12p')
+    unpack(packed, out)     # packed: flat uint8 frame buffer
+                            # out: preallocated uint16 (height, width)
+
+Formats are described by UNPACK_LAYOUTS: a group of n_bytes bytes holds
+n_pixels pixels, every pixel is assembled from bit fields of the group's
+bytes. The output is written group-wise with in-place ufuncs, with a
+single reused scratch array. A frame ending in a partial group (pixel
+count not a multiple of the group's) takes only the bytes its pixels use.
+"""
+import numpy as np
+
+# format: (bits per pixel, bytes per group, [terms of each pixel in the group])
+# term: (byte index, right shift, mask, left shift)
+#   pixel |= ((byte >> right shift) & mask) << left shift
+UNPACK_LAYOUTS = {
+    # PFNC, LSB first: 2 pixels in 3 bytes
+    'Mono12p': (12, 3, [[(0, 0, 0xFF, 0), (1, 0, 0x0F, 8)],
+                        [(1, 4, 0x0F, 0), (2, 0, 0xFF, 4)]]),
+    # GigE Vision: high bits in bytes 0 and 2, low nibbles shared in byte 1
+    'Mono12Packed': (12, 3, [[(0, 0, 0xFF, 4), (1, 0, 0x0F, 0)],
+                             [(2, 0, 0xFF, 4), (1, 4, 0x0F, 0)]]),
+    'Mono10Packed': (10, 3, [[(0, 0, 0xFF, 2), (1, 0, 0x03, 0)],
+                             [(2, 0, 0xFF, 2), (1, 4, 0x03, 0)]]),
+    # PFNC, LSB first: 4 pixels in 5 bytes
+    'Mono10p': (10, 5, [[(0, 0, 0xFF, 0), (1, 0, 0x03, 8)],
+                        [(1, 2, 0x3F, 0), (2, 0, 0x0F, 6)],
+                        [(2, 4, 0x0F, 0), (3, 0, 0x3F, 4)],
+                        [(3, 6, 0x03, 0), (4, 0, 0xFF, 2)]]),
+    }
+
+
+def packed_nbytes(pixel_format, n_pixels):
+    "size in bytes of n_pixels packed pixels"
+    bits, n_bytes, terms = UNPACK_LAYOUTS[pixel_format]
+    n_groups, rest = divmod(n_pixels, len(terms))
+    return n_groups*n_bytes + _partial_nbytes(terms, rest)
+
+
+def _partial_nbytes(terms, n):
+    "bytes used by the first n pixels of a group"
+    return max([t[0] for pixel_terms in terms[:n] for t in pixel_terms], default=-1) + 1
+
+
+class Unpacker(object):
+    """
+    Callable unpacking pixel_format (see UNPACK_LAYOUTS) into uint16.
+    """
+
+    def __init__(self, pixel_format):
+        self.pixel_format = pixel_format
+        self.bits, self.n_bytes, self.terms = UNPACK_LAYOUTS[pixel_format]
+        self.n_pixels = len(self.terms)
+        self._tmp = None
+
+    def __call__(self, packed, out):
+        "unpack flat uint8 array packed into C-contiguous uint16 array out"
+        n_groups, rest = divmod(out.size, self.n_pixels)
+        flat = out.reshape(-1)
+        if rest:
+            self._unpack_partial(packed[n_groups*self.n_bytes:], flat[n_groups*self.n_pixels:])
+        groups = packed[:n_groups*self.n_bytes].reshape(n_groups, self.n_bytes)
+        pixels = flat[:n_groups*self.n_pixels].reshape(n_groups, self.n_pixels)
+        if self._tmp is None or self._tmp.shape[0] != n_groups:
+            self._tmp = np.empty(n_groups, dtype=np.uint16)
+        tmp = self._tmp
+        for i, terms in enumerate(self.terms):
+            dst = pixels[:, i]
+            for j, (byte, rshift, mask, lshift) in enumerate(terms):
+                t = dst if j == 0 else tmp
+                src = groups[:, byte]
+                if rshift:
+                    np.right_shift(src, rshift, out=t, dtype=np.uint16)
+                    src = t
+                if mask != 0xFF or src is not t:
+                    np.bitwise_and(src, mask, out=t, dtype=np.uint16)
+                if lshift:
+                    np.left_shift(t, lshift, out=t)
+                if j > 0:
+                    np.bitwise_or(dst, t, out=dst)
+        return out
+
+    def _unpack_partial(self, packed, pixels):
+        "unpack the last group of a frame, holding only pixels.size pixels"
+        nbytes = _partial_nbytes(self.terms, pixels.size)
+        if packed.size < nbytes:
+            raise ValueError("{} buffer too short: last {} pixels need {} bytes, got {}".format(
+                self.pixel_format, pixels.size, nbytes, packed.size))
+        group = packed[:nbytes].astype(np.uint16)
+        for i, terms in enumerate(self.terms[:pixels.size]):
+            v = 0
+            for byte, rshift, mask, lshift in terms:
+                v |= ((int(group[byte]) >> rshift) & mask) << lshift
+            pixels[i] = v
+
+
+def get_unpacker(pixel_format):
+    "Returns an Unpacker for pixel_format, None if it is not a packed format"
+    if pixel_format not in UNPACK_LAYOUTS:
+        return None
+    return Unpacker(pixel_format)
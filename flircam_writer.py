@@ -0,0 +1,125 @@
+import threading
+import queue
+from .flircam_chunk import FrameGapDetector
+
+
+class FrameWriterThread(threading.Thread):
+    """
+    Writes frames to a sink on a dedicated thread.
+
+    put(img, info) is meant to be registered as a frame consumer on the
+    acquisition thread (FlirCamHW.add_frame_consumer): it only enqueues
+    the frame. The queue is bounded, when it is full the frame is either
+    dropped (default, never stalls acquisition) or put() blocks for up to
+    block_timeout seconds (back-pressure) before dropping.
+
+    The sink needs write(img, info) and close() methods.
+
+    With a FramePool (the camera's frame_pool) queued frames are retained
+    until they are written, so the frame ring can not recycle them.
+    
+    Frame IDs (info['frame_id']) of the written frames are followed by 
+    self.frame_gaps, its drop log covers frames lost anywhere before the
+    sink: on the camera, in the stream buffers or in a full queue.
+    """
+
+    def __init__(self, sink, queue_size=256, block=False, block_timeout=0.1,
+                 max_frames=0, pool=None):
+        threading.Thread.__init__(self, name='FrameWriterThread', daemon=True)
+        self.sink = sink
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.block = block
+        self.block_timeout = block_timeout
+        self.max_frames = max_frames  # 0: no limit
+        self.pool = pool
+
+        self.n_received = 0
+        self.n_written = 0
+        self.n_dropped = 0
+        self.max_queue_depth = 0
+        self.frame_gaps = FrameGapDetector()
+        self.error = None
+        self._stop_event = threading.Event()
+
+    def put(self, img, info=None):
+        "Enqueue frame for writing. Returns False if the frame was dropped"
+        if self._stop_event.is_set() or self.error is not None:
+            return False
+        if self.max_frames and self.n_received >= self.max_frames:
+            return False
+        self.n_received += 1
+        if self.pool is not None:
+            self.pool.retain(img)
+        try:
+            if self.block:
+                self.queue.put((img, info), timeout=self.block_timeout)
+            else:
+                self.queue.put_nowait((img, info))
+        except queue.Full:
+            if self.pool is not None:
+                self.pool.release(img)
+            self.n_dropped += 1
+            return False
+        depth = self.queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+        return True
+
+    def run(self):
+        try:
+            while True:
+                try:
+                    img, info = self.queue.get(timeout=0.05)
+                except queue.Empty:
+                    if self._stop_event.is_set():
+                        break
+                    continue
+                try:
+                    if info and 'frame_id' in info:
+                        self.frame_gaps.update(info['frame_id'])
+                    self.sink.write(img, info)
+                    self.n_written += 1
+                finally:
+                    if self.pool is not None:
+                        self.pool.release(img)
+                    del img
+        except Exception as err:
+            self.error = err
+            raise
+        finally:
+            # after an error the queued frames are never written
+            self._drain()
+            self.sink.close()
+
+    def _drain(self):
+        "Drop the queued frames, releasing them to the pool"
+        while True:
+            try:
+                img, info = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if self.pool is not None:
+                self.pool.release(img)
+            self.n_dropped += 1
+
+    def stop(self, timeout=None):
+        "Stop accepting frames, write what is queued and close the sink"
+        self._stop_event.set()
+        self.join(timeout)
+        if not self.is_alive():
+            # a frame put() while the thread ended on an error
+            self._drain()
+
+    def is_done(self):
+        "True once max_frames were received and written (or dropped)"
+        return bool(self.max_frames) and self.n_received >= self.max_frames \
+            and self.queue.empty()
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def stats(self):
+        return dict(received=self.n_received, written=self.n_written,
+                    dropped=self.n_dropped, queue_depth=self.queue.qsize(),
+                    max_queue_depth=self.max_queue_depth, missing=self.frame_gaps.n_missing)
+
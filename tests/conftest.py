@@ -0,0 +1,20 @@
+"""
+Makes the repository importable as ScopeFoundryHW.flircam without running
+its __init__ (which pulls in ScopeFoundry and Qt), so the modules that do
+not need them can be tested on their own.
+"""
+import os
+import sys
+import types
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+if 'ScopeFoundryHW.flircam' not in sys.modules:
+    if 'ScopeFoundryHW' not in sys.modules:
+        ns = types.ModuleType('ScopeFoundryHW')
+        ns.__path__ = []
+        sys.modules['ScopeFoundryHW'] = ns
+    pkg = types.ModuleType('ScopeFoundryHW.flircam')
+    pkg.__path__ = [REPO_DIR]
+    sys.modules['ScopeFoundryHW.flircam'] = pkg
+    sys.modules['ScopeFoundryHW'].flircam = pkg
@@ -0,0 +1,97 @@
+"FrameAccumulator sum, mean, Welford variance and dark/flat correction vs numpy"
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_accumulate import FrameAccumulator
+
+
+def frame_stack(n=20, shape=(16, 24), level=1000.0, noise=30.0, seed=5):
+    rng = np.random.default_rng(seed)
+    return np.round(rng.normal(level, noise, (n,) + shape)).clip(0, 65535).astype(np.uint16)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_sum_mean(dtype):
+    frames = frame_stack()
+    acc = FrameAccumulator(dtype=dtype)
+    for f in frames:
+        acc.add(f)
+    assert acc.n == len(frames)
+    assert np.allclose(acc.sum, frames.sum(axis=0, dtype=np.float64), rtol=1e-6)
+    assert np.allclose(acc.mean, frames.mean(axis=0), rtol=1e-6)
+    assert acc.variance is None
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_welford_variance(dtype):
+    # large offset: the naive sum of squares loses everything in float32
+    frames = frame_stack(n=50, level=60000.0, noise=3.0)
+    acc = FrameAccumulator(dtype=dtype, variance=True)
+    for f in frames:
+        acc.add(f)
+    ref = frames.astype(np.float64)
+    # float32 resolves ~0.004 at 60000, a variance of ~10 stays within 1%
+    rtol = 1e-2 if dtype == np.float32 else 1e-9
+    assert np.allclose(acc.mean, ref.mean(axis=0), rtol=1e-6)
+    assert np.allclose(acc.variance, ref.var(axis=0, ddof=1), rtol=rtol)
+    assert np.allclose(acc.std, ref.std(axis=0, ddof=1), rtol=rtol)
+
+
+def test_dark_flat():
+    frames = frame_stack(n=10).astype(np.float64)
+    rng = np.random.default_rng(6)
+    dark = rng.uniform(90, 110, frames.shape[1:])
+    flat = rng.uniform(500, 1500, frames.shape[1:])
+    flat[0, 0] = dark[0, 0] - 5     # dead pixel keeps a gain of 1
+
+    acc = FrameAccumulator(variance=True)
+    acc.set_dark(dark)
+    acc.set_flat(flat)
+    acc.reset()
+    for f in frames:
+        acc.add(f)
+    assert acc.dark_applied and acc.flat_applied
+
+    d = flat - dark
+    good = d > 0
+    gain = np.ones_like(d)
+    gain[good] = d[good].mean()/d[good]
+    corrected = (frames - dark)*gain
+    assert np.allclose(acc.mean, corrected.mean(axis=0))
+    assert np.allclose(acc.variance, corrected.var(axis=0, ddof=1))
+    assert acc.mean[0, 0] == pytest.approx((frames[:, 0, 0] - dark[0, 0]).mean())
+
+
+def test_corrections_apply_after_reset():
+    frames = frame_stack(n=4)
+    acc = FrameAccumulator()
+    acc.add(frames[0])
+    acc.set_dark(np.full(frames.shape[1:], 100.0))
+    acc.add(frames[1])
+    assert not acc.dark_applied
+    acc.reset()
+    for f in frames:
+        acc.add(f)
+    assert np.allclose(acc.mean, frames.mean(axis=0) - 100)
+
+
+def test_buffers_reused_and_shape_checked():
+    frames = frame_stack(n=3)
+    acc = FrameAccumulator(variance=True)
+    acc.add(frames[0])
+    buffers = acc.sum, acc._m2
+    acc.reset()
+    acc.add(frames[1])
+    assert acc.sum is buffers[0] and acc._m2 is buffers[1]
+    with pytest.raises(ValueError):
+        acc.add(frames[0][:8])
+    acc.set_dark(np.zeros((4, 4)))
+    with pytest.raises(ValueError):
+        acc.allocate(frames.shape[1:])
+
+
+def test_flat_without_signal():
+    acc = FrameAccumulator()
+    acc.set_dark(np.full((4, 4), 10.0))
+    with pytest.raises(ValueError):
+        acc.set_flat(np.full((4, 4), 10.0))
@@ -0,0 +1,18 @@
+"Benchmark helpers run on the simulated camera, they need pyqtgraph and ScopeFoundry"
+import os
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+pytest.importorskip('pyqtgraph')
+pytest.importorskip('ScopeFoundry')
+
+from ScopeFoundryHW.flircam import flircam_benchmark
+
+
+@pytest.mark.parametrize('mode', ['stride', 'block'])
+@pytest.mark.parametrize('ds', [1, 2, 4])
+def test_display_prepare_downsample(ds, mode):
+    # fails in check_display_shape if the worker ignores the downsample settings
+    res = flircam_benchmark.bench_display_prepare(ds, mode, n_frames=3, width=66, height=31,
+                                                  warmup=1)
+    assert res['n'] == 3
@@ -0,0 +1,53 @@
+"FrameGapDetector, and chunk data of the simulated camera"
+import numpy as np
+
+from ScopeFoundryHW.flircam.flircam_chunk import CHUNK_DTYPE, FrameGapDetector
+from ScopeFoundryHW.flircam.flircam_interface import FlirCamInterface
+from ScopeFoundryHW.flircam.flircam_sim_lib import SimSpinnakerLib
+
+
+def test_gaps():
+    det = FrameGapDetector()
+    gaps = [det.update(i) for i in (5, 6, 9, 10, 14)]
+    assert gaps == [0, 0, 2, 0, 3]
+    assert det.n_frames == 5 and det.n_missing == 5
+    log = det.get_drop_log()
+    assert log.dtype.names == ('index', 'frame_id', 'n_missing')
+    assert log.tolist() == [(2, 9, 2), (4, 14, 3)]
+
+
+def test_counter_reset_and_restart():
+    det = FrameGapDetector()
+    for i in (10, 11, 0, 1, 3):
+        det.update(i)
+    # going back is a counter reset, not a gap
+    assert det.n_missing == 1
+    det.restart()
+    assert det.update(100) == 0
+    assert det.n_frames == 6
+    det.reset()
+    assert det.n_frames == 0 and det.get_drop_log().size == 0
+
+
+def test_sim_chunk_data_and_dropped_frames():
+    lib = SimSpinnakerLib(width=32, height=16, pixel_format='Mono8',
+                          frame_rate=None, realtime=False, seed=1)
+    cam = FlirCamInterface(lib=lib)
+    try:
+        cam.set_chunk_mode(True)
+        cam.start_acquisition()
+        ids = []
+        for i in range(10):
+            info = dict()
+            cam.frame_pool.release(cam.get_image(info=info, timeout=1.0))
+            chunk = info['chunk']
+            assert chunk.dtype == CHUNK_DTYPE
+            assert int(chunk['frame_id']) == info['frame_id']
+            assert int(chunk['timestamp']) == info['timestamp']
+            ids.append(info['frame_id'])
+        assert ids == sorted(ids)
+        assert cam.frame_gaps.n_missing == (ids[-1] - ids[0] + 1) - len(ids)
+    finally:
+        cam.stop_acquisition()
+        cam.release_camera()
+        cam.release_system()
@@ -0,0 +1,78 @@
+"Display preparation: decimation, lookup tables, auto levels and the display worker"
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_display import (AutoLevels, DisplayWorker, downsample,
+                                                    linear_lut)
+from ScopeFoundryHW.flircam.flircam_frame_pool import FramePool
+from ScopeFoundryHW.flircam.flircam_frame_ring import FrameRing
+
+
+def test_downsample_stride():
+    im = np.arange(7*9, dtype=np.uint16).reshape(7, 9)
+    assert downsample(im, 1) is im
+    assert np.array_equal(downsample(im, 3), im[::3, ::3])
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+def test_downsample_block(dtype):
+    rng = np.random.default_rng(4)
+    im = rng.integers(0, np.iinfo(dtype).max, (9, 11, 3), endpoint=True).astype(dtype)
+    out = downsample(im, 2, 'block')
+    ref = im[:8, :10].astype(np.float64).reshape(4, 2, 5, 2, 3).mean(axis=(1, 3))
+    assert out.dtype == dtype and out.shape == (4, 5, 3)
+    assert np.array_equal(out, np.floor(ref))
+
+
+def test_linear_lut():
+    lut = linear_lut(100, 355, 1024)
+    assert lut.dtype == np.uint8 and lut.size == 1024
+    assert lut[:101].max() == 0 and lut[355:].min() == 255
+    assert lut[100 + 128] == 128
+    assert (np.diff(lut.astype(int)) >= 0).all()
+
+
+def test_auto_levels_percentiles():
+    im = np.arange(1000, dtype=np.uint16).reshape(25, 40)
+    al = AutoLevels(low=1, high=99, smoothing=0.5, n_samples=10**6)
+    lo, hi = al.update(im)[0]
+    assert (lo, hi) == (np.percentile(im, 1, method='lower'), np.percentile(im, 99, method='lower'))
+    # exponential smoothing towards the new levels
+    lo2, hi2 = al.update(im + 1000)[0]
+    assert lo2 == pytest.approx(0.5*lo + 0.5*(lo + 1000))
+    assert hi2 == pytest.approx(0.5*hi + 0.5*(hi + 1000))
+
+
+def test_auto_levels_per_channel():
+    im = np.zeros((20, 20, 3), dtype=np.uint8)
+    im[..., 0] = np.arange(20)
+    im[..., 1] = 100 + np.arange(20)
+    im[..., 2] = 200
+    levels = AutoLevels(low=1, high=99, per_channel=True).update(im)
+    assert levels.shape == (3, 2)
+    assert list(levels[0]) == [0, 19] and list(levels[1]) == [100, 119]
+    # a flat channel still gets a non-empty range
+    assert levels[2][1] > levels[2][0]
+    assert AutoLevels(per_channel=False).update(im).shape == (1, 2)
+
+
+def test_worker_prepare_latest():
+    pool = FramePool()
+    ring = FrameRing(4, pool=pool)
+    worker = DisplayWorker(ring)
+    assert not worker.process_latest()
+    for i in range(3):
+        img = pool.acquire((8, 12), np.uint16)
+        img[...] = 1000*i
+        ring.push(img, dict(frame_id=i))
+    worker.min_ds = 2
+    worker.auto_level = False
+    assert worker.process_latest()
+    out = worker.output
+    assert out.seq == 2 and out.ds == 2 and out.frame_shape == (8, 12)
+    assert out.image.dtype == np.uint8 and out.image.shape == (4, 6)
+    assert out.image.flags.c_contiguous
+    assert (out.image == linear_lut(0, 65535, 65536)[2000]).all()
+    # stale frames skipped, nothing new
+    assert not worker.process_latest()
+    ring.remove_cursor(worker.cursor)
@@ -0,0 +1,29 @@
+"FramePool buffer reuse and reference counting"
+import numpy as np
+
+from ScopeFoundryHW.flircam.flircam_frame_pool import FramePool
+
+
+def test_pool_refcount():
+    pool = FramePool()
+    a = pool.acquire((4, 6), np.uint16)
+    assert pool.refcount(a) == 1
+    pool.retain(a[1:3])         # a view holds the buffer too
+    assert pool.refcount(a) == 2
+    pool.release(a)
+    assert pool.num_free() == 0
+    pool.release(a[1:3])
+    assert pool.num_free() == 1 and pool.refcount(a) == 0
+    # released once only, extra releases and foreign arrays are ignored
+    pool.release(a)
+    pool.release(np.zeros((4, 6), np.uint16))
+    assert pool.num_free() == 1
+    assert pool.acquire((4, 6), np.uint16) is a
+    assert pool.n_reused == 1
+
+
+def test_pool_forgets_dropped_buffers():
+    pool = FramePool()
+    a = pool.acquire((4, 6))
+    del a
+    assert pool._refs == {}
@@ -0,0 +1,74 @@
+"FrameRing cursors and frame ownership with a FramePool"
+import numpy as np
+
+from ScopeFoundryHW.flircam.flircam_frame_pool import FramePool
+from ScopeFoundryHW.flircam.flircam_frame_ring import FrameRing
+
+
+def push_frames(ring, pool, n, shape=(4, 6)):
+    "acquire, fill and push n frames like the acquisition thread"
+    frames = []
+    for i in range(n):
+        img = pool.acquire(shape, np.uint16)
+        img[...] = ring.head
+        ring.push(img, dict(frame_id=ring.head))
+        frames.append(img)
+    return frames
+
+
+def test_cursor_modes():
+    ring = FrameRing(4)
+    nxt = ring.new_cursor('next')
+    latest = ring.new_cursor('latest')
+    for i in range(3):
+        ring.push(np.full(2, i), dict(i=i))
+    assert [nxt.get()[0] for i in range(3)] == [0, 1, 2]
+    assert nxt.get() is None
+    assert latest.get()[0] == 2 and latest.n_skipped == 2
+    for i in range(3, 10):
+        ring.push(np.full(2, i))
+    assert nxt.get()[0] == 6 and nxt.n_missed == 3
+    assert ring.stats()['overwritten'] == 6
+
+
+def test_ring_recycles_overwritten_frames():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(4, pool=pool)
+    frames = push_frames(ring, pool, 4)
+    assert pool.num_free() == 0
+    new = push_frames(ring, pool, 2)
+    # frame 0 went back to the pool and was reused for frame 5,
+    # frame 1 is free
+    assert new[1] is frames[0]
+    assert pool.num_free() == 1 and pool.refcount(frames[1]) == 0
+    assert pool.n_allocated == 5 and pool.n_reused == 1
+    push_frames(ring, pool, 8)
+    assert pool.n_allocated == 5
+
+
+def test_cursor_holds_frame():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(2, pool=pool)
+    cursor = ring.new_cursor('next')
+    push_frames(ring, pool, 1)
+    seq, frame, meta = cursor.get()
+    assert pool.refcount(frame) == 2
+    # overwritten in the ring but still held by the cursor: not recycled
+    push_frames(ring, pool, 4)
+    assert pool.refcount(frame) == 1
+    assert (frame == 0).all()
+    n_free = pool.num_free()
+    cursor.get()
+    # held frame released with the next get()
+    assert pool.num_free() == n_free + 1 and pool.refcount(frame) == 0
+    ring.remove_cursor(cursor)
+    assert cursor._held is None
+
+
+def test_clear_releases_frames():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(4, pool=pool)
+    push_frames(ring, pool, 3)
+    ring.clear()
+    assert pool.num_free() == 3
+    assert ring.latest() is None
@@ -0,0 +1,289 @@
+"FlirCamInterface on the simulated SpinnakerC backend"
+import asyncio
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_consts import SpinNodeTypeEnum
+from ScopeFoundryHW.flircam.flircam_interface import FlirCamInterface
+from ScopeFoundryHW.flircam.flircam_sim_lib import SimSpinnakerLib, SimImage
+from ScopeFoundryHW.flircam.flircam_spin_api import FlirCamAccessError, FlirCamError
+
+
+@pytest.fixture
+def sim():
+    lib = SimSpinnakerLib(width=64, height=32, pixel_format='Mono8',
+                          frame_rate=None, realtime=False, seed=0)
+    cam = FlirCamInterface(lib=lib)
+    yield cam, lib
+    cam.stop_acquisition()
+    cam.release_camera()
+    cam.release_system()
+
+
+def n_open_images(lib):
+    return sum(isinstance(obj, SimImage) for obj in lib._handles.values())
+
+
+def test_get_image_releases(sim):
+    cam, lib = sim
+    cam.start_acquisition()
+    for i in range(5):
+        img = cam.get_image(timeout=1.0)
+        cam.frame_pool.release(img)
+    assert n_open_images(lib) == 0
+
+
+def test_get_image_releases_on_decode_error(sim):
+    cam, lib = sim
+    cam.start_acquisition()
+    wrong = np.empty((3, 3), dtype=np.uint8)
+    for i in range(5):
+        with pytest.raises(ValueError):
+            cam.get_image(out=wrong, timeout=1.0)
+    assert n_open_images(lib) == 0
+    # stream still delivers frames
+    assert cam.get_image(timeout=1.0).shape == (32, 64)
+
+
+def test_get_image_releases_on_chunk_error(sim):
+    cam, lib = sim
+    cam.set_chunk_mode(True)
+    cam.start_acquisition()
+    info = dict()
+    cam.get_image(info=info, timeout=1.0)
+    assert 'chunk' in info
+
+    # a chunk read failing after the image was grabbed
+    cam.api.spinImageChunkDataGetIntValue = chunk_read_error
+    for i in range(3):
+        with pytest.raises(FlirCamError):
+            cam.get_image(timeout=1.0)
+    assert n_open_images(lib) == 0
+
+
+def chunk_read_error(*args):
+    raise FlirCamError(-1010)
+
+
+@pytest.mark.parametrize('realtime', [False, True])
+def test_acquire_stack_software_trigger(sim, realtime):
+    cam, lib = sim
+    lib.realtime = realtime
+    cam.set_trigger(True, 'Software')
+    out, timestamps = cam.acquire_stack(5, timeout=1.0)
+    assert out.shape == (5, 32, 64)
+    assert (np.diff(timestamps.astype(np.int64)) > 0).all()
+    assert lib.n_triggers_ignored == 0
+
+
+def test_set_frame_rate_stale_limits(sim):
+    cam, lib = sim
+    cam.set_roi(0, 0, 64, 8)
+    cam.set_frame_rate(10.0)
+    fmax = cam.get_node_value_limits('AcquisitionFrameRate')[1]
+    # the camera changes the frame height itself, the cached max is too high now
+    lib._nm['Height']._value = 32
+    assert lib._max_frame_rate() < fmax
+    cam.set_frame_rate(1e9)
+    assert cam.get_frame_rate() == pytest.approx(lib._max_frame_rate())
+
+
+def test_set_exposure_time_stale_limits(sim):
+    cam, lib = sim
+    cam.set_frame_rate(100.0)
+    cam.set_exposure_time(0.001)
+    assert cam.get_exposure_lims()[1] == pytest.approx(0.01)
+    # frame rate changed without the interface, exposure max drops to 5 ms
+    lib._nm['AcquisitionFrameRate']._value = 200.0
+    cam.set_exposure_time(1.0)
+    assert cam.get_exposure_time() == pytest.approx(0.005)
+
+
+def test_node_availability_and_write_access(sim):
+    cam, lib = sim
+    assert not cam.get_node_is_available('NoSuchNode')
+    assert cam.get_node_is_available('Gain')
+    lib._nm['Gain'].available = False
+    assert not cam.get_node_is_available('Gain')
+    assert not cam.get_node_is_readable('Gain')
+    lib._nm['Gain'].available = True
+    cam.set_node_value('GainAuto', 'Continuous')
+    # checked before the write, not retried with fresh limits
+    with pytest.raises(FlirCamAccessError, match='Gain is not writable'):
+        cam.set_node_value_clamped('Gain', 10.0)
+    assert cam.get_node_value('Gain') == 0.0
+
+
+def test_unknown_image_status_counted(sim):
+    cam, lib = sim
+    cam.start_acquisition()
+    get_status = cam.api.spinImageGetStatus
+    for status in (-1, 99):
+        def unknown_status(hImage, pStatus):
+            get_status(hImage, pStatus)
+            pStatus._obj.value = status
+        cam.api.spinImageGetStatus = unknown_status
+        cam.frame_pool.release(cam.get_image(timeout=1.0))
+    cam.api.spinImageGetStatus = get_status
+    cam.frame_pool.release(cam.get_image(timeout=1.0))
+    stats = cam.image_status_stats()
+    assert stats['IMAGE_UNKNOWN_ERROR'] == 2
+    assert stats['IMAGE_NO_ERROR'] == 1
+
+
+def test_snapshot(sim):
+    cam, lib = sim
+    cam.set_node_value('GainAuto', 'Continuous')
+    snap = cam.snapshot(['Width', 'ExposureTime', 'PixelFormat', 'Gain', 'WidthMax',
+                         'TriggerSoftware', 'NoSuchNode'])
+    assert list(snap) == ['Width', 'ExposureTime', 'PixelFormat', 'Gain', 'WidthMax',
+                          'TriggerSoftware', 'NoSuchNode']
+    assert snap['Width'] == ('Width', SpinNodeTypeEnum.IntegerNode, True, True,
+                             64, (8, 64), None)
+    s = snap['ExposureTime']
+    assert s.type == SpinNodeTypeEnum.FloatNode and s.value == 10000.0
+    assert s.limits == cam.get_node_value_limits('ExposureTime')
+    s = snap['PixelFormat']
+    assert s.value == 'Mono8' and 'Mono16' in s.choices and s.limits is None
+    # read-only and locked nodes
+    assert snap['Gain'].readable and not snap['Gain'].writable
+    assert not snap['WidthMax'].writable and snap['WidthMax'].value == 64
+    # command node, no value
+    assert snap['TriggerSoftware'].type == SpinNodeTypeEnum.CommandNode
+    assert snap['TriggerSoftware'].value is None
+    assert snap['NoSuchNode'] == ('NoSuchNode', None, False, False, None, None, None)
+
+    snap = cam.snapshot(['Width', 'PixelFormat'], values=False)
+    assert snap['Width'].writable and snap['Width'].value is None
+    assert snap['PixelFormat'].choices is None
+
+
+def test_async_frames(sim):
+    cam, lib = sim
+    cam.start_acquisition()
+
+    async def collect():
+        got = []
+        async for img, info in cam.frames(timeout=1.0, max_frames=5):
+            got.append((img.shape, info['frame_id']))
+            cam.frame_pool.release(img)
+        return got
+
+    got = asyncio.run(collect())
+    assert [shape for shape, frame_id in got] == [(32, 64)]*5
+    ids = [frame_id for shape, frame_id in got]
+    assert ids == sorted(set(ids))
+    assert n_open_images(lib) == 0
+
+
+def test_async_frames_timeouts_until_stopped(sim):
+    cam, lib = sim
+    # no triggers, every grab times out
+    cam.set_trigger(True, 'Software')
+    cam.start_acquisition()
+
+    async def stop_later():
+        await asyncio.sleep(0.2)
+        cam.stop_acquisition()
+
+    async def collect():
+        stopper = asyncio.ensure_future(stop_later())
+        n = 0
+        async for img, info in cam.frames(timeout=0.02):
+            n += 1
+        await stopper
+        return n
+
+    assert asyncio.run(collect()) == 0
+    assert not cam.acquiring
+
+
+def test_snap_node_value():
+    # sensor width not a multiple of the Width increment (8, min 8)
+    lib = SimSpinnakerLib(width=60, height=30, pixel_format='Mono8', realtime=False)
+    cam = FlirCamInterface(lib=lib)
+    try:
+        assert cam.get_node_value_inc('Width') == 8
+        assert cam.snap_node_value('Width', 21) == 24
+        assert cam.snap_node_value('Width', 27.4) == 24
+        assert cam.snap_node_value('Width', 3) == 8
+        # 60 is above the last increment step
+        assert cam.snap_node_value('Width', 60) == 56
+        assert cam.snap_node_value('Width', 1000) == 56
+        assert cam.snap_node_value('OffsetX', -5) == 0
+        cam.set_node_value('Width', 45)
+        assert cam.get_node_value('Width') == 48
+    finally:
+        cam.release_camera()
+        cam.release_system()
+
+
+def test_set_roi(sim):
+    cam, lib = sim
+    assert cam.get_roi() == (0, 0, 64, 32)
+    # snapped to the increments: OffsetX 4, Width 8, OffsetY 2, Height 2
+    assert cam.set_roi(7, 4, 21, 12) == (8, 4, 24, 12)
+    # None keeps the current value
+    assert cam.set_roi(width=16) == (8, 4, 16, 12)
+    assert cam.set_roi(offset_y=10) == (8, 10, 16, 12)
+    # past the sensor edge: moved back onto it, or shrunk
+    assert cam.set_roi(60, 30, None, None) == (48, 20, 16, 12)
+    assert cam.set_roi(0, 0, 1000, 1000) == (0, 0, 64, 32)
+
+    cam.start_acquisition()
+    cam.frame_pool.release(cam.get_image(timeout=1.0))
+    cam.set_roi(4, 2, 32, 8)
+    # acquisition restarted with the new frame size
+    assert cam.acquiring
+    assert cam.get_image(timeout=1.0).shape == (8, 32)
+    assert cam.set_full_frame() == (0, 0, 64, 32)
+
+
+def stream_nodes(lib):
+    nm = lib.tl_stream_node_map
+    return (nm['StreamBufferHandlingMode'].current_entry().name,
+            nm['StreamBufferCountMode'].current_entry().name,
+            nm['StreamBufferCountManual'].value)
+
+
+def test_set_stream_buffers(sim):
+    cam, lib = sim
+    assert cam.get_stream_buffers() == ('OldestFirst', 10)
+    cam.set_stream_buffers('NewestOnly', 5)
+    assert stream_nodes(lib) == ('NewestOnly', 'Manual', 5)
+    assert cam.get_stream_buffers() == ('NewestOnly', 5)
+    # None keeps the setting, the count is clamped to its limits
+    cam.set_stream_buffers(buffer_count=5000)
+    assert stream_nodes(lib) == ('NewestOnly', 'Manual', 2048)
+    cam.set_stream_buffers('OldestFirstOverwrite')
+    assert stream_nodes(lib) == ('OldestFirstOverwrite', 'Manual', 2048)
+
+    # a running acquisition is restarted with the new buffers
+    cam.start_acquisition()
+    cam.frame_pool.release(cam.get_image(timeout=1.0))
+    cam.set_stream_buffers('OldestFirst', 7)
+    assert cam.acquiring
+    assert cam.get_stream_buffers() == ('OldestFirst', 7)
+    cam.frame_pool.release(cam.get_image(timeout=1.0))
+
+
+def test_set_stream_preset(sim):
+    cam, lib = sim
+    cam.set_stream_preset('record')
+    assert stream_nodes(lib) == ('OldestFirst', 'Manual', 200)
+    cam.set_stream_preset('live')
+    assert stream_nodes(lib) == ('NewestOnly', 'Manual', 3)
+    # the preset is applied again when acquisition starts
+    cam.set_node_value('StreamBufferHandlingMode', 'OldestFirst')
+    cam.start_acquisition()
+    assert stream_nodes(lib) == ('NewestOnly', 'Manual', 3)
+    cam.stop_acquisition()
+    # explicit buffer settings replace the preset
+    cam.set_stream_buffers(buffer_count=20)
+    assert cam.stream_preset is None
+    cam.set_node_value('StreamBufferHandlingMode', 'OldestFirst')
+    cam.start_acquisition()
+    assert stream_nodes(lib) == ('OldestFirst', 'Manual', 20)
+    with pytest.raises(KeyError):
+        cam.set_stream_preset('fast')
+    assert cam.stream_preset is None
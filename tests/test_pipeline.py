@@ -0,0 +1,171 @@
+"FramePipeline stage tree, queue policies and counters"
+import threading
+import time
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_frame_pool import FramePool
+from ScopeFoundryHW.flircam.flircam_frame_ring import FrameRing
+from ScopeFoundryHW.flircam.flircam_pipeline import FramePipeline
+
+
+def wait_for(cond, timeout=2.0):
+    t_end = time.perf_counter() + timeout
+    while not cond():
+        if time.perf_counter() > t_end:
+            return False
+        time.sleep(0.001)
+    return True
+
+
+def test_tree_inline():
+    pipeline = FramePipeline()
+    seen = dict(a=[], b=[], c=[])
+    pipeline.add_stage('crop', lambda img, info: img[1:3])
+    pipeline.add_stage('a', lambda img, info: seen['a'].append(img.shape), after='crop')
+    pipeline.add_stage('b', lambda img, info: (img*2, dict(info, scaled=True)), after='crop')
+    pipeline.add_stage('c', lambda img, info: seen['c'].append((int(img[0, 0]), info)), after='b')
+    pipeline.start()
+    pipeline.process(np.ones((4, 5), np.uint16), dict(frame_id=7))
+    pipeline.stop()
+    assert seen['a'] == [(2, 5)]
+    assert seen['c'] == [(2, dict(frame_id=7, scaled=True))]
+    stats = pipeline.stats()
+    assert stats['c']['processed'] == 1 and stats['c']['policy'] == 'inline'
+
+
+def test_default_policy_drop_oldest():
+    pipeline = FramePipeline()
+    gate = threading.Event()
+    seen = []
+
+    def slow(img, info):
+        gate.wait(2.0)
+        seen.append(info['i'])
+
+    stage = pipeline.add_stage('slow', slow, threaded=True, queue_size=2)
+    assert stage.policy == 'drop_oldest'
+    pipeline.start()
+    pipeline.process(None, dict(i=0))
+    assert wait_for(lambda: stage.queue_depth() == 0)   # 0 is in slow()
+    t0 = time.perf_counter()
+    for i in range(1, 10):
+        pipeline.process(None, dict(i=i))
+    # never waits for the stage
+    assert time.perf_counter() - t0 < 0.05
+    gate.set()
+    assert wait_for(lambda: stage.n_processed == 3)
+    pipeline.stop()
+    # the newest frames survive
+    assert seen == [0, 8, 9]
+    assert stage.n_in == 10 and stage.n_dropped == 7
+    assert pipeline.n_dropped == 7
+
+
+def test_block_policy_timeout():
+    pipeline = FramePipeline()
+    gate = threading.Event()
+    stage = pipeline.add_stage('slow', lambda img, info: gate.wait(2.0), threaded=True,
+                               queue_size=1, policy='block', block_timeout=0.02)
+    pipeline.start()
+    pipeline.process(None, dict())
+    assert wait_for(lambda: stage.queue_depth() == 0)
+    pipeline.process(None, dict())      # queued
+    t0 = time.perf_counter()
+    pipeline.process(None, dict())      # waits block_timeout, then dropped
+    dt = time.perf_counter() - t0
+    gate.set()
+    pipeline.stop()
+    assert 0.015 < dt < 0.5
+    assert stage.n_dropped == 1
+
+
+def test_errors_counted():
+    pipeline = FramePipeline()
+    stage = pipeline.add_stage('bad', lambda img, info: 1/0)
+    below = pipeline.add_stage('below', lambda img, info: None, after='bad')
+    for i in range(3):
+        pipeline.process(None, dict())
+    assert stage.n_errors == 3 and isinstance(stage.last_error, ZeroDivisionError)
+    assert below.n_in == 0
+    pipeline.reset_stats()
+    assert stage.stats()['errors'] == 0 and stage.last_error is None
+
+
+def test_counters_with_workers():
+    pipeline = FramePipeline()
+    stage = pipeline.add_stage('work', lambda img, info: time.sleep(0.0002), threaded=True,
+                               n_workers=4, queue_size=8)
+    pipeline.start()
+    for i in range(500):
+        pipeline.process(None, dict())
+    assert wait_for(lambda: stage.queue_depth() == 0)
+    assert wait_for(lambda: stage.n_processed + stage.n_dropped == 500)
+    pipeline.stop()
+    assert stage.n_in == 500
+
+
+def test_remove_stage():
+    pipeline = FramePipeline()
+    pipeline.add_stage('a', lambda img, info: img, threaded=True)
+    pipeline.add_stage('b', lambda img, info: None, after='a')
+    pipeline.start()
+    stage = pipeline.stages['a']
+    assert stage.workers
+    pipeline.remove_stage('a')
+    assert pipeline.stages == {} and pipeline.roots == []
+    assert not stage.workers
+    with pytest.raises(KeyError):
+        pipeline.add_stage('c', lambda img, info: None, after='a')
+    pipeline.stop()
+
+
+def test_pipeline_retains_queued_frames():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(2, pool=pool)
+    pipeline = FramePipeline(pool=pool)
+    gate = threading.Event()
+    seen = []
+
+    def slow(img, info):
+        gate.wait(2.0)
+        seen.append((info['frame_id'], int(img[0, 0])))
+
+    pipeline.add_stage('crop', lambda img, info: img[1:3])
+    stage = pipeline.add_stage('slow', slow, after='crop', threaded=True,
+                               queue_size=16, policy='block')
+    pipeline.start()
+    for i in range(8):
+        img = pool.acquire((4, 6), np.uint16)
+        img[...] = i
+        ring.push(img)
+        pipeline.process(img, dict(frame_id=i))
+    gate.set()
+    t_end = time.perf_counter() + 2.0
+    while stage.n_processed < 8 and time.perf_counter() < t_end:
+        time.sleep(0.001)
+    pipeline.stop()
+    assert seen == [(i, i) for i in range(8)]
+    assert pool.num_free() == 6
+
+
+def test_pipeline_releases_dropped_frames():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(2, pool=pool)
+    pipeline = FramePipeline(pool=pool)
+    gate = threading.Event()
+    stage = pipeline.add_stage('slow', lambda img, info: gate.wait(2.0), threaded=True,
+                               queue_size=2)
+    pipeline.start()
+    frames = []
+    for i in range(8):
+        frames.append(pool.acquire((4, 6), np.uint16))
+        ring.push(frames[-1])
+        pipeline.process(frames[-1], dict())
+    gate.set()
+    pipeline.stop()
+    assert stage.n_dropped > 0
+    # only the ring's two slots still hold frames
+    buffers = {id(f): f for f in frames}.values()
+    assert sum(pool.refcount(f) for f in buffers) == 2
+
@@ -0,0 +1,104 @@
+"Raw frame container: header, index sidecar and memory-mapped reads of simulated camera frames"
+import json
+import os
+
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_interface import FlirCamInterface
+from ScopeFoundryHW.flircam.flircam_raw_file import (HEADER_SIZE, INDEX_DTYPE, MAGIC,
+                                                     RawFrameReader, RawFrameWriter)
+from ScopeFoundryHW.flircam.flircam_sim_lib import SimSpinnakerLib
+
+
+@pytest.fixture
+def cam():
+    lib = SimSpinnakerLib(width=24, height=10, pixel_format='Mono16',
+                          frame_rate=None, realtime=False, seed=3)
+    cam = FlirCamInterface(lib=lib)
+    cam.start_acquisition()
+    yield cam
+    cam.stop_acquisition()
+    cam.release_camera()
+    cam.release_system()
+
+
+def record(cam, writer, n):
+    "writes n sim frames, returns copies of the frames and their info"
+    frames, infos = [], []
+    for i in range(n):
+        info = dict(host_time=100.0 + i)
+        img = cam.get_image(info=info, timeout=1.0)
+        writer.write(img, info)
+        frames.append(img.copy())
+        infos.append(info)
+        cam.frame_pool.release(img)
+    return np.array(frames), infos
+
+
+def test_round_trip(cam, tmp_path):
+    fname = str(tmp_path / 'rec.raw')
+    writer = RawFrameWriter(fname, pixel_format='Mono16')
+    writer.index_flush_frames = 4
+    frames, infos = record(cam, writer, 10)
+    writer.close()
+
+    nbytes = frames[0].nbytes
+    assert os.path.getsize(fname) == HEADER_SIZE + 10*nbytes
+    with open(fname, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    assert header.startswith(MAGIC)
+    desc = json.loads(header[len(MAGIC):].rstrip(b'\0').decode())
+    assert desc == dict(shape=[10, 24], dtype='<u2', pixel_format='Mono16',
+                        n_frames=10, header_size=HEADER_SIZE)
+
+    index = np.fromfile(fname + '.idx', dtype=INDEX_DTYPE)
+    assert list(index['offset']) == [HEADER_SIZE + i*nbytes for i in range(10)]
+    assert list(index['timestamp']) == [info['timestamp'] for info in infos]
+
+    reader = RawFrameReader(fname)
+    assert len(reader) == 10 and reader.pixel_format == 'Mono16'
+    assert isinstance(reader.frames, np.memmap)
+    assert reader[3].shape == (10, 24) and reader[3].dtype == np.uint16
+    assert np.array_equal(reader[:], frames)
+    assert np.array_equal(reader[2:7], frames[2:7])
+    assert list(reader.timestamps) == [info['timestamp'] for info in infos]
+    assert list(reader.host_times) == [100.0 + i for i in range(10)]
+    reader.close()
+
+
+def test_read_unclosed(cam, tmp_path):
+    # frames written so far are readable while recording, the header
+    # still has n_frames=0 and the index is only partially flushed
+    fname = str(tmp_path / 'rec.raw')
+    writer = RawFrameWriter(fname)
+    writer.index_flush_frames = 4
+    frames, infos = record(cam, writer, 6)
+    writer.f.flush()
+    reader = RawFrameReader(fname)
+    assert reader.desc['n_frames'] == 0
+    assert len(reader) == 6
+    assert np.array_equal(reader[:], frames)
+    assert len(reader.index) == 4
+    reader.close()
+    writer.close()
+    assert len(RawFrameReader(fname).index) == 6
+
+
+def test_shape_change(cam, tmp_path):
+    writer = RawFrameWriter(str(tmp_path / 'rec.raw'))
+    record(cam, writer, 2)
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((10, 16), dtype=np.uint16))
+    with pytest.raises(ValueError):
+        writer.write(np.zeros((10, 24), dtype=np.uint8))
+    writer.close()
+    assert len(RawFrameReader(writer.fname)) == 2
+
+
+def test_bad_magic(tmp_path):
+    fname = str(tmp_path / 'other.raw')
+    with open(fname, 'wb') as f:
+        f.write(b'\0'*2*HEADER_SIZE)
+    with pytest.raises(IOError):
+        RawFrameReader(fname)
@@ -0,0 +1,92 @@
+"HDF5 recording of simulated camera frames: frames, per-frame data and drop log"
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+pytest.importorskip('ScopeFoundry')
+
+from ScopeFoundryHW.flircam.flircam_chunk import CHUNK_DTYPE
+from ScopeFoundryHW.flircam.flircam_interface import FlirCamInterface
+from ScopeFoundryHW.flircam.flircam_record_measure import H5FrameSink, save_writer_stats
+from ScopeFoundryHW.flircam.flircam_sim_lib import SimSpinnakerLib
+from ScopeFoundryHW.flircam.flircam_writer import FrameWriterThread
+
+
+@pytest.fixture
+def cam():
+    lib = SimSpinnakerLib(width=32, height=16, pixel_format='Mono16',
+                          frame_rate=None, realtime=False, seed=2)
+    cam = FlirCamInterface(lib=lib)
+    cam.set_chunk_mode(True)
+    cam.start_acquisition()
+    yield cam
+    cam.stop_acquisition()
+    cam.release_camera()
+    cam.release_system()
+
+
+def grab(cam):
+    info = dict(host_time=1.5)
+    img = cam.get_image(info=info, timeout=1.0)
+    return img, info
+
+
+def test_h5_round_trip(cam, tmp_path):
+    fname = str(tmp_path / 'rec.h5')
+    with h5py.File(fname, 'w') as h5:
+        g = h5.create_group('m')
+        writer = FrameWriterThread(H5FrameSink(g, chunk_frames=4), pool=cam.frame_pool)
+        writer.start()
+        frames, infos = [], []
+        for i in range(12):
+            img, info = grab(cam)
+            if i in (3, 7, 8):
+                # lost before the writer, e.g. at a full queue
+                cam.frame_pool.release(img)
+                continue
+            frames.append(img.copy())
+            infos.append(info)
+            writer.put(img, info)
+            cam.frame_pool.release(img)
+        writer.stop(2.0)
+        assert writer.error is None
+        save_writer_stats(g, writer)
+
+    with h5py.File(fname, 'r') as h5:
+        g = h5['m']
+        assert g['frames'].shape == (9, 16, 32) and g['frames'].dtype == np.uint16
+        assert np.array_equal(g['frames'][:], np.array(frames))
+        ids = [info['frame_id'] for info in infos]
+        assert list(g['frame_id'][:]) == ids
+        assert list(g['timestamp'][:]) == [info['timestamp'] for info in infos]
+        assert (g['host_time'][:] == 1.5).all()
+        assert g['chunk'].dtype == CHUNK_DTYPE
+        assert list(g['chunk']['frame_id']) == ids
+        assert g.attrs['writer_written'] == 9 and g.attrs['writer_missing'] == 3
+        drop_log = g['drop_log'][:]
+        assert [(int(r['index']), int(r['frame_id']), int(r['n_missing'])) for r in drop_log] \
+            == [(3, ids[3], 1), (6, ids[6], 2)]
+
+
+# the writer thread ends with the sink's exception
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_h5_shape_change_mid_recording(cam, tmp_path):
+    with h5py.File(str(tmp_path / 'rec.h5'), 'w') as h5:
+        writer = FrameWriterThread(H5FrameSink(h5, chunk_frames=2), pool=cam.frame_pool)
+        writer.start()
+        for i in range(3):
+            img, info = grab(cam)
+            writer.put(img, info)
+            cam.frame_pool.release(img)
+        # narrower frames, e.g. from an ROI change
+        cam.set_roi(0, 0, 16, 16)
+        img, info = grab(cam)
+        assert img.shape == (16, 16)
+        writer.put(img, info)
+        cam.frame_pool.release(img)
+        writer.stop(2.0)
+        assert isinstance(writer.error, ValueError)
+        assert 'does not match recording' in str(writer.error)
+        # frames before the change are kept
+        assert h5['frames'].shape == (3, 16, 32)
+        assert cam.frame_pool.refcount(img) == 0
@@ -0,0 +1,112 @@
+"Shared memory frame ring, publisher and client in one process"
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_shm import FrameShmPublisher, FrameShmClient
+
+
+@pytest.fixture
+def name(request):
+    name = 'flircam_test_{}_{}'.format(os.getpid(), request.node.name[:20])
+    yield name
+    try:
+        shm = shared_memory.SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def frames(n, shape=(6, 10), dtype=np.uint16):
+    return [np.full(shape, i, dtype=dtype) for i in range(n)]
+
+
+def test_next(name):
+    pub = FrameShmPublisher(name, n_slots=4, slot_bytes=120)
+    client = FrameShmClient(name, mode='next')
+    assert client.get() is None
+    for i, img in enumerate(frames(3)):
+        assert pub.publish(img, dict(frame_id=100 + i, timestamp=i*1000)) == i
+    for i in range(3):
+        seq, frame, meta = client.get()
+        assert seq == i
+        assert frame.shape == (6, 10) and frame.dtype == np.uint16
+        assert (frame == i).all()
+        assert meta['frame_id'] == 100 + i and meta['timestamp'] == i*1000
+    assert client.get() is None
+    client.close()
+    pub.close()
+
+
+def test_overwritten_frames_are_missed(name):
+    pub = FrameShmPublisher(name, n_slots=4, slot_bytes=120)
+    client = FrameShmClient(name, mode='next')
+    for img in frames(10):
+        pub.publish(img)
+    seqs = [client.get()[0] for i in range(4)]
+    assert seqs == [6, 7, 8, 9]
+    assert client.n_missed == 6
+    client.close()
+    pub.close()
+
+
+def test_latest(name):
+    pub = FrameShmPublisher(name, n_slots=4, slot_bytes=120)
+    client = FrameShmClient(name, mode='latest')
+    for img in frames(3):
+        pub.publish(img)
+    seq, frame, meta = client.get()
+    assert seq == 2 and (frame == 2).all()
+    assert client.n_skipped == 2
+    assert client.get() is None
+    client.close()
+    pub.close()
+
+
+def test_zero_copy_view(name):
+    pub = FrameShmPublisher(name, n_slots=2, slot_bytes=120)
+    client = FrameShmClient(name)
+    pub.publish(frames(1)[0])
+    seq, view, meta = client.get(copy=False)
+    assert client.is_current(meta)
+    for img in frames(2):
+        pub.publish(img + 7)
+    # the slot was written again
+    assert not client.is_current(meta)
+    del view
+    client.close()
+    pub.close()
+
+
+def test_oversize_dropped(name):
+    pub = FrameShmPublisher(name, n_slots=2, slot_bytes=100)
+    assert pub.publish(np.zeros((6, 10), np.uint16)) is None
+    assert pub.n_oversize == 1
+    assert pub.publish(np.zeros((5, 10), np.uint16)) == 0
+    pub.close()
+
+
+def test_closed(name):
+    pub = FrameShmPublisher(name, n_slots=2, slot_bytes=100)
+    client = FrameShmClient(name)
+    pub.close()
+    assert client.closed
+    assert client.wait(timeout=1.0) is None
+    client.close()
+
+
+def test_stale_block(name):
+    # left behind by a process that did not close its publisher
+    stale = shared_memory.SharedMemory(name=name, create=True, size=4096)
+    stale.close()
+    with pytest.raises(FileExistsError):
+        FrameShmPublisher(name, n_slots=2, slot_bytes=120)
+    pub = FrameShmPublisher(name, n_slots=2, slot_bytes=120, replace=True)
+    client = FrameShmClient(name)
+    pub.publish(frames(2)[1])
+    seq, frame, meta = client.get()
+    assert (frame == 1).all()
+    client.close()
+    pub.close()
@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_spot import SpotAnalyzer, SpotHistory
+
+
+def reference(img, background=0, roi=None):
+    "centroid and sigmas with plain float64 numpy"
+    h, w = img.shape
+    x0, y0, rw, rh = roi if roi is not None else (0, 0, w, h)
+    sub = img[y0:y0+rh, x0:x0+rw].astype(np.float64)
+    I = np.maximum(sub - background, 0)
+    yy, xx = np.mgrid[y0:y0+rh, x0:x0+rw]
+    m0 = I.sum()
+    cx = (I*xx).sum()/m0
+    cy = (I*yy).sum()/m0
+    sx = np.sqrt((I*(xx - cx)**2).sum()/m0)
+    sy = np.sqrt((I*(yy - cy)**2).sum()/m0)
+    cxy = (I*(xx - cx)*(yy - cy)).sum()/m0
+    return m0, cx, cy, sx, sy, cxy
+
+
+def gaussian_frame(dtype, h=200, w=300, cx=170.3, cy=80.6, sx=9.0, sy=5.0, level=50, peak=1000):
+    yy, xx = np.mgrid[0:h, 0:w]
+    g = level + peak*np.exp(-((xx - cx)**2/(2*sx**2) + (yy - cy)**2/(2*sy**2)))
+    return np.round(g).astype(dtype)
+
+
+def assert_matches(r, ref, rtol=1e-6):
+    m0, cx, cy, sx, sy, cxy = ref
+    assert r.sum == pytest.approx(m0, rel=rtol)
+    assert r.x == pytest.approx(cx, rel=rtol)
+    assert r.y == pytest.approx(cy, rel=rtol)
+    assert r.sigma_x == pytest.approx(sx, rel=rtol)
+    assert r.sigma_y == pytest.approx(sy, rel=rtol)
+    assert r.cov_xy == pytest.approx(cxy, rel=rtol, abs=1e-6)
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.uint16])
+@pytest.mark.parametrize('background', [0, 100, 49.5])
+def test_full_frame(dtype, background):
+    peak = 200 if dtype == np.uint8 else 1000
+    img = gaussian_frame(dtype, peak=peak)
+    r = SpotAnalyzer(background=background, block_rows=16)(img)
+    assert_matches(r, reference(img, background))
+
+
+def test_square_spot_below_background():
+    # pixels below the background must clip to 0, not wrap around
+    img = np.full((100, 128), 50, dtype=np.uint16)
+    img[40:50, 60:70] = 1000
+    r = SpotAnalyzer(background=100)(img)
+    assert r.sum == 100*900
+    assert (r.x, r.y) == (64.5, 44.5)
+    assert_matches(r, reference(img, 100))
+
+
+@pytest.mark.parametrize('background', [0, 100])
+def test_roi(background):
+    img = gaussian_frame(np.uint16)
+    roi = (140, 60, 70, 45)
+    r = SpotAnalyzer(background=background)(img, roi=roi)
+    assert r.roi == roi
+    assert_matches(r, reference(img, background, roi))
+
+
+@pytest.mark.parametrize('background', [0, 100])
+def test_coarse_to_fine(background):
+    img = gaussian_frame(np.uint16, level=0 if background == 0 else 50)
+    r = SpotAnalyzer(background=background, coarse_ds=4)(img)
+    # fine window: the reference on the window the analyzer chose
+    assert r.roi[2] < img.shape[1] and r.roi[3] < img.shape[0]
+    assert_matches(r, reference(img, background, r.roi))
+    full = reference(img, background)
+    assert r.x == pytest.approx(full[1], abs=0.05)
+    assert r.y == pytest.approx(full[2], abs=0.05)
+
+
+def test_focus_metrics():
+    img = gaussian_frame(np.uint16)
+    f = img.astype(np.float64)
+    gx = np.diff(f, axis=1)[:-1]
+    gy = np.diff(f, axis=0)[:, :-1]
+    r = SpotAnalyzer(focus_metric='gradient', block_rows=7)(img)
+    assert r.focus == pytest.approx((gx**2 + gy**2).mean(), rel=1e-5)
+    lap = f[:-2, 1:-1] + f[2:, 1:-1] + f[1:-1, :-2] + f[1:-1, 2:] - 4*f[1:-1, 1:-1]
+    r = SpotAnalyzer(focus_metric='laplacian', block_rows=7)(img)
+    assert r.focus == pytest.approx(lap.var(), rel=1e-5)
+
+
+def test_empty_frame():
+    r = SpotAnalyzer(background=10)(np.zeros((20, 20), dtype=np.uint8))
+    assert r.sum == 0 and np.isnan(r.x)
+
+
+def test_history_ring():
+    hist = SpotHistory(4)
+    r = SpotAnalyzer()(gaussian_frame(np.uint16))
+    for i in range(6):
+        hist.append(r, float(i), i)
+    data = hist.get()
+    assert list(data['t']) == [2, 3, 4, 5]
+    assert list(data['frame_id']) == [2, 3, 4, 5]
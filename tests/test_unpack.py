@@ -0,0 +1,100 @@
+"Unpackers against the PFNC and GigE Vision packed layouts"
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_unpack import (UNPACK_LAYOUTS, get_unpacker,
+                                                   packed_nbytes)
+
+
+def pack_lsb_first(pixels, bits):
+    "PFNC Mono10p/Mono12p: one little endian bit stream, first pixel in the lowest bits"
+    n = len(pixels)
+    per_group = 2 if bits == 12 else 4
+    n_bytes = per_group*bits//8
+    out = bytearray()
+    for g in range(0, n, per_group):
+        v = 0
+        for i, p in enumerate(pixels[g:g+per_group]):
+            v |= int(p) << (bits*i)
+        out += v.to_bytes(n_bytes, 'little')
+    return np.frombuffer(bytes(out), dtype=np.uint8)
+
+
+def pack_gige(pixels, bits):
+    """
+    GigE Vision Mono10Packed/Mono12Packed: bytes 0 and 2 hold the most
+    significant 8 bits of pixel 0 and 1, byte 1 their low bits (pixel 0
+    in bits 0.., pixel 1 in bits 4..). A last single pixel takes 2 bytes.
+    """
+    low = bits - 8
+    mask = (1 << low) - 1
+    out = bytearray()
+    for p0, p1 in zip(pixels[0::2], pixels[1::2]):
+        p0, p1 = int(p0), int(p1)
+        out += bytes([p0 >> low, (p0 & mask) | ((p1 & mask) << 4), p1 >> low])
+    if len(pixels) % 2:
+        p0 = int(pixels[-1])
+        out += bytes([p0 >> low, p0 & mask])
+    return np.frombuffer(bytes(out), dtype=np.uint8)
+
+
+FORMATS = [('Mono12p', 12, pack_lsb_first),
+           ('Mono10p', 10, pack_lsb_first),
+           ('Mono12Packed', 12, pack_gige),
+           ('Mono10Packed', 10, pack_gige)]
+
+
+@pytest.mark.parametrize('pixel_format, bits, pack', FORMATS)
+def test_unpack(pixel_format, bits, pack):
+    rng = np.random.default_rng(1)
+    h, w = 6, 16
+    pixels = rng.integers(0, 1 << bits, h*w, dtype=np.uint16)
+    # the extreme values of every bit field
+    pixels[:8] = [0, (1 << bits) - 1, 1, 1 << (bits - 1), 0x0F, 0xF0, 0x300 >> (12 - bits), 0x5A]
+    packed = pack(pixels, bits)
+    assert packed.size == packed_nbytes(pixel_format, h*w)
+    assert UNPACK_LAYOUTS[pixel_format][0] == bits
+
+    out = np.zeros((h, w), dtype=np.uint16)
+    unpack = get_unpacker(pixel_format)
+    unpack(packed, out)
+    assert np.array_equal(out.ravel(), pixels)
+    # scratch reused on the next frame
+    out2 = np.zeros((h, w), dtype=np.uint16)
+    unpack(pack(pixels[::-1].copy(), bits), out2)
+    assert np.array_equal(out2.ravel(), pixels[::-1])
+
+
+@pytest.mark.parametrize('pixel_format, bits, pack', FORMATS)
+def test_unpack_padded_buffer(pixel_format, bits, pack):
+    # trailing bytes after the frame (buffer padding) are ignored
+    pixels = np.arange(32, dtype=np.uint16) * 7 % (1 << bits)
+    packed = np.concatenate((pack(pixels, bits), np.full(9, 0xFF, np.uint8)))
+    out = np.empty((4, 8), dtype=np.uint16)
+    get_unpacker(pixel_format)(packed, out)
+    assert np.array_equal(out.ravel(), pixels)
+
+
+@pytest.mark.parametrize('pixel_format, bits, pack', FORMATS)
+@pytest.mark.parametrize('shape', [(3, 5), (2, 3), (1, 1)])
+def test_unpack_partial_group(pixel_format, bits, pack, shape):
+    # pixel count not a multiple of the group, the last group is cut
+    # after the last byte its pixels use
+    n = shape[0]*shape[1]
+    pixels = (np.arange(n, dtype=np.uint16)*613 + (1 << bits) - 1) % (1 << bits)
+    nbytes = packed_nbytes(pixel_format, n)
+    if pack is pack_lsb_first:
+        # the bit stream padded to whole bytes
+        assert nbytes == -(-n*bits//8)
+    packed = pack(pixels, bits)[:nbytes]
+    out = np.zeros(shape, dtype=np.uint16)
+    unpack = get_unpacker(pixel_format)
+    unpack(packed, out)
+    assert np.array_equal(out.ravel(), pixels)
+    with pytest.raises(ValueError):
+        unpack(packed[:-1], out)
+
+
+def test_not_packed():
+    assert get_unpacker('Mono8') is None
+    assert get_unpacker('Mono16') is None
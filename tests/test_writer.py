@@ -0,0 +1,71 @@
+"FrameWriterThread queueing and frame ownership"
+import threading
+import numpy as np
+import pytest
+
+from ScopeFoundryHW.flircam.flircam_frame_pool import FramePool
+from ScopeFoundryHW.flircam.flircam_frame_ring import FrameRing
+from ScopeFoundryHW.flircam.flircam_writer import FrameWriterThread
+
+
+def test_writer_retains_queued_frames():
+    pool = FramePool(max_free=16)
+    ring = FrameRing(2, pool=pool)
+    gate = threading.Event()
+    written = []
+
+    class Sink(object):
+        def write(self, img, info):
+            gate.wait(2.0)
+            written.append((info['frame_id'], int(img[0, 0])))
+
+        def close(self):
+            pass
+
+    writer = FrameWriterThread(Sink(), queue_size=16, pool=pool)
+    writer.start()
+    for i in range(8):
+        img = pool.acquire((4, 6), np.uint16)
+        img[...] = i
+        ring.push(img)
+        writer.put(img, dict(frame_id=i))
+    gate.set()
+    writer.stop(2.0)
+    # frames were not reused while they waited in the queue
+    assert written == [(i, i) for i in range(8)]
+    assert pool.num_free() == 6
+
+
+# the writer thread ends with the sink's exception
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_writer_releases_frames_on_sink_error():
+    pool = FramePool(max_free=16)
+    gate = threading.Event()
+    written = []
+
+    class Sink(object):
+        def write(self, img, info):
+            gate.wait(2.0)
+            if len(written) == 2:
+                raise IOError('disk full')
+            written.append(info['frame_id'])
+
+        def close(self):
+            pass
+
+    writer = FrameWriterThread(Sink(), queue_size=16, pool=pool)
+    writer.start()
+    frames = []
+    for i in range(6):
+        frames.append(pool.acquire((4, 6), np.uint16))
+        writer.put(frames[-1], dict(frame_id=i))
+        pool.release(frames[-1])    # the writer holds the only reference
+    gate.set()
+    writer.stop(2.0)
+    assert isinstance(writer.error, IOError)
+    assert written == [0, 1]
+    # the failed frame and the ones still queued went back to the pool
+    assert all(pool.refcount(f) == 0 for f in frames)
+    assert pool.num_free() == 6
+    assert writer.n_dropped == 3
+    assert not writer.put(pool.acquire((4, 6), np.uint16), dict(frame_id=6))